@@ -20,6 +20,35 @@ import defragger
 import firstfit
 import logging
 import math
+import multiprocessing
+import pickle
+import config
+
+# The state of each process of the pool used by Defragger_BF (it is set by _init_pool_process when the process starts)
+_pool_process = {}
+
+def _init_pool_process(defragger_bf, snapshot, filtered_destination_candidate_hosts, fixed_vms):
+    '''
+    Initializer of the processes of the pool used by Defragger_BF: each process receives the defragger and the snapshot of
+        the HostsInfo structure once (if the process is forked, they are inherited instead of pickled)
+    '''
+    _pool_process['defragger'] = defragger_bf
+    _pool_process['hosts_info'] = defragger.HostsInfo.from_snapshot(snapshot)
+    _pool_process['destinations'] = filtered_destination_candidate_hosts
+    _pool_process['fixed_vms'] = fixed_vms
+    _pool_process['migrations'] = 0
+
+def _evaluate_hosts_to_empty(args):
+    '''
+    Entry point for the processes of the pool used by Defragger_BF: makes the migrations of the plan that the process has
+        not made yet in its HostsInfo structure and evaluates a chunk of the hosts to empty
+    '''
+    (migrations, hosts_to_empty) = args
+    hosts_info = _pool_process['hosts_info']
+    for migration in migrations[_pool_process['migrations']:]:
+        hosts_info.make_movement(migration)
+    _pool_process['migrations'] = len(migrations)
+    return _pool_process['defragger']._evaluate_hosts_to_empty(hosts_info, hosts_to_empty, _pool_process['destinations'], _pool_process['fixed_vms'])
 
 class MigrationList_Length():
     def _reevaluate_migration_lists(self, hosts_info, possible_migration_lists):
@@ -33,9 +62,15 @@ class MigrationList_Variance():
 
     def _reevaluate_migration_lists(self, hosts_info, possible_migration_lists):
         for evaluated_migration_list in possible_migration_lists:
+
+            # If the running sums of the resources are tracked, the variance is calculated only from the hosts involved in the list
+            S_2 = hosts_info.variance_after_migrations(evaluated_migration_list.migration_list)
+            if S_2 is not None:
+                evaluated_migration_list.reward = -S_2
+                continue
             
-            # We clone the hosts_info data structure to simmulate the list of migrations
-            working_hosts_info = hosts_info.clone()
+            # We use an overlay of the hosts_info data structure to simmulate the list of migrations
+            working_hosts_info = hosts_info.overlay()
             self._make_migrations(working_hosts_info, evaluated_migration_list.migration_list)
             
             # Now we calculate the standard deviation of the resources after the migrations and set it as reward for the list,
@@ -87,34 +122,90 @@ class Defragger_BF(firstfit.Defragger_FF):
         '''
 
         # self.__class__.__bases__[0].refilter_possible_destinations(self, hosts_info, current_node_id, filtered_hosts_to_empty, vm_migration_list)
+
+    def _evaluate_hosts_to_empty(self, hosts_info, hosts_to_empty, filtered_destination_candidate_hosts, fixed_vms):
+        '''
+        @return the list of acceptable migration lists for each of the hosts in hosts_to_empty (in the same order). Each host is
+            evaluated on its own, without considering the movements for the other hosts.
+            * if the time budget expires, only the hosts evaluated so far are returned
+        '''
+        migration_lists = []
+        for current_node_id in hosts_to_empty:
+            if (len(migration_lists) > 0) and self._time_budget_expired():
+                break
+
+            # * 3 we re-schedule the vms from the host
+            migration_list = self.schedule_vms_from_host(hosts_info.overlay(), current_node_id, filtered_destination_candidate_hosts, fixed_vms, True)
+
+            # We check whether the migration is acceptable because we are First-fitting just in case that we can empty the node
+            migration_lists.append(self.filter_migrations_for_host(hosts_info, current_node_id, migration_list))
+        return migration_lists
+
+    def _create_pool(self, processes, hosts_info, filtered_destination_candidate_hosts, fixed_vms):
+        '''
+        @return a pool of processes that start from the current state of hosts_info, or None if the defragger cannot be
+            shipped to the processes (then the hosts are evaluated in the main process)
+        '''
+        try:
+            return multiprocessing.Pool(processes, _init_pool_process, (self, hosts_info.snapshot(), filtered_destination_candidate_hosts, fixed_vms))
+        except pickle.PicklingError as e:
+            logging.warning("could not create the pool of processes (%s), so the hosts are evaluated in the main process" % e)
+            return None
+
+    def _evaluate_hosts_to_empty_in_pool(self, pool, processes, migration_plan, hosts_to_empty):
+        '''
+        Makes the same than _evaluate_hosts_to_empty, but the hosts are split in chunks that are evaluated in the processes of
+            the pool (each process has its own HostsInfo structure, so only the migrations made since the pool was created are
+            shipped with the chunks)
+        '''
+        migrations = [ migration for migration_list in migration_plan for migration in migration_list ]
+        chunk_size = int(math.ceil(len(hosts_to_empty) / float(processes)))
+        chunks = [ hosts_to_empty[i:i + chunk_size] for i in range(0, len(hosts_to_empty), chunk_size) ]
+        results = pool.map(_evaluate_hosts_to_empty, [ (migrations, chunk) for chunk in chunks ])
+
+        migration_lists = []
+        for result in results:
+            migration_lists.extend(result)
+        return migration_lists
     
     def defrag(self, _hosts_info, hosts_fixed = [], fixed_vms = []):
+        self._start_time_budget()
+
         # First of all we create a copy to not to modify the original structure
         hosts_info = _hosts_info.clone()
         hosts_info.normalize_resources()
         
         hosts_to_empty = [ x for x in _hosts_info.keys() if x not in hosts_fixed ]
         
-        migration_plan = []
-        
         # * 1 we filter the list to remove those hosts that are disabled in config, etc.
         filtered_hosts_to_empty = self.filter_hosts_to_empty(hosts_info, hosts_to_empty, fixed_vms)
         filtered_destination_candidate_hosts = self.prefilter_possible_destinations(hosts_info)
 
+        # The evaluation of the hosts to empty is independent for each host, so it can be made in a pool of processes (that
+        #   are created for each defrag, because they start from the state of hosts_info)
+        processes = config.config_vmca.DEFRAGGER_PROCESSES
+        pool = None
+        if (processes > 1) and (len(filtered_hosts_to_empty) > processes):
+            pool = self._create_pool(processes, hosts_info, filtered_destination_candidate_hosts, fixed_vms)
+
+        try:
+            return self._defrag_loop(hosts_info, filtered_hosts_to_empty, filtered_destination_candidate_hosts, fixed_vms, pool, processes)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def _defrag_loop(self, hosts_info, filtered_hosts_to_empty, filtered_destination_candidate_hosts, fixed_vms, pool, processes):
+        migration_plan = []
         continue_moving = True
         while continue_moving:
 
-            possible_migration_lists = []
-            
-            for current_node_id in filtered_hosts_to_empty:
-                
-                # * 3 we re-schedule the vms from the host
-                migration_list = self.schedule_vms_from_host(hosts_info.clone(), current_node_id, filtered_destination_candidate_hosts, fixed_vms, True)
-    
-                # We check whether the migration is acceptable because we are First-fitting just in case that we can empty the node
-                migration_list = self.filter_migrations_for_host(hosts_info, current_node_id, migration_list)
-                if len(migration_list) > 0:
-                    possible_migration_lists.append(defragger.Evaluated_VMMigration_List(migration_list))
+            if (pool is not None) and (len(filtered_hosts_to_empty) > processes):
+                migration_lists = self._evaluate_hosts_to_empty_in_pool(pool, processes, migration_plan, filtered_hosts_to_empty)
+            else:
+                migration_lists = self._evaluate_hosts_to_empty(hosts_info, filtered_hosts_to_empty, filtered_destination_candidate_hosts, fixed_vms)
+
+            possible_migration_lists = [ defragger.Evaluated_VMMigration_List(migration_list) for migration_list in migration_lists if len(migration_list) > 0 ]
                 
             # First we correct the costs and rewards of the possible migration lists (e.g. more reward if a migration gets a node empty or
             # more cost if it implies powering on a node)
@@ -129,7 +220,7 @@ class Defragger_BF(firstfit.Defragger_FF):
                     
             # The current_node_id is now None, because is a migration list that "does not obbey to empty one host"
             filtered_hosts_to_empty = self.refilter_hosts_to_empty(hosts_info, None, filtered_hosts_to_empty, migration_list)
-            continue_moving = (len(migration_list) > 0)
+            continue_moving = (len(migration_list) > 0) and (not self._time_budget_expired())
 
         return migration_plan
     
@@ -189,6 +280,7 @@ class Defragger_Distribute(defragger.Defragger_Base):
         return distance_to_mean_before - distance_to_mean_after
 
     def defrag(self, _hosts_info, hosts_fixed = [], fixed_vms = []):
+        self._start_time_budget()
         hosts_info = _hosts_info.clone()
         hosts_info.normalize_resources()
         hosts_to_empty = [ x for x in _hosts_info.keys() if x not in hosts_fixed ]
@@ -200,18 +292,13 @@ class Defragger_Distribute(defragger.Defragger_Base):
         filtered_destination_candidate_hosts = self.prefilter_possible_destinations(hosts_info)
 
         # Now we'll calculate the mean of free resources (we want to homogeinize the distance to the mean)
-        r_total = 0.0
-        n_count = float(len(hosts_info.keys()))
-        for h_id in hosts_info.keys():
-            r_total += float(hosts_info.euclid_normalized_resources_free(h_id))
-
-        r_mean = r_total / n_count
+        r_mean = defragger.calc_mean(hosts_info)
 
         possible_migrable_vm = []
         for h_id, host in hosts_info.items():
             for vm in host.vm_list[:]:
                 if vm.id not in fixed_vms:
-                    vm_norm_res = hosts_info.calculate_euclid_normalized_resources(vm.memory, vm.cpu)
+                    vm_norm_res = hosts_info.calculate_euclid_normalized_resources(vm.memory, vm.cpu, vm.extra)
                     possible_migrable_vm.append((vm, vm_norm_res))
         
         possible_migrable_vm = sorted(possible_migrable_vm, key = lambda x: x[1], reverse=False)
@@ -230,8 +317,8 @@ class Defragger_Distribute(defragger.Defragger_Base):
 
                 # Now let's find one destination
                 possible_destinations = []
-                for h_id, host in hosts_info.items():
-                    if (not host.has_vm(vm)) and host.vm_can_fit(vm):
+                for h_id in hosts_info.filter_hosts_that_fit(hosts_info.keys(), vm):
+                    if not hosts_info[h_id].has_vm(vm):
 
                         # If moving the VM to the hosts makes that the distance to the mean is less, we'll consider the movement
                         enhancement = self._migration_enhancement(r_mean, hosts_info, h_id, -vm_norm_res)
@@ -248,6 +335,7 @@ class Defragger_Distribute(defragger.Defragger_Base):
                 fixed_vms.append(migration_selected.vmid)
                 migration_list.append(migration_selected)
                 self._make_migrations(hosts_info, [ migration_selected ])
+                continue_moving = not self._time_budget_expired()
             else:
                 continue_moving = False
 
@@ -262,6 +350,7 @@ class Defragger_Refill(defragger.Defragger_Base):
         return distance_to_mean_before - distance_to_mean_after
 
     def defrag(self, _hosts_info, hosts_fixed = [], fixed_vms = []):
+        self._start_time_budget()
         hosts_info = _hosts_info.clone()
         hosts_info.normalize_resources()
         hosts_to_empty = [ x for x in _hosts_info.keys() if x not in hosts_fixed ]
@@ -273,12 +362,7 @@ class Defragger_Refill(defragger.Defragger_Base):
         filtered_destination_candidate_hosts = self.prefilter_possible_destinations(hosts_info)
 
         # Now we'll calculate the mean of free resources (we want to homogeinize the distance to the mean)
-        r_total = 0.0
-        n_count = float(len(hosts_info.keys()))
-        for h_id in hosts_info.keys():
-            r_total += float(hosts_info.euclid_normalized_resources_free(h_id))
-
-        r_mean = r_total / n_count
+        r_mean = defragger.calc_mean(hosts_info)
 
         possible_migrable_vm = []
         hosts_resource_info = []
@@ -286,12 +370,12 @@ class Defragger_Refill(defragger.Defragger_Base):
             hosts_resource_info.append((h_id, hosts_info.euclid_normalized_resources_free(h_id)))
             for vm in host.vm_list[:]:
                 if vm.id not in fixed_vms:
-                    vm_norm_res = hosts_info.calculate_euclid_normalized_resources(vm.memory, vm.cpu)
+                    vm_norm_res = hosts_info.calculate_euclid_normalized_resources(vm.memory, vm.cpu, vm.extra)
                     possible_migrable_vm.append((vm, vm_norm_res))
         
         migration_list = []
         # for each host we'll try to move VMs to it, to get to the mean
-        while len(hosts_resource_info) > 0:
+        while (len(hosts_resource_info) > 0) and (not self._time_budget_expired()):
             h_id, free_resources = hosts_resource_info.pop(0)
             host = hosts_info[h_id]
 
@@ -336,6 +420,7 @@ class Defragger_Refill_Relative(defragger.Defragger_Base):
         return distance_to_mean_before - distance_to_mean_after
 
     def defrag(self, _hosts_info, hosts_fixed = [], fixed_vms = []):
+        self._start_time_budget()
         hosts_info = _hosts_info.clone()
         hosts_info.normalize_resources()
         hosts_to_empty = [ x for x in _hosts_info.keys() if x not in hosts_fixed ]
@@ -362,7 +447,7 @@ class Defragger_Refill_Relative(defragger.Defragger_Base):
             hosts_resource_info.append((h_id, hosts_info.euclid_normalized_resources_free_relative(h_id)))
             for vm in host.vm_list[:]:
                 if vm.id not in fixed_vms:
-                    vm_norm_res = hosts_info.calculate_euclid_normalized_resources(vm.memory, vm.cpu)
+                    vm_norm_res = hosts_info.calculate_euclid_normalized_resources(vm.memory, vm.cpu, vm.extra)
                     possible_migrable_vm.append((vm, vm_norm_res))
         
         # We'll sort the resources so as the one that has less free resources is tried to be filled first
@@ -372,7 +457,7 @@ class Defragger_Refill_Relative(defragger.Defragger_Base):
         
         migration_list = []
         # for each host we'll try to move VMs to it, to get to the mean
-        while len(hosts_resource_info) > 0:
+        while (len(hosts_resource_info) > 0) and (not self._time_budget_expired()):
             h_id, free_resources = hosts_resource_info.pop(0)
             host = hosts_info[h_id]
 
@@ -0,0 +1,433 @@
+# coding: utf-8
+#
+# Virtual Machine Consolidation Agent (VMCA)
+# Copyright (C) 2016 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import defragger
+import logging
+import math
+import bisect
+
+_EPSILON = 1e-9
+
+def l2_lower_bound(sizes, capacity):
+    '''
+    @return the L2 lower bound of Martello and Toth for the number of bins of the given capacity that are needed to pack
+        the items whose sizes are in the list (one dimension)
+    '''
+    if capacity <= 0:
+        return 0
+    sizes = sorted([ w for w in sizes if w > _EPSILON ], reverse = True)
+    if len(sizes) == 0:
+        return 0
+
+    best = 0
+    half = capacity / 2.0
+    for k in [ 0.0 ] + sorted(set([ w for w in sizes if w <= half + _EPSILON ])):
+        j1 = [ w for w in sizes if w > capacity - k + _EPSILON ]
+        j2 = [ w for w in sizes if (w <= capacity - k + _EPSILON) and (w > half + _EPSILON) ]
+        j3 = [ w for w in sizes if (w <= half + _EPSILON) and (w >= k - _EPSILON) ]
+        remaining = sum(j3) - (len(j2) * capacity - sum(j2))
+        bound = len(j1) + len(j2) + max(0, int(math.ceil(remaining / capacity - _EPSILON)))
+        best = max(best, bound)
+    return best
+
+def active_hosts_lower_bound(hosts_info):
+    '''
+    @return a lower bound for the number of hosts that are needed to host all the VMs in the hosts_info structure: the
+        greatest of the L2 bound for each dimension (using the greatest capacity of the hosts) and the number of hosts
+        with the greatest capacities that are needed to sum the resources of the VMs in each dimension
+    '''
+    vms = hosts_info.get_vms()
+    bound = 0
+    for resource_total, resource_vm in [ (lambda h: h.cpu_total, lambda vm: vm.cpu), (lambda h: h.memory_total, lambda vm: vm.memory) ]:
+        capacities = sorted([ resource_total(h) for h_id, h in hosts_info.items() ], reverse = True)
+        if len(capacities) == 0:
+            continue
+        demand = sum([ resource_vm(vm) for vm in vms ])
+        bound = max(bound, l2_lower_bound([ resource_vm(vm) for vm in vms ], capacities[0]))
+
+        count = 0
+        while (demand > _EPSILON) and (count < len(capacities)):
+            demand -= capacities[count]
+            count += 1
+        bound = max(bound, count)
+    return bound
+
+def _vm_type(vm):
+    # The VMs that need the same resources (including the additional ones) are interchangeable
+    return (vm.cpu, vm.memory, tuple(sorted(vm.extra.items())))
+
+class _Placement:
+    '''
+    The state of the search of the best placement: the VMs that can be moved, grouped by type, the number of VMs of each
+        type that are assigned to each host and the resources that are still free in the hosts
+
+    * the VMs with the same resources are interchangeable, so the search decides how many VMs of each type are placed
+      in each host and the number of migrations is obtained from the number of VMs of each type that stay in their host
+    * to avoid exploring permutations, the VMs of the same type are placed in the hosts following an order (the hosts
+      that originally had more VMs of the type come first)
+    '''
+    def __init__(self, hosts_info, filtered_hosts_to_empty, destinations):
+        self.hosts = hosts_info.keys()
+        self.n_hosts = len(self.hosts)
+
+        # The free resources of the hosts once the VMs that can be moved are taken out of them
+        self.free_cpu = []
+        self.free_memory = []
+        self.free_extra = []
+        self.count = []
+        self.active = []
+        self.movable_vms = []
+        for h_id in self.hosts:
+            h = hosts_info[h_id]
+            movable = (h_id in filtered_hosts_to_empty)
+            f_cpu = h.cpu_free
+            f_memory = h.memory_free
+            f_extra = h.extra_free.copy()
+            if movable:
+                for vm in h.vm_list:
+                    f_cpu += vm.cpu
+                    f_memory += vm.memory
+                    for name, amount in vm.extra.items():
+                        if name in f_extra:
+                            f_extra[name] += amount
+                    self.movable_vms.append(vm)
+            self.free_cpu.append(f_cpu)
+            self.free_memory.append(f_memory)
+            self.free_extra.append(f_extra)
+            pinned = 0
+            if not movable:
+                pinned = len(h.vm_list)
+            self.count.append(pinned)
+            self.active.append(pinned > 0)
+        self.maxvms = [ hosts_info[h_id].maxvms for h_id in self.hosts ]
+        self.max_cpu = float(max([ 1 ] + [ hosts_info[h_id].cpu_total for h_id in self.hosts ]))
+        self.max_memory = float(max([ 1 ] + [ hosts_info[h_id].memory_total for h_id in self.hosts ]))
+
+        # The types of VMs (the greatest first) and the number of VMs of each type that are originally in each host
+        self.types = sorted(set([ _vm_type(vm) for vm in self.movable_vms ]), key = lambda t: (max(t[0] / self.max_cpu, t[1] / self.max_memory), t), reverse = True)
+        self.t_index = dict([ (t, k) for k, t in enumerate(self.types) ])
+        self.h_index = dict([ (h_id, i) for i, h_id in enumerate(self.hosts) ])
+        self.original = [ [ 0 ] * len(self.types) for i in range(self.n_hosts) ]
+        for vm in self.movable_vms:
+            self.original[self.h_index[vm.hostname]][self.t_index[_vm_type(vm)]] += 1
+        self.assigned = [ [ 0 ] * len(self.types) for i in range(self.n_hosts) ]
+
+        self.items = []
+        for k in range(len(self.types)):
+            self.items += [ k ] * sum([ self.original[i][k] for i in range(self.n_hosts) ])
+        self.n_items = len(self.items)
+        # The position after the last VM of each type, and the VMs of each type that can still stay in their hosts
+        self.end_of_type = [ 0 ] * len(self.types)
+        for j, k in enumerate(self.items):
+            self.end_of_type[k] = j + 1
+        self.free_stays = [ sum([ self.original[i][k] for i in range(self.n_hosts) ]) for k in range(len(self.types)) ]
+
+        # The VMs of a type can be placed in the possible destinations or in the hosts in which there are VMs of that type
+        self.candidates = []
+        self.order = []
+        for k in range(len(self.types)):
+            self.candidates.append(sorted([ i for i in range(self.n_hosts) if (self.hosts[i] in destinations) or (self.original[i][k] > 0) ], key = lambda i: (-self.original[i][k], i)))
+            self.order.append(dict([ (i, position) for position, i in enumerate(self.candidates[k]) ]))
+
+        # The resources of the remaining VMs (from the item j to the end)
+        self.remaining_cpu = [ 0.0 ] * (self.n_items + 1)
+        self.remaining_memory = [ 0.0 ] * (self.n_items + 1)
+        for j in range(self.n_items - 1, -1, -1):
+            self.remaining_cpu[j] = self.remaining_cpu[j + 1] + self.types[self.items[j]][0]
+            self.remaining_memory[j] = self.remaining_memory[j + 1] + self.types[self.items[j]][1]
+
+        # The capacities of the inactive hosts, sorted, to calculate the lower bound of each node
+        self.inactive_cpu = sorted([ self.free_cpu[i] for i in range(self.n_hosts) if not self.active[i] ])
+        self.inactive_memory = sorted([ self.free_memory[i] for i in range(self.n_hosts) if not self.active[i] ])
+
+        self.active_count = len([ a for a in self.active if a ])
+        self.stays = 0
+        self.residual_cpu = sum([ self.free_cpu[i] for i in range(self.n_hosts) if self.active[i] ])
+        self.residual_memory = sum([ self.free_memory[i] for i in range(self.n_hosts) if self.active[i] ])
+
+    def _hosts_needed(self, excess, sorted_capacities):
+        needed = 0
+        i = len(sorted_capacities) - 1
+        while (excess > _EPSILON) and (i >= 0):
+            excess -= sorted_capacities[i]
+            needed += 1
+            i -= 1
+        if excess > _EPSILON:
+            return self.n_hosts + 1
+        return needed
+
+    def lower_bound(self, j):
+        '''
+        @return the minimum number of active hosts once the VMs from the item j to the end are placed
+        '''
+        extra_cpu = self._hosts_needed(self.remaining_cpu[j] - self.residual_cpu, self.inactive_cpu)
+        extra_memory = self._hosts_needed(self.remaining_memory[j] - self.residual_memory, self.inactive_memory)
+        return self.active_count + max(extra_cpu, extra_memory)
+
+    def min_migrations(self, j):
+        '''
+        @return the minimum number of VMs that will leave their hosts once the VMs from the item j to the end are placed
+        '''
+        max_future_stays = 0
+        if j < self.n_items:
+            k = self.items[j]
+            max_future_stays = min(self.end_of_type[k] - j, self.free_stays[k])
+            for k_next in range(k + 1, len(self.types)):
+                max_future_stays += self.free_stays[k_next]
+        return self.n_items - self.stays - max_future_stays
+
+    def fits(self, k, i):
+        (cpu, memory, extra) = self.types[k]
+        if (self.free_cpu[i] - cpu < -_EPSILON) or (self.free_memory[i] - memory < -_EPSILON):
+            return False
+        for name, amount in extra:
+            if (name in self.free_extra[i]) and (self.free_extra[i][name] - amount < -_EPSILON):
+                return False
+        return (self.maxvms[i] < 0) or (self.count[i] < self.maxvms[i])
+
+    def apply(self, k, i):
+        '''
+        Places a VM of the type k in the host i
+        '''
+        (cpu, memory, extra) = self.types[k]
+        if not self.active[i]:
+            self.active[i] = True
+            self.active_count += 1
+            self.inactive_cpu.pop(bisect.bisect_left(self.inactive_cpu, self.free_cpu[i] - _EPSILON))
+            self.inactive_memory.pop(bisect.bisect_left(self.inactive_memory, self.free_memory[i] - _EPSILON))
+            self.residual_cpu += self.free_cpu[i]
+            self.residual_memory += self.free_memory[i]
+        self.free_cpu[i] -= cpu
+        self.free_memory[i] -= memory
+        for name, amount in extra:
+            if name in self.free_extra[i]:
+                self.free_extra[i][name] -= amount
+        self.residual_cpu -= cpu
+        self.residual_memory -= memory
+        self.count[i] += 1
+        if self.assigned[i][k] < self.original[i][k]:
+            self.stays += 1
+            self.free_stays[k] -= 1
+        self.assigned[i][k] += 1
+
+    def undo(self, k, i):
+        '''
+        Takes out of the host i a VM of the type k that was placed by apply
+        '''
+        (cpu, memory, extra) = self.types[k]
+        self.assigned[i][k] -= 1
+        if self.assigned[i][k] < self.original[i][k]:
+            self.stays -= 1
+            self.free_stays[k] += 1
+        self.free_cpu[i] += cpu
+        self.free_memory[i] += memory
+        for name, amount in extra:
+            if name in self.free_extra[i]:
+                self.free_extra[i][name] += amount
+        self.residual_cpu += cpu
+        self.residual_memory += memory
+        self.count[i] -= 1
+        if self.count[i] == 0:
+            self.active[i] = False
+            self.active_count -= 1
+            self.residual_cpu -= self.free_cpu[i]
+            self.residual_memory -= self.free_memory[i]
+            bisect.insort(self.inactive_cpu, self.free_cpu[i])
+            bisect.insort(self.inactive_memory, self.free_memory[i])
+
+    def choices(self, j, first_position):
+        '''
+        @return the hosts in which the item j can be placed, in the order in which they have to be tried: the active hosts
+            first (those in which the VM would stay, and then the fullest ones) and then the inactive ones (only the first
+            of the hosts that have the same capacity and the same original VMs is tried)
+        '''
+        k = self.items[j]
+        active_hosts = []
+        inactive_hosts = {}
+        for i in self.candidates[k][first_position:]:
+            if not self.fits(k, i):
+                continue
+            stays = self.original[i][k] - self.assigned[i][k]
+            load = self.free_cpu[i] / self.max_cpu + self.free_memory[i] / self.max_memory
+            if self.active[i]:
+                active_hosts.append((stays > 0, -load, i))
+            else:
+                signature = (self.free_cpu[i], self.free_memory[i], tuple(sorted(self.free_extra[i].items())), self.maxvms[i], tuple(self.original[i]))
+                if signature not in inactive_hosts:
+                    inactive_hosts[signature] = (stays > 0, load, -self.order[k][i], i)
+        active_hosts.sort(reverse = True)
+        return [ i for (_, _, i) in active_hosts ] + [ i for (_, _, _, i) in sorted(inactive_hosts.values(), reverse = True) ]
+
+    def assignment(self):
+        '''
+        @return a dictionary vmid -> host for the VMs that leave their hosts in the current placement (the VMs of each type
+            that leave their hosts are placed in the hosts that receive VMs of that type)
+        '''
+        original = [ row[:] for row in self.original ]
+        leaving = [ [] for k in range(len(self.types)) ]
+        for vm in self.movable_vms:
+            i = self.h_index[vm.hostname]
+            k = self.t_index[_vm_type(vm)]
+            if self.assigned[i][k] < original[i][k]:
+                leaving[k].append(vm)
+                original[i][k] -= 1
+        assignment = {}
+        for i in range(self.n_hosts):
+            for k in range(len(self.types)):
+                for n in range(self.assigned[i][k] - min(self.assigned[i][k], original[i][k])):
+                    assignment[leaving[k].pop().id] = self.hosts[i]
+        return assignment
+
+class Defragger_BinPacking(defragger.Defragger_Base):
+    '''
+    Exact defragger that solves the consolidation as a vector bin-packing problem (cpu, memory and the additional
+        resources of the hosts) by means of branch-and-bound: the main objective is minimizing the number of hosts with
+        VMs and the secondary one is minimizing the number of migrations of the plan.
+
+    * the VMs of the hosts that cannot be emptied (fixed hosts, disabled hosts or hosts with fixed or unstable VMs)
+      stay in their hosts; the rest of VMs can be placed in their host or in any possible destination
+    * the lower bound of each node of the search is the number of active hosts plus the minimum number of hosts that
+      would be needed for the cpu and for the memory of the remaining VMs; the L2 bound is used at the root
+    * the VMs with the same resources and the empty hosts with the same capacity and the same original VMs are
+      interchangeable, so their permutations are not explored
+    * each placement found is compared by means of the migration plan that reaches it, so the migrations to intermediate
+      hosts that are needed to break the cycles are counted (and the placements that cannot be reached are discarded)
+    * the first incumbent is a greedy solution; the search stops when the number of nodes reaches max_nodes or the
+      time budget expires (see converged) and then the best plan found is used (which is never worse than keeping the
+      VMs where they are). The number of hosts is optimal when it equals the lower_bound attribute
+    '''
+    def __init__(self, max_nodes = 200000):
+        defragger.Defragger_Base.__init__(self)
+        self._max_nodes = max_nodes
+        self.nodes = 0
+        self.lower_bound = 0
+
+    def _possible_destinations(self, hosts_info):
+        destinations = self.prefilter_possible_destinations(hosts_info)
+        if self._can_use_empty_hosts_as_destination:
+            return destinations
+        return [ h_id for h_id in destinations if len(hosts_info[h_id].vm_list) > 0 ]
+
+    def defrag(self, _hosts_info, hosts_fixed = [], fixed_vms = []):
+        self._start_time_budget()
+        hosts_info = _hosts_info.clone()
+        hosts_info.normalize_resources()
+
+        hosts_to_empty = [ x for x in _hosts_info.keys() if x not in hosts_fixed ]
+        filtered_hosts_to_empty = set(self.filter_hosts_to_empty(hosts_info, hosts_to_empty, fixed_vms))
+        destinations = set(self._possible_destinations(hosts_info))
+
+        return self._solve(hosts_info, filtered_hosts_to_empty, destinations)
+
+    def _update_best(self, hosts_info, placement, best):
+        '''
+        Replaces the best plan found by the plan that reaches the current placement of the search, if it uses less hosts
+            or the same hosts with less migrations (the placements that the plan cannot reach are discarded)
+        '''
+        assignment = placement.assignment()
+        new_hosts_info = hosts_info.clone()
+        migration_plan = self._create_migration_plan(new_hosts_info, assignment)
+        for vmid, h_dst in assignment.items():
+            if new_hosts_info.get_vm_location(vmid) != h_dst:
+                return
+        migrations = sum([ len(migration_list) for migration_list in migration_plan ])
+        if (placement.active_count < best['active']) or ((placement.active_count == best['active']) and (migrations < best['migrations'])):
+            best.update({ 'active': placement.active_count, 'migrations': migrations, 'plan': migration_plan })
+
+    def _branch_and_bound(self, hosts_info, placement, best):
+        '''
+        Explores the placements of the VMs in depth, and updates best with the plans that improve it
+        @return True if the whole search space has been explored
+        '''
+        items = placement.items
+        n_items = placement.n_items
+        options = [ None ] * n_items
+        position = [ 0 ] * n_items
+        applied = [ None ] * n_items
+        depth = 0
+        if n_items > 0:
+            options[0] = placement.choices(0, 0)
+        while (depth >= 0) and (n_items > 0):
+            k = items[depth]
+            if applied[depth] is not None:
+                placement.undo(k, applied[depth])
+                applied[depth] = None
+
+            if position[depth] >= len(options[depth]):
+                depth -= 1
+                continue
+
+            if (self._max_nodes > 0) and (self.nodes >= self._max_nodes):
+                return False
+            if (self.nodes % 1000 == 0) and self._time_budget_expired():
+                return False
+
+            i = options[depth][position[depth]]
+            position[depth] += 1
+            placement.apply(k, i)
+            applied[depth] = i
+            self.nodes += 1
+
+            # The migrations to intermediate hosts are only known once the plan is created, so the bound only
+            #   considers the VMs that leave their hosts
+            bound = max(placement.lower_bound(depth + 1), self.lower_bound)
+            if (bound > best['active']) or ((bound == best['active']) and (placement.min_migrations(depth + 1) >= best['migrations'])):
+                continue
+
+            if depth + 1 == n_items:
+                self._update_best(hosts_info, placement, best)
+                continue
+
+            depth += 1
+            first_position = 0
+            if items[depth] == items[depth - 1]:
+                first_position = placement.order[items[depth]][applied[depth - 1]]
+            options[depth] = placement.choices(depth, first_position)
+            position[depth] = 0
+        return True
+
+    def _solve(self, hosts_info, filtered_hosts_to_empty, destinations):
+        '''
+        @return the migration plan that reaches the best placement found for the VMs that can be moved
+        '''
+        placement = _Placement(hosts_info, filtered_hosts_to_empty, destinations)
+
+        # The initial solution consists of keeping the VMs in their hosts
+        best = { 'active': len([ h_id for h_id in hosts_info.keys() if len(hosts_info[h_id].vm_list) > 0 ]), 'migrations': 0, 'plan': [] }
+        self.lower_bound = max(active_hosts_lower_bound(hosts_info), placement.active_count)
+        self.nodes = 0
+
+        # A greedy solution (each VM is placed in its preferred host, without backtracking) is used as the first incumbent
+        placed = []
+        for j in range(placement.n_items):
+            options_j = placement.choices(j, 0)
+            if len(options_j) == 0:
+                break
+            placement.apply(placement.items[j], options_j[0])
+            placed.append(options_j[0])
+        if len(placed) == placement.n_items:
+            self._update_best(hosts_info, placement, best)
+        for j in range(len(placed) - 1, -1, -1):
+            placement.undo(placement.items[j], placed[j])
+
+        if not self._branch_and_bound(hosts_info, placement, best):
+            self._converged = False
+            logging.debug("the search of the best placement has been stopped after %d nodes" % self.nodes)
+
+        logging.debug("best placement found uses %d hosts with %d migrations (lower bound: %d hosts)" % (best['active'], best['migrations'], self.lower_bound))
+        return best['plan']
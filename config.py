@@ -57,6 +57,7 @@ config_one = ONEConfig(
         "ONLY_TEMPLATES": "",
         "ONLY_GIDS": "",
         "ONLY_UIDS": "",
+        "MONITORING_CACHE_TIME": 5,
     },
     callback = ONEConfig.parse
 )
@@ -67,6 +68,19 @@ class VMCAConfig(cpyutils.config.Configuration):
         dlevel = str(self.DEBUG_LEVEL).lower()
         if dlevel not in ["error", "debug", "info" ]:
             self.DEBUG_LEVEL = "debug"
+        self.RESOURCES = [ x.strip().lower() for x in self.RESOURCES.split(",") if x.strip() != "" ]
+        # The weight of each additional resource is read from WEIGHT_<RESOURCE> (e.g. WEIGHT_DISK), as WEIGHT_CPU and WEIGHT_MEM
+        weights = cpyutils.config.Configuration("GENERAL", dict([ ("WEIGHT_%s" % name.upper(), 1) for name in self.RESOURCES ]))
+        self.RESOURCE_WEIGHTS = dict([ (name, weights.__dict__["WEIGHT_%s" % name.upper()]) for name in self.RESOURCES ])
+        # RACKS has the form "rack1:host1,host2;rack2:host3,host4" and it is converted to a dictionary host -> rack
+        racks = {}
+        for rack_def in [ x.strip() for x in self.RACKS.split(";") if x.strip() != "" ]:
+            if ":" not in rack_def:
+                continue
+            rack, hosts = rack_def.split(":", 1)
+            for host in [ x.strip() for x in hosts.split(",") if x.strip() != "" ]:
+                racks[host] = rack.strip()
+        self.RACKS = racks
 
 config_vmca = VMCAConfig(
     "GENERAL",
@@ -78,23 +92,35 @@ config_vmca = VMCAConfig(
         "MAX_SIMULTANEOUS_MIGRATIONS": 1,
         "MIGRATION_PLAN_FREQUENCY": 10,
         "DEFRAGGER_FREQUENCY": 10,
+        "DEFRAGGER_PROCESSES": 1,
+        "DEFRAGGER_TIME_BUDGET": 0,
+        "LOCAL_SEARCH_EVALUATIONS": 0,
         "DISABLED_HOSTS": "",
         "STABLE_TIME": 600,
         "WEIGHT_MEM": 1,
         "WEIGHT_CPU": 1,
+        "RESOURCES": "",
         "ENABLE_MIGRATION": False,
         "CONSIDER_VMS_STABLE_ON_STARTUP": False,
         "XMLRPC_PORT": 9999,
         "XMLRPC_HOST": "localhost",
         "MONITORIZATION_VALIDITY": 10,
+        "MONITORING_FREQUENCY": 0,
+        "REPAIR_MIGRATION_PLAN": True,
         "COOLDOWN_MIGRATION": 10,
         "MAX_MIGRATIONS_PER_HOST": 2,
+        "MAX_SIMULTANEOUS_MIGRATIONS_PER_HOST": 2,
+        "HOST_BANDWIDTH": 0,
+        "RACKS": "",
+        "UPLINK_BANDWIDTH": 0,
+        "MIGRATION_TIME_AS_COST": False,
         "MAX_MIGRATION_TIME": 300,
         "SPARE_MEMORY": 0,
         "SPARE_CPU": 0,
         "SPARE_MEMORY_PCT": 0,
         "SPARE_CPU_PCT": 0,
 	"ENABLE_DEFRAGGER": True,
+        "ENABLE_PROFILING": False,
     },
     callback = VMCAConfig.parse
 )
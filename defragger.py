@@ -20,20 +20,89 @@ import config
 import logging
 import copy
 import math
+import heapq
+import bisect
+import time
+import gzip
 import cpyutils.eventloop
+import profiling
 
-def calculate_euclid_resources(mem, cpu):
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The resources of the hosts are mirrored in numpy arrays (if available) to vectorize the operations that involve all the hosts
+USE_NUMPY = (numpy is not None)
+
+def calculate_euclid_resources(mem, cpu, extra = None):
+    '''
+    @param extra a dictionary with the (normalized) amount of the additional resources (see RESOURCES in the config). The
+        resources that are not in the dictionary are considered to be 0
+    '''
+    wm2 = (config.config_vmca.WEIGHT_MEM*mem)*(config.config_vmca.WEIGHT_MEM*mem)
+    wc2 = (config.config_vmca.WEIGHT_CPU*cpu)*(config.config_vmca.WEIGHT_CPU*cpu)
+    m2 = config.config_vmca.WEIGHT_MEM*config.config_vmca.WEIGHT_MEM
+    c2 = config.config_vmca.WEIGHT_CPU*config.config_vmca.WEIGHT_CPU
+    we2 = 0
+    e2 = 0
+    for name in config.config_vmca.RESOURCES:
+        w = config.config_vmca.RESOURCE_WEIGHTS[name]
+        if extra is not None:
+            we2 += (w*extra.get(name, 0))*(w*extra.get(name, 0))
+        e2 += w*w
+    return math.sqrt(wm2+wc2+we2)/math.sqrt(m2+c2+e2)
+
+def calculate_euclid_resources_v(mem, cpu, extra = None):
+    '''
+    Vectorized version of calculate_euclid_resources, for numpy arrays (extra is a dictionary of numpy arrays)
+    '''
     wm2 = (config.config_vmca.WEIGHT_MEM*mem)*(config.config_vmca.WEIGHT_MEM*mem)
     wc2 = (config.config_vmca.WEIGHT_CPU*cpu)*(config.config_vmca.WEIGHT_CPU*cpu)
     m2 = config.config_vmca.WEIGHT_MEM*config.config_vmca.WEIGHT_MEM
     c2 = config.config_vmca.WEIGHT_CPU*config.config_vmca.WEIGHT_CPU
-    return math.sqrt(wm2+wc2)/math.sqrt(m2+c2)
+    we2 = 0
+    e2 = 0
+    for name in config.config_vmca.RESOURCES:
+        w = config.config_vmca.RESOURCE_WEIGHTS[name]
+        if (extra is not None) and (name in extra):
+            we2 = we2 + (w*extra[name])*(w*extra[name])
+        e2 += w*w
+    return numpy.sqrt(wm2+wc2+we2)/math.sqrt(m2+c2+e2)
+
+def _variance_from_sums(r_sum, r_sum2, n_count):
+    r_mean = r_sum / n_count
+    return max(0.0, (r_sum2 / n_count) - (r_mean * r_mean))
+
+def calc_mean(hosts_info):
+    '''
+    Obtains the mean of the normalized free resources of the hosts
+    '''
+    if hosts_info._r_sum is not None:
+        return hosts_info._r_sum / float(len(hosts_info.keys()))
+
+    resources = hosts_info.get_resources_store()
+    if resources is not None:
+        return float(numpy.mean(resources.euclid_normalized_free(hosts_info._max_cpu, hosts_info._max_memory, hosts_info._max_extra)))
+
+    r_total = 0.0
+    n_count = float(len(hosts_info.keys()))
+    for h_id in hosts_info.keys():
+        r_total += float(hosts_info.euclid_normalized_resources_free(h_id))
+    return r_total / n_count
 
 def calc_variance(hosts_info):
     '''
     We can optimize these values, but for the sake of readingness, we are using the full calculation by now
+    (unless the running sums of the resources are being tracked or the resources store is available)
     '''
-    
+    if hosts_info._r_sum is not None:
+        return _variance_from_sums(hosts_info._r_sum, hosts_info._r_sum2, float(len(hosts_info.keys())))
+
+    resources = hosts_info.get_resources_store()
+    if resources is not None:
+        return float(numpy.var(resources.euclid_normalized_free(hosts_info._max_cpu, hosts_info._max_memory, hosts_info._max_extra)))
+
     r_total = 0.0
     n_count = float(len(hosts_info.keys()))
     for h_id in hosts_info.keys():
@@ -50,14 +119,59 @@ def calc_variance(hosts_info):
 
     return S_2
     
-class HostData:
-    def __init__(self, hostname, cpu, memory, keywords = {}):
+def _vm_fingerprint(vmid):
+    # The fingerprint of a VM in a host (the same criteria to identify the VMs than get_vm_byid)
+    return hash(str(vmid))
+
+def _host_fingerprint(h_id, placement_fingerprint):
+    return hash((h_id, placement_fingerprint))
+
+def open_csv(filename, mode = "r"):
+    '''
+    @description Opens a CSV file with the structure of the hosts. The files whose name ends in .gz are written
+        compressed with gzip, and the compressed files are detected when they are read (whatever their name is)
+    @param mode "r" to read the file or "w" to write it
+    @return the file object
+    '''
+    if mode.startswith("w"):
+        if filename.endswith(".gz"):
+            return gzip.open(filename, "wb")
+        return open(filename, "wt")
+
+    f = open(filename, "rb")
+    magic = f.read(2)
+    f.close()
+    if magic == "\x1f\x8b":
+        return gzip.open(filename, "rb")
+    return open(filename, "rt")
+
+# The dictionaries of keywords and additional resources are shared by the copies of the objects (and the objects that
+#   do not have them share these empty ones), so they must not be modified in place
+_NO_KEYWORDS = {}
+_NO_EXTRA = {}
+
+class HostData(object):
+    # The hosts and their VMs are copied each time that a structure is cloned or a host is modified in an overlay, so
+    #   they have no per-instance dictionary (the subclasses may add their own attributes, though)
+    __slots__ = [ 'hostname', 'cpu_free', 'cpu_total', 'memory_free', 'memory_total', 'extra_free', 'extra_total', 'vm_list',
+                  '_vm_index', 'placement_fingerprint', 'maxvms', 'norm_cpu_free', 'norm_cpu_total', 'norm_memory_free',
+                  'norm_memory_total', 'norm_resources_free', 'norm_resources_total', 'keywords' ]
+
+    def __init__(self, hostname, cpu, memory, keywords = None):
         self.hostname = hostname
         self.cpu_free = cpu
         self.cpu_total = cpu
         self.memory_free = memory
         self.memory_total = memory
+        # The additional resources of the host (e.g. disk or pci slots): name -> amount. The resources that the host does not
+        #   declare are not limited
+        self.extra_free = {}
+        self.extra_total = {}
         self.vm_list = []
+        # Index of the VMs in vm_list by their id (as str, the same criteria than get_vm_byid)
+        self._vm_index = {}
+        # The XOR of the fingerprints of the VMs in the host, that is maintained as the VMs are added and removed
+        self.placement_fingerprint = 0
         self.maxvms = -1
         self.norm_cpu_free = 0.0
         self.norm_cpu_total = 0.0
@@ -65,7 +179,9 @@ class HostData:
         self.norm_memory_total = 0.0
         self.norm_resources_free = 0.0
         self.norm_resources_total = 0.0
-        self.keywords = {}
+        self.keywords = _NO_KEYWORDS
+        if keywords is not None:
+            self.keywords = keywords
         
     def reduce_capacity(self, cpu, memory, cpu_pct = 0, memory_pct = 0):
         spare_cpu = max(cpu, math.ceil(float(self.cpu_total) * float(cpu_pct)/100.0))
@@ -75,6 +191,13 @@ class HostData:
         self.memory_free = max(0, self.memory_free - spare_mem)
         self.memory_total = max(0, self.memory_total - spare_mem)
         
+    def set_extra_resource(self, name, total):
+        '''
+        @description Sets the total amount of an additional resource of the host (the amount used by the VMs that it hosts is kept)
+        '''
+        self.extra_free[name] = self.extra_free.get(name, self.extra_total.get(name, 0)) + total - self.extra_total.get(name, 0)
+        self.extra_total[name] = total
+
     def norm_str(self):
         return "CPU: %.1f/%.1f; MEM: %.1f/%.1f" % (self.norm_cpu_free, self.norm_cpu_total, self.norm_memory_free, self.norm_memory_total)
         
@@ -87,10 +210,30 @@ class HostData:
             * it is not checked whether the vm has space or not
         """
         self.vm_list.append(vmdata)
+        self._vm_index[str(vmdata.id)] = vmdata
+        self.placement_fingerprint ^= _vm_fingerprint(vmdata.id)
         self.cpu_free -= vmdata.cpu
         self.memory_free -= vmdata.memory
+        for name, amount in vmdata.extra.items():
+            if name in self.extra_free:
+                self.extra_free[name] -= amount
         return True
 
+    def add_vms(self, vms):
+        """
+        @description Adds a list of vms to the host (as add_vm does for each of them, but at once)
+        """
+        for vmdata in vms:
+            self.vm_list.append(vmdata)
+            self._vm_index[str(vmdata.id)] = vmdata
+            self.placement_fingerprint ^= _vm_fingerprint(vmdata.id)
+            self.cpu_free -= vmdata.cpu
+            self.memory_free -= vmdata.memory
+            if len(vmdata.extra) > 0:
+                for name, amount in vmdata.extra.items():
+                    if name in self.extra_free:
+                        self.extra_free[name] -= amount
+
     def vm_can_fit(self, vmdata):
         """
         @description Checks whether a vm would meet any of the constraints of
@@ -98,13 +241,26 @@ class HostData:
         @param vmdata the VMData structure that is checked to fit the host
         @return True in case that the vm would meet any of the constraints
         """
+        if profiling.ENABLED:
+            profiling.count("vm_can_fit")
         cpu = self.cpu_free - vmdata.cpu
         memory = self.memory_free - vmdata.memory
         fits = (cpu >= 0 and memory >= 0)
         if fits and self.maxvms >= 0:
             fits = (len(self.vm_list) < self.maxvms)
+        if fits and (len(vmdata.extra) > 0):
+            fits = self.extra_can_fit(vmdata)
         return fits
 
+    def extra_can_fit(self, vmdata):
+        '''
+        @return True if the host has enough free amount of the additional resources that the vm needs
+        '''
+        for name, amount in vmdata.extra.items():
+            if (name in self.extra_free) and (self.extra_free[name] < amount):
+                return False
+        return True
+
     def remove_vm(self, vmdata):
         """
         @description Removes a VM from the host and returns the resources that
@@ -112,14 +268,19 @@ class HostData:
         @param vmdata the VMData structure that must be removed to the host
         @return True if the vm was in the host. False otherwise
         """
-        for vm in self.vm_list:
-            if vm.id == vmdata.id:
-                self.vm_list.remove(vm)
-                self.cpu_free += vmdata.cpu
-                self.memory_free += vmdata.memory
-                return True
+        vm = self._vm_index.get(str(vmdata.id), None)
+        if (vm is None) or (vm.id != vmdata.id):
+            return False
 
-        return False
+        del self._vm_index[str(vmdata.id)]
+        self.placement_fingerprint ^= _vm_fingerprint(vmdata.id)
+        self.vm_list.remove(vm)
+        self.cpu_free += vmdata.cpu
+        self.memory_free += vmdata.memory
+        for name, amount in vmdata.extra.items():
+            if name in self.extra_free:
+                self.extra_free[name] += amount
+        return True
 
     def has_vm(self, vmdata):
         """
@@ -127,11 +288,8 @@ class HostData:
         @param vmdata the VMData structure that must be removed to the host
         @return True if the vm was in the host. False otherwise
         """
-        for vm in self.vm_list:
-            if vm.id == vmdata.id:
-                return True
-
-        return False
+        vm = self._vm_index.get(str(vmdata.id), None)
+        return (vm is not None) and (vm.id == vmdata.id)
 
     def get_vm_byid(self, vmid):
         """
@@ -139,11 +297,7 @@ class HostData:
         @param vmid the id of the VM that is wanted to obtain
         @return the VM if the vm was in the host. None otherwise
         """
-        for vm in self.vm_list:
-            if str(vm.id) == str(vmid):
-                return vm
-
-        return None
+        return self._vm_index.get(str(vmid), None)
             
     def remove_any_vm(self):
         """
@@ -153,7 +307,10 @@ class HostData:
         for vmdata in self.vm_list:
             self.cpu_free += vmdata.cpu
             self.memory_free += vmdata.memory
+        self.extra_free = self.extra_total.copy()
         self.vm_list = []
+        self._vm_index = {}
+        self.placement_fingerprint = 0
         
     def __str__(self):
         """
@@ -168,114 +325,418 @@ class HostData:
     
     def clone(self):
         """
-        @description Provides a verbatim copy of the object
+        @description Provides a verbatim copy of the object (the VMs are also copied, but the keywords are shared)
+        @returns A copy of the object
+        """
+        new_host = self.shallow_clone()
+        new_host.vm_list = [ vm.clone() for vm in self.vm_list ]
+        new_host._vm_index = dict([ (str(vm.id), vm) for vm in new_host.vm_list ])
+        return new_host
+
+    def shallow_clone(self):
+        """
+        @description Provides a copy of the object that shares the VMs with it, so it can be used to modify the capacity
+            and the normalized values of the host, but not to add, remove or modify its VMs
         @returns A copy of the object
         """
-        return copy.deepcopy(self)
+        new_host = self.__class__.__new__(self.__class__)
+        new_host.hostname = self.hostname
+        new_host.cpu_free = self.cpu_free
+        new_host.cpu_total = self.cpu_total
+        new_host.memory_free = self.memory_free
+        new_host.memory_total = self.memory_total
+        new_host.extra_free = self.extra_free.copy()
+        new_host.extra_total = self.extra_total.copy()
+        new_host.vm_list = self.vm_list
+        new_host._vm_index = self._vm_index
+        new_host.placement_fingerprint = self.placement_fingerprint
+        new_host.maxvms = self.maxvms
+        new_host.norm_cpu_free = self.norm_cpu_free
+        new_host.norm_cpu_total = self.norm_cpu_total
+        new_host.norm_memory_free = self.norm_memory_free
+        new_host.norm_memory_total = self.norm_memory_total
+        new_host.norm_resources_free = self.norm_resources_free
+        new_host.norm_resources_total = self.norm_resources_total
+        new_host.keywords = self.keywords
+        # The attributes of the subclasses (e.g. the ID of the host in ONE)
+        if hasattr(self, '__dict__'):
+            new_host.__dict__.update(copy.deepcopy(self.__dict__))
+        return new_host
 
 class CannotNormalizeException(Exception): pass
 
+class HostsResources:
+    '''
+    Contiguous arrays with the resources of the hosts of a HostsInfo structure (one slot per host), that are used to vectorize
+    the operations that involve all the hosts (normalization, variance, which hosts can host a VM, etc.)
+
+    * the HostData objects are still the reference information: the store must be updated whenever they change (HostsInfo
+      does it when making movements)
+    '''
+    def __init__(self, hosts_info = None):
+        self.hostnames = []
+        self.slots = {}
+        if hosts_info is None:
+            return
+
+        self.hostnames = hosts_info.keys()
+        self.slots = dict([ (h_id, i) for i, h_id in enumerate(self.hostnames) ])
+        n = len(self.hostnames)
+        self.cpu_free = numpy.zeros(n)
+        self.cpu_total = numpy.zeros(n)
+        self.memory_free = numpy.zeros(n)
+        self.memory_total = numpy.zeros(n)
+        self.vm_count = numpy.zeros(n, dtype = numpy.int64)
+        self.maxvms = numpy.zeros(n, dtype = numpy.int64)
+        # The additional resources are stored in a matrix with one column per resource (declared states whether the host
+        #   declares the resource, as the resources that are not declared are not limited)
+        self.extra_names = []
+        self.extra_columns = {}
+        self.extra_free = numpy.zeros((n, 0))
+        self.extra_total = numpy.zeros((n, 0))
+        self.extra_declared = numpy.zeros((n, 0), dtype = bool)
+        for h_id in self.hostnames:
+            self.update(h_id, hosts_info[h_id])
+
+    def _add_extra_resource(self, name):
+        n = len(self.hostnames)
+        # The names of the resources may be shared with copies of the store, so they are not modified in place
+        self.extra_columns = dict(self.extra_columns)
+        self.extra_columns[name] = len(self.extra_names)
+        self.extra_names = self.extra_names + [ name ]
+        self.extra_free = numpy.hstack([ self.extra_free, numpy.zeros((n, 1)) ])
+        self.extra_total = numpy.hstack([ self.extra_total, numpy.zeros((n, 1)) ])
+        self.extra_declared = numpy.hstack([ self.extra_declared, numpy.zeros((n, 1), dtype = bool) ])
+
+    def update(self, h_id, hostdata):
+        i = self.slots[h_id]
+        self.cpu_free[i] = hostdata.cpu_free
+        self.cpu_total[i] = hostdata.cpu_total
+        self.memory_free[i] = hostdata.memory_free
+        self.memory_total[i] = hostdata.memory_total
+        self.vm_count[i] = len(hostdata.vm_list)
+        self.maxvms[i] = hostdata.maxvms
+        for name, total in hostdata.extra_total.items():
+            if name not in self.extra_columns:
+                self._add_extra_resource(name)
+            j = self.extra_columns[name]
+            self.extra_free[i, j] = hostdata.extra_free[name]
+            self.extra_total[i, j] = total
+            self.extra_declared[i, j] = True
+
+    def copy(self):
+        nr = HostsResources()
+        nr.hostnames = self.hostnames
+        nr.slots = self.slots
+        nr.cpu_free = self.cpu_free.copy()
+        nr.cpu_total = self.cpu_total.copy()
+        nr.memory_free = self.memory_free.copy()
+        nr.memory_total = self.memory_total.copy()
+        nr.vm_count = self.vm_count.copy()
+        nr.maxvms = self.maxvms.copy()
+        nr.extra_names = self.extra_names
+        nr.extra_columns = self.extra_columns
+        nr.extra_free = self.extra_free.copy()
+        nr.extra_total = self.extra_total.copy()
+        nr.extra_declared = self.extra_declared.copy()
+        return nr
+
+    def max_extra(self):
+        '''
+        @return a dictionary with the greatest total amount of each additional resource
+        '''
+        return dict([ (name, float(self.extra_total[:, j].max())) for j, name in enumerate(self.extra_names) ])
+
+    def _normalized_extra(self, extra, max_extra):
+        normalized = {}
+        for name in config.config_vmca.RESOURCES:
+            if (name in self.extra_columns) and (max_extra.get(name, 0) > 0):
+                normalized[name] = extra[:, self.extra_columns[name]] / max_extra[name]
+        return normalized
+
+    def euclid_normalized_free(self, max_cpu, max_memory, max_extra = {}):
+        return calculate_euclid_resources_v(self.memory_free / float(max_memory), self.cpu_free / float(max_cpu), self._normalized_extra(self.extra_free, max_extra))
+
+    def euclid_normalized_total(self, max_cpu, max_memory, max_extra = {}):
+        return calculate_euclid_resources_v(self.memory_total / float(max_memory), self.cpu_total / float(max_cpu), self._normalized_extra(self.extra_total, max_extra))
+
+    def fits(self, vmdata):
+        '''
+        @return a list of booleans (one per slot) that states whether the vm would fit in each host (the same criteria than HostData.vm_can_fit)
+        '''
+        fits = ((self.cpu_free - vmdata.cpu) >= 0) & ((self.memory_free - vmdata.memory) >= 0) & ((self.maxvms < 0) | (self.vm_count < self.maxvms))
+        # One vectorized comparison per additional resource that the vm needs
+        for name, amount in vmdata.extra.items():
+            j = self.extra_columns.get(name, None)
+            if j is not None:
+                fits &= (~self.extra_declared[:, j]) | (self.extra_free[:, j] >= amount)
+        return fits.tolist()
+
+class HostsCapacityIndex:
+    '''
+    Index of the hosts of a HostsInfo structure by free cpu and by free memory (one sorted list per dimension), to obtain
+    the hosts in which a vm would fit by means of a range query instead of checking every host
+
+    * the index is updated from the log of changes of the HostsInfo structure (HostsInfo.get_changes) before each query, so
+      only the hosts that have been modified since the last query are re-indexed
+    '''
+    def __init__(self, hosts_info):
+        self._hosts_info = hosts_info
+        self._cpu = []
+        self._memory = []
+        self._entries = {}
+        for h_id in hosts_info.keys():
+            self._insert(h_id)
+        self._cpu.sort()
+        self._memory.sort()
+        _, self._changes_seen = hosts_info.get_changes()
+
+    def _insert(self, h_id, keep_sorted = False):
+        h = self._hosts_info[h_id]
+        entry = (h.cpu_free, h.memory_free)
+        self._entries[h_id] = entry
+        if keep_sorted:
+            bisect.insort(self._cpu, (entry[0], h_id))
+            bisect.insort(self._memory, (entry[1], h_id))
+        else:
+            self._cpu.append((entry[0], h_id))
+            self._memory.append((entry[1], h_id))
+
+    def _remove(self, h_id):
+        (cpu, memory) = self._entries.pop(h_id)
+        del self._cpu[bisect.bisect_left(self._cpu, (cpu, h_id))]
+        del self._memory[bisect.bisect_left(self._memory, (memory, h_id))]
+
+    def update(self):
+        changed, self._changes_seen = self._hosts_info.get_changes(self._changes_seen)
+        for h_id in set(changed):
+            if h_id in self._entries:
+                self._remove(h_id)
+            self._insert(h_id, True)
+
+    def hosts_that_fit(self, vmdata):
+        '''
+        @return the set of identifiers of the hosts in which the vm would fit (the same criteria than HostData.vm_can_fit)
+        '''
+        self.update()
+
+        # The range of the most selective dimension is traversed, and the other dimension is checked for each host
+        i_cpu = bisect.bisect_left(self._cpu, (vmdata.cpu,))
+        i_memory = bisect.bisect_left(self._memory, (vmdata.memory,))
+        if (len(self._cpu) - i_cpu) <= (len(self._memory) - i_memory):
+            in_range = [ h_id for (_, h_id) in self._cpu[i_cpu:] if self._entries[h_id][1] >= vmdata.memory ]
+        else:
+            in_range = [ h_id for (_, h_id) in self._memory[i_memory:] if self._entries[h_id][0] >= vmdata.cpu ]
+
+        fits = set()
+        for h_id in in_range:
+            h = self._hosts_info[h_id]
+            if (h.maxvms < 0) or (len(h.vm_list) < h.maxvms):
+                if (len(vmdata.extra) == 0) or h.extra_can_fit(vmdata):
+                    fits.add(h_id)
+        return fits
+
 class HostsInfo():
-    @classmethod
+    @staticmethod
     def createfromstr(_str):
-        return HostsInfo.createfromcsv(_str.split("\n"))
+        return HostsInfo.createfromcsv(_str.splitlines())
     
     @staticmethod
     def createfromfile(fname):
-        f = open(fname, "rt")
-        h = HostsInfo.createfromcsv(f)
-        f.close()
+        '''
+        @description Reads the structure from a CSV file, line by line. The file may be compressed with gzip
+        '''
+        f = open_csv(fname, "r")
+        try:
+            h = HostsInfo.createfromcsv(f)
+        finally:
+            f.close()
         return h
     
+    @staticmethod
+    def _csv_extra(fields):
+        '''
+        @return a dictionary with the additional resources in the fields name=value (the other fields are ignored)
+        '''
+        extra = {}
+        for field in fields:
+            if "=" in field:
+                name, value = field.split("=", 1)
+                extra[name.strip().lower()] = float(value)
+        return extra
+
     @staticmethod
     def createfromcsv(lines):
+        '''
+        @description Creates the structure from any iterable of CSV lines (a list, a file, a socket file or a generator).
+            The lines are consumed one by one, so only the structure itself is kept in memory
+        '''
         hosts = {}
         for l in lines:
-            l=l.strip("\n")
+            l=l.rstrip("\r\n")
             fields = l.split(";")
             if fields[0] == 'host':
                 hosts[fields[1]] = HostData(fields[1], float(fields[2]), float(fields[3]))
+                # The additional resources follow the summary of the host
+                for name, total in HostsInfo._csv_extra(fields[5:]).items():
+                    hosts[fields[1]].set_extra_resource(name, total)
             elif fields[0] == 'vm':
-                vm = VMData(fields[1], float(fields[2]), float(fields[3]), fields[4])
+                vm = VMData(fields[1], float(fields[2]), float(fields[3]), fields[4], extra = HostsInfo._csv_extra(fields[6:]))
                 # Currently we are ignoring timestamp_state from CSV because we are working with the old data
                 # vm.timestamp_state = float(fields[5])
                 hosts[fields[4]].add_vm(vm)
-        return HostsInfo(hosts)
+
+        # The hosts have just been created, so they are not cloned again (as the constructor does)
+        hosts_info = HostsInfo({})
+        hosts_info._hosts_info = hosts
+        return hosts_info
+
+    def _csv_extra_fields(self, extra):
+        return "".join([ ";%s=%f" % (name, extra[name]) for name in sorted(extra.keys()) ])
 
     def _csv_vm(self, vm):
-        return "vm;%s;%f;%f;%s;%.2f" % (vm.id, vm.cpu, vm.memory, vm.hostname, vm.timestamp_state)
+        return "vm;%s;%f;%f;%s;%.2f%s" % (vm.id, vm.cpu, vm.memory, vm.hostname, vm.timestamp_state, self._csv_extra_fields(vm.extra))
     
     def _csv_host(self, h):
-        retval = ""
-        for vm in h.vm_list:
-            retval="%s%s\n" % (retval, self._csv_vm(vm))
-        
-        return "host;%s;%f;%f;%d(%.0f,%.1f)\n%s" % (h.hostname, h.cpu_total, h.memory_total, len(h.vm_list), h.cpu_total-h.cpu_free, h.memory_total-h.memory_free, retval)
+        return "host;%s;%f;%f;%d(%.0f,%.1f)%s" % (h.hostname, h.cpu_total, h.memory_total, len(h.vm_list), h.cpu_total-h.cpu_free, h.memory_total-h.memory_free, self._csv_extra_fields(h.extra_total))
 
-    def csv(self, INSTANCE_TYPES = None, filename = None):
-        retval = ""
-        h_names = self._hosts_info.keys()
-        h_names.sort()
-
-        summary = ""
+    def iter_csv(self, INSTANCE_TYPES = None):
+        '''
+        @description Generates the CSV representation of the structure, line by line (each line ends in a newline,
+            except the summary of the instance types)
+        '''
+        summary = []
         t_count = 0
 
-        for h_name in h_names:
-            retval = "%s%s" % (retval, self._csv_host(self._hosts_info[h_name]))
-            sum1 = ""
+        for h_name in sorted(self._hosts_info.keys()):
+            h = self._hosts_info[h_name]
+            yield "%s\n" % self._csv_host(h)
+            for vm in h.vm_list:
+                yield "%s\n" % self._csv_vm(vm)
 
             if INSTANCE_TYPES is not None:
                 t=[0]*len(INSTANCE_TYPES)
-                for vm in self._hosts_info[h_name].vm_list:
+                for vm in h.vm_list:
                     i = 0
                     for tvm in INSTANCE_TYPES:
                         if (vm.memory == tvm.memory ) and (vm.cpu == tvm.cpu):
                             t[i] += 1
                             i += 1
-                sum1 = ",".join([ str(x) for x in t ])
-                summary = "%s & %s" % (summary, sum1)
+                summary.append(" & %s" % ",".join([ str(x) for x in t ]))
                         
-            t_count = t_count + len(self._hosts_info[h_name].vm_list)
+            t_count = t_count + len(h.vm_list)
             
         if INSTANCE_TYPES is not None:
-            retval = "%s\n# %d%s" % (retval, t_count, summary)
-            
+            yield "\n# %d%s" % (t_count, "".join(summary))
+
+    def write_csv(self, output, INSTANCE_TYPES = None):
+        '''
+        @description Writes the CSV representation of the structure line by line, without building it in memory
+        @param output the name of a file (it is compressed with gzip if the name ends in .gz) or a file-like object
+            (e.g. a file or a socket file)
+        '''
+        if isinstance(output, basestring):
+            f = open_csv(output, "w")
+            try:
+                self.write_csv(f, INSTANCE_TYPES)
+            finally:
+                f.close()
+            return
+        for line in self.iter_csv(INSTANCE_TYPES):
+            output.write(line)
+
+    def csv(self, INSTANCE_TYPES = None, filename = None):
         if filename is not None:
-            f = open(filename, "wt")
-            f.write(retval)
-            f.close()
-            
-        return retval
+            self.write_csv(filename, INSTANCE_TYPES)
+        return "".join(self.iter_csv(INSTANCE_TYPES))
 
     def stabilize_vms(self, min_stable_time, hosts_affected = []):
         if hosts_affected is None:
             return
         
+        now = cpyutils.eventloop.now()
         for h_id in hosts_affected:
-            if h_id in hosts_affected:
-                h = self._hosts_info[h_id]
-                for vm in h.vm_list:
-                    vm.timestamp_state = vm.timestamp_state - min_stable_time
-                    vm.state = VMData.STATE_RUNNING
+            # The hosts whose VMs are already running and stable are not modified, so that they can keep being shared
+            #   with other versions of the structure (see HostsInfo_Version)
+            stable = True
+            for vm in self._hosts_info[h_id].vm_list:
+                if (vm.state != VMData.STATE_RUNNING) or ((now - vm.timestamp_state) < min_stable_time):
+                    stable = False
+                    break
+            if stable:
+                continue
+
+            h = self._host_for_update(h_id)
+            for vm in h.vm_list:
+                vm.timestamp_state = vm.timestamp_state - min_stable_time
+                vm.state = VMData.STATE_RUNNING
     
     def reduce_capacity(self, cpu, memory, cpu_pct, memory_pct):
-        for h_id, hostdata in self._hosts_info.items():
-            hostdata.reduce_capacity(cpu, memory, cpu_pct, memory_pct)
+        for h_id in self._hosts_info.keys():
+            self._host_for_attributes(h_id).reduce_capacity(cpu, memory, cpu_pct, memory_pct)
+        # The resources have changed, so the information must be normalized again
+        self._resources = None
+        self._r_sum = None
+        self._r_sum2 = None
     
+    def get_resources_store(self):
+        '''
+        @return the HostsResources store, if it is available and the resources have been normalized. None otherwise
+        '''
+        if (self._resources is None) or (not self._max_cpu > 0) or (not self._max_memory > 0):
+            return None
+        return self._resources
+
+    def _resources_for_update(self):
+        '''
+        @return the HostsResources store that is going to be modified (the overlays provide a private copy here)
+        '''
+        return self._resources
+
+    def get_capacity_index(self):
+        if self._capacity_index is None:
+            self._capacity_index = HostsCapacityIndex(self)
+        return self._capacity_index
+
+    def hosts_that_fit(self, vmdata):
+        '''
+        @return the set of identifiers of the hosts in which the vm would fit
+        '''
+        return self.get_capacity_index().hosts_that_fit(vmdata)
+
+    def filter_hosts_that_fit(self, candidates, vmdata):
+        '''
+        @return the identifiers in candidates (in the same order) of the hosts in which the vm would fit
+        '''
+        fits = self.hosts_that_fit(vmdata)
+        if len(fits) == 0:
+            return []
+        return [ h_id for h_id in candidates if h_id in fits ]
+
+    @profiling.timed("hostsinfo.normalize_resources")
     def normalize_resources(self):
+        self._r_sum = None
+        self._r_sum2 = None
+        if USE_NUMPY and (len(self._hosts_info) > 1):
+            return self._normalize_resources_v()
+
         self._max_cpu = 0
         self._max_memory = 0
+        self._max_extra = {}
 
         # There is a special case for normalization that would cause problems:
         # when there is the unique host and self._max_cpu or self._max_memory is zero. So
         # we'd avoid it by assuming that when there is only 1 host, the normalized
         # values are 1.0
         if len(self._hosts_info) > 1:
-            for hostname, hostdata in self._hosts_info.items():
+            for hostname in self._hosts_info.keys():
+                hostdata = self._host_for_attributes(hostname)
                 if hostdata.cpu_total > self._max_cpu:
                     self._max_cpu = hostdata.cpu_total
                 if hostdata.memory_total > self._max_memory:
                     self._max_memory = hostdata.memory_total
+                for name, total in hostdata.extra_total.items():
+                    self._max_extra[name] = max(self._max_extra.get(name, 0), total)
                 hostdata.norm_cpu_total = 0.0
                 hostdata.norm_cpu_free = 0.0
                 hostdata.norm_memory_total = 0.0
@@ -291,10 +752,13 @@ class HostsInfo():
                 hostdata.norm_cpu_total = (1.0 * hostdata.cpu_total) / self._max_cpu
                 hostdata.norm_memory_free = (1.0 * hostdata.memory_free) / self._max_memory
                 hostdata.norm_memory_total = (1.0 * hostdata.memory_total) / self._max_memory
-                hostdata.norm_resources_free = self.calculate_euclid_normalized_resources(hostdata.memory_free, hostdata.cpu_free)
-                hostdata.norm_resources_total = self.calculate_euclid_normalized_resources(hostdata.memory_total, hostdata.cpu_total)
+                hostdata.norm_resources_free = self.calculate_euclid_normalized_resources(hostdata.memory_free, hostdata.cpu_free, hostdata.extra_free)
+                hostdata.norm_resources_total = self.calculate_euclid_normalized_resources(hostdata.memory_total, hostdata.cpu_total, hostdata.extra_total)
+
+            self._init_running_sums()
         else:
-            for hostname, hostdata in self._hosts_info.items():
+            for hostname in self._hosts_info.keys():
+                hostdata = self._host_for_attributes(hostname)
                 hostdata.norm_cpu_free = 1.0
                 hostdata.norm_cpu_total = 1.0
                 hostdata.norm_memory_free = 1.0
@@ -304,24 +768,112 @@ class HostsInfo():
             
         return True
 
-    def calculate_euclid_normalized_resources(self, memory, cpu):
+    def _normalize_resources_v(self):
+        # Vectorized version of normalize_resources, that also (re)creates the resources store
+        self._resources = HostsResources(self)
+        resources = self._resources
+
+        self._max_cpu = max(0, resources.cpu_total.max())
+        self._max_memory = max(0, resources.memory_total.max())
+        self._max_extra = resources.max_extra()
+        if self._max_cpu <= 0 or self._max_memory <= 0:
+            raise CannotNormalizeException()
+
+        norm_cpu_free = (resources.cpu_free / float(self._max_cpu)).tolist()
+        norm_cpu_total = (resources.cpu_total / float(self._max_cpu)).tolist()
+        norm_memory_free = (resources.memory_free / float(self._max_memory)).tolist()
+        norm_memory_total = (resources.memory_total / float(self._max_memory)).tolist()
+        norm_resources_free = resources.euclid_normalized_free(self._max_cpu, self._max_memory, self._max_extra).tolist()
+        norm_resources_total = resources.euclid_normalized_total(self._max_cpu, self._max_memory, self._max_extra).tolist()
+
+        for i, hostname in enumerate(resources.hostnames):
+            hostdata = self._host_for_attributes(hostname)
+            hostdata.norm_cpu_free = norm_cpu_free[i]
+            hostdata.norm_cpu_total = norm_cpu_total[i]
+            hostdata.norm_memory_free = norm_memory_free[i]
+            hostdata.norm_memory_total = norm_memory_total[i]
+            hostdata.norm_resources_free = norm_resources_free[i]
+            hostdata.norm_resources_total = norm_resources_total[i]
+
+        self._init_running_sums()
+        return True
+
+    def _init_running_sums(self):
+        # The running sum and sum of squares of the normalized free resources of the hosts, that are maintained
+        #   in make_movement to calculate the mean and the variance in O(1)
+        self._r_sum = 0.0
+        self._r_sum2 = 0.0
+        for h_id in self._hosts_info.keys():
+            r_i = self.euclid_normalized_resources_free(h_id)
+            self._r_sum += r_i
+            self._r_sum2 += r_i * r_i
+
+    def variance_after_migrations(self, migration_list):
+        '''
+        @return the variance of the normalized free resources of the hosts that would result from making the migrations
+            in migration_list, without making them (it costs O(len(migration_list))). If the running sums are not
+            being tracked it returns None
+        '''
+        if self._r_sum is None:
+            return None
+
+        free = {}
+        for vm_movement in migration_list:
+            if (vm_movement.host_src not in self._hosts_info) or (vm_movement.host_dst not in self._hosts_info):
+                break
+            vm = self._hosts_info[vm_movement.host_src].get_vm_byid(vm_movement.vmid)
+            if vm is None:
+                break
+            for h_id, sign in [ (vm_movement.host_src, 1), (vm_movement.host_dst, -1) ]:
+                if h_id not in free:
+                    free[h_id] = [ self._hosts_info[h_id].cpu_free, self._hosts_info[h_id].memory_free, self._hosts_info[h_id].extra_free.copy() ]
+                free[h_id][0] += sign * vm.cpu
+                free[h_id][1] += sign * vm.memory
+                for name, amount in vm.extra.items():
+                    if name in free[h_id][2]:
+                        free[h_id][2][name] += sign * amount
+
+        r_sum = self._r_sum
+        r_sum2 = self._r_sum2
+        for h_id, (cpu_free, memory_free, extra_free) in free.items():
+            r_before = self.euclid_normalized_resources_free(h_id)
+            r_after = calculate_euclid_resources((1.0 * memory_free) / self._max_memory, (1.0 * cpu_free) / self._max_cpu, self._normalized_extra(extra_free))
+            r_sum += r_after - r_before
+            r_sum2 += (r_after * r_after) - (r_before * r_before)
+
+        return _variance_from_sums(r_sum, r_sum2, float(len(self._hosts_info)))
+
+    def _normalized_extra(self, extra):
+        '''
+        @return the amounts of the additional resources in extra (only those that are considered in the normalized
+            resources), normalized by the greatest amount in the hosts
+        '''
+        if len(config.config_vmca.RESOURCES) == 0:
+            return None
+        normalized = {}
+        for name in config.config_vmca.RESOURCES:
+            if (name in extra) and (self._max_extra.get(name, 0) > 0):
+                normalized[name] = float(extra[name]) / self._max_extra[name]
+        return normalized
+
+    def calculate_euclid_normalized_resources(self, memory, cpu, extra = {}):
         cpu_f = float(cpu) / self._max_cpu
         mem_f = float(memory) / self._max_memory
-        return calculate_euclid_resources(mem_f, cpu_f)
+        return calculate_euclid_resources(mem_f, cpu_f, self._normalized_extra(extra))
 
     def euclid_normalized_resources_free(self, host_id):
         host = self._hosts_info[host_id]
-        return calculate_euclid_resources(host.norm_memory_free, host.norm_cpu_free)
+        return calculate_euclid_resources(host.norm_memory_free, host.norm_cpu_free, self._normalized_extra(host.extra_free))
 
     def euclid_normalized_resources_free_relative(self, host_id):
         host = self._hosts_info[host_id]
-        total = calculate_euclid_resources(host.norm_memory_total, host.norm_cpu_total)
-        free = calculate_euclid_resources(host.norm_memory_free, host.norm_cpu_free)
+        total = calculate_euclid_resources(host.norm_memory_total, host.norm_cpu_total, self._normalized_extra(host.extra_total))
+        free = calculate_euclid_resources(host.norm_memory_free, host.norm_cpu_free, self._normalized_extra(host.extra_free))
         return free/total
 
     def euclid_normalized_resources_total(self, host_id):
         host = self._hosts_info[host_id]
-        return calculate_euclid_resources(host.norm_memory_total, host.norm_cpu_total)
+        return calculate_euclid_resources(host.norm_memory_total, host.norm_cpu_total, self._normalized_extra(host.extra_total))
 
     def get_vms(self):
         vms = []
@@ -335,12 +887,105 @@ class HostsInfo():
             vmids = vmids + [ vm.id for vm in h.vm_list ]
         return vmids
 
+    def _get_vm_index(self):
+        # The index vmid -> host is built the first time that it is needed, and then it is maintained as the VMs are moved
+        if self._vm2host is None:
+            self._vm2host = {}
+            for h_id, h in self._hosts_info.items():
+                for vm in h.vm_list:
+                    self._vm2host[str(vm.id)] = h_id
+        return self._vm2host
+
+    def _set_vm_location(self, vmid, h_id):
+        if self._vm2host is not None:
+            if h_id is None:
+                self._vm2host.pop(str(vmid), None)
+            else:
+                self._vm2host[str(vmid)] = h_id
+
+    def get_vm_location(self, vmid):
+        '''
+        @return the identifier of the host in which the vm is hosted (None if the vm is not in the structure)
+        '''
+        return self._get_vm_index().get(str(vmid), None)
+
+    def get_vm_byid(self, vmid):
+        '''
+        @return the VMData of the vm whose id is vmid (None if the vm is not in the structure)
+        '''
+        h_id = self.get_vm_location(vmid)
+        if h_id is None:
+            return None
+        return self._hosts_info[h_id].get_vm_byid(vmid)
+
     def remove_vms(self, vmids = []):
-        for h_id, h in self._hosts_info.items():
-            for vmid in vmids:
-                vm = h.get_vm_byid()
-                if vm is not None:
-                    h.remove_vm(vm)
+        for vmid in vmids:
+            h_id = self.get_vm_location(vmid)
+            if h_id is None:
+                continue
+            vm = self._hosts_info[h_id].get_vm_byid(vmid)
+            if self._r_sum is not None:
+                r_before = self.euclid_normalized_resources_free(h_id)
+            self._host_for_update(h_id).remove_vm(vm)
+            self._set_vm_location(vmid, None)
+            if self._r_sum is not None:
+                self._update_normalized_resources(h_id)
+                r_after = self.euclid_normalized_resources_free(h_id)
+                self._r_sum += r_after - r_before
+                self._r_sum2 += (r_after * r_after) - (r_before * r_before)
+            if self._resources is not None:
+                self._resources_for_update().update(h_id, self._hosts_info[h_id])
+
+    def fingerprint(self, vms_excluded = []):
+        '''
+        @return a fingerprint of the placement of the VMs in the hosts (i.e. two structures with the same hosts and
+            the same VMs in each host have the same fingerprint). It is maintained as the VMs are moved, so it is
+            calculated in O(1) except for the first time.
+        @param vms_excluded the ids of VMs that are not taken into account (e.g. the VMs that are being migrated)
+        '''
+        if self._fingerprint is None:
+            fingerprint = 0
+            for h_id, h in self._hosts_info.items():
+                fingerprint ^= _host_fingerprint(h_id, h.placement_fingerprint)
+            self._fingerprint = fingerprint
+
+        fingerprint = self._fingerprint
+        if len(vms_excluded) > 0:
+            # The contribution of the hosts of the excluded VMs is replaced by the one that they would have without them
+            placement = {}
+            for vmid in vms_excluded:
+                h_id = self.get_vm_location(vmid)
+                if h_id is not None:
+                    placement[h_id] = placement.get(h_id, self._hosts_info[h_id].placement_fingerprint) ^ _vm_fingerprint(vmid)
+            for h_id, placement_fingerprint in placement.items():
+                fingerprint ^= _host_fingerprint(h_id, self._hosts_info[h_id].placement_fingerprint) ^ _host_fingerprint(h_id, placement_fingerprint)
+        return fingerprint
+
+    def diff(self, hi):
+        '''
+        @return the list of VMs that are placed in a different host in hi, as VMMigration objects from the host in this
+            structure to the host in hi (the host is None if the VM is not in the structure). The hosts whose placement
+            fingerprint is the same in both structures are not inspected (the fingerprint of the whole structure is not
+            used to skip the comparison, because a collision would hide the changes)
+        '''
+        vmids = set()
+        for h_id, h_mine in self._hosts_info.items():
+            if (h_id not in hi) or (hi[h_id].placement_fingerprint != h_mine.placement_fingerprint):
+                vmids.update([ str(vm.id) for vm in h_mine.vm_list ])
+        for h_id, h_other in hi.items():
+            if (h_id not in self) or (self[h_id].placement_fingerprint != h_other.placement_fingerprint):
+                vmids.update([ str(vm.id) for vm in h_other.vm_list ])
+
+        moved = []
+        for vmid in sorted(vmids):
+            h_mine = self.get_vm_location(vmid)
+            h_other = hi.get_vm_location(vmid)
+            if h_mine != h_other:
+                vm = self.get_vm_byid(vmid)
+                if vm is None:
+                    vm = hi.get_vm_byid(vmid)
+                moved.append(VMMigration(vm.id, h_mine, h_other, 0, 0))
+        return moved
 
     def __ne__(self, hi):
         return not self.__eq__(hi)
@@ -352,15 +997,7 @@ class HostsInfo():
             
             h_other = hi._hosts_info[h_id]
             for vm in h_mine.vm_list:
-                vmid_mine = vm.id
-                
-                has_vm = False
-                for vm_other in h_other.vm_list:
-                    if vm_other.id == vmid_mine:
-                        has_vm = True
-                        break
-                    
-                if not has_vm:
+                if not h_other.has_vm(vm):
                     return False
                 
         for h_id, h_other in hi._hosts_info.items():
@@ -369,35 +1006,123 @@ class HostsInfo():
             
             h_mine = self._hosts_info[h_id]
             for vm in h_other.vm_list:
-                vmid_other = vm.id
-                
-                has_vm = False
-                for vm_mine in h_mine.vm_list:
-                    if vmid_other == vm_mine.id:
-                        has_vm = True
-                        break
-                    
-                if not has_vm:
+                if not h_mine.has_vm(vm):
                     return False
                 
         return True        
     
+    @profiling.timed("hostsinfo.clone")
     def clone(self):
         nhi = HostsInfo(self._hosts_info)
         nhi._max_memory = self._max_memory
         nhi._max_cpu = self._max_cpu
+        nhi._max_extra = self._max_extra
+        nhi._r_sum = self._r_sum
+        nhi._r_sum2 = self._r_sum2
+        nhi._fingerprint = self._fingerprint
+        return nhi
+
+    def overlay(self):
+        '''
+        @return a HostsInfo_Overlay over this structure, that can be used instead of clone() to simulate
+            movements whose cost depends only on the hosts that are modified
+        '''
+        return HostsInfo_Overlay(self)
+
+    def derive(self):
+        '''
+        @return a new version of this structure (HostsInfo_Version) that shares the hosts with it, and that can be
+            modified without copying the whole structure
+        '''
+        return HostsInfo_Version(self)
+
+    def snapshot(self):
+        '''
+        @return a compact and picklable representation of the structure (the hosts, in order, and the values used
+            for the normalization), that can be restored by means of HostsInfo.from_snapshot (e.g. in other process)
+        '''
+        return ([ (h_id, self._hosts_info[h_id]) for h_id in self._hosts_info.keys() ], self._max_cpu, self._max_memory, self._max_extra, self._r_sum, self._r_sum2)
+
+    @staticmethod
+    def from_snapshot(snapshot):
+        (hosts, max_cpu, max_memory, max_extra, r_sum, r_sum2) = snapshot
+        nhi = HostsInfo({})
+        # The hosts are not copied again, because the snapshot is expected to be a copy itself (i.e. it has been unpickled)
+        for h_id, h in hosts:
+            nhi._hosts_info[h_id] = h
+        nhi._max_cpu = max_cpu
+        nhi._max_memory = max_memory
+        nhi._max_extra = max_extra
+        nhi._r_sum = r_sum
+        nhi._r_sum2 = r_sum2
         return nhi
     
     def __init__(self, dictionary):
-        self._hosts_info = copy.deepcopy(dictionary)
+        self._hosts_info = dict([ (h_id, h.clone()) for h_id, h in dictionary.items() ])
         self._max_cpu = None
         self._max_memory = None
+        self._max_extra = {}
+        self._resources = None
+        self._vm2host = None
+        self._r_sum = None
+        self._r_sum2 = None
+        # The log of the hosts that have been modified, to enable the incremental update of derived structures (e.g. HostsRanking)
+        self._changes = []
+        self._capacity_index = None
+        self._fingerprint = None
+
+    def _host_for_update(self, h_id):
+        '''
+        @return the HostData for host h_id that is going to be modified (the overlays provide a private copy here)
+        '''
+        self._changes.append(h_id)
+        self._fingerprint = None
+        return self._hosts_info[h_id]
+
+    def _host_for_attributes(self, h_id):
+        '''
+        @return the HostData for host h_id whose capacity or normalized values are going to be modified (but not its VMs)
+        '''
+        self._changes.append(h_id)
+        return self._hosts_info[h_id]
+
+    def _record_changes(self, h_ids):
+        self._changes.extend(h_ids)
+
+    def get_changes(self, since = 0):
+        '''
+        @return a pair (hosts, next) where hosts is the list of the identifiers of the hosts that have been modified
+            since the position "since" of the log of changes, and next is the position to use in the next call
+        '''
+        return self._changes[since:], len(self._changes)
+
+    def get_root(self):
+        '''
+        @return the structure that holds the hosts (it is the structure itself, except for the overlays)
+        '''
+        return self
+
+    def touched_hosts(self):
+        return []
         
     def __getitem__(self, i):
         return self._hosts_info[i]
+
+    def __contains__(self, i):
+        return i in self._hosts_info
     
     def __setitem__(self, i, itm):
         self._hosts_info[i] = itm
+        self._changes.append(i)
+        self._fingerprint = None
+        self._vm2host = None
+        self._r_sum = None
+        self._r_sum2 = None
+        if self._resources is not None:
+            if i in self._resources.slots:
+                self._resources_for_update().update(i, itm)
+            else:
+                self._resources = None
     
     def items(self):
         return self._hosts_info.items()
@@ -406,6 +1131,8 @@ class HostsInfo():
         return self._hosts_info.keys()
     
     def make_movement(self, vm_movement):
+        if profiling.ENABLED:
+            profiling.count("make_movement")
         h_src = vm_movement.host_src
         h_dst = vm_movement.host_dst
 
@@ -418,27 +1145,57 @@ class HostsInfo():
             logging.error("host %s or host %s is not found" % (h_dst))
             return False
 
-        vm = self._hosts_info[h_src].get_vm_byid(vm_movement.vmid)
-        if vm is None:
+        if self._hosts_info[h_src].get_vm_byid(vm_movement.vmid) is None:
             logging.error("error trying to simulate movement %s could not retrieve the information about vm %s on host %s" % (vm_movement, vm_movement.vmid, h_src))
             return False
             
-        self._hosts_info[h_src].remove_vm(vm)
-        self._hosts_info[h_dst].add_vm(vm)
+        tracking = (self._r_sum is not None)
+        if tracking:
+            r_before = [ self.euclid_normalized_resources_free(h) for h in [ h_src, h_dst ] ]
+
+        fingerprint = self._fingerprint
+        if fingerprint is not None:
+            for h in [ h_src, h_dst ]:
+                fingerprint ^= _host_fingerprint(h, self._hosts_info[h].placement_fingerprint)
+
+        host_src = self._host_for_update(h_src)
+        vm = host_src.get_vm_byid(vm_movement.vmid)
+        host_src.remove_vm(vm)
+        self._host_for_update(h_dst).add_vm(vm)
+        self._set_vm_location(vm.id, h_dst)
         
         vm.hostname = h_dst
 
-        if (self._max_cpu > 0) and (self._max_memory > 0):
-            # We'll recalculate the normalized values
+        if fingerprint is not None:
             for h in [ h_src, h_dst ]:
-                hostdata = self._hosts_info[h]
-                hostdata.norm_cpu_free = (1.0 * hostdata.cpu_free) / self._max_cpu
-                hostdata.norm_cpu_total = (1.0 * hostdata.cpu_total) / self._max_cpu
-                hostdata.norm_memory_free = (1.0 * hostdata.memory_free) / self._max_memory
-                hostdata.norm_memory_total = (1.0 * hostdata.memory_total) / self._max_memory
+                fingerprint ^= _host_fingerprint(h, self._hosts_info[h].placement_fingerprint)
+            self._fingerprint = fingerprint
+
+        # We'll recalculate the normalized values
+        for h in [ h_src, h_dst ]:
+            self._update_normalized_resources(h)
+
+        if tracking:
+            for h, r_b in zip([ h_src, h_dst ], r_before):
+                r_a = self.euclid_normalized_resources_free(h)
+                self._r_sum += r_a - r_b
+                self._r_sum2 += (r_a * r_a) - (r_b * r_b)
+
+        if self._resources is not None:
+            resources = self._resources_for_update()
+            resources.update(h_src, self._hosts_info[h_src])
+            resources.update(h_dst, self._hosts_info[h_dst])
         
         return True
 
+    def _update_normalized_resources(self, h_id):
+        if (self._max_cpu > 0) and (self._max_memory > 0):
+            hostdata = self._hosts_info[h_id]
+            hostdata.norm_cpu_free = (1.0 * hostdata.cpu_free) / self._max_cpu
+            hostdata.norm_cpu_total = (1.0 * hostdata.cpu_total) / self._max_cpu
+            hostdata.norm_memory_free = (1.0 * hostdata.memory_free) / self._max_memory
+            hostdata.norm_memory_total = (1.0 * hostdata.memory_total) / self._max_memory
+
     def dump_info(self):
         res = []
         count = 0
@@ -490,23 +1247,514 @@ class HostsInfo():
             if vm_count == 0: empty_count += 1
         return empty_count
 
-    
-class VMData:
+class _OverlayDict:
+    '''
+    Dictionary-like container for HostsInfo_Overlay: the hosts that have been modified are stored locally and
+    the rest of them are read from the dictionary of the parent structure
+    '''
+    def __init__(self, parent_dict):
+        self._parent = parent_dict
+        self._local = {}
+
+    def __getitem__(self, h_id):
+        if h_id in self._local:
+            return self._local[h_id]
+        return self._parent[h_id]
+
+    def __setitem__(self, h_id, h):
+        self._local[h_id] = h
+
+    def __contains__(self, h_id):
+        return (h_id in self._local) or (h_id in self._parent)
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return self._parent.keys() + [ h_id for h_id in self._local.keys() if h_id not in self._parent ]
+
+    def values(self):
+        return [ self[h_id] for h_id in self.keys() ]
+
+    def items(self):
+        return [ (h_id, self[h_id]) for h_id in self.keys() ]
+
+class HostsInfo_Overlay(HostsInfo):
+    '''
+    A copy-on-write view of a HostsInfo structure. The hosts are shared with the parent structure until
+        they are modified by means of the methods of the structure (e.g. make_movement), so creating the
+        overlay is O(1) and each movement costs O(vms in the hosts involved) instead of deep copying
+        the whole structure.
+
+    * the parent must not be modified while the overlay is in use, and the HostData obtained from the
+        overlay must not be modified directly (use the methods of HostsInfo instead)
+    '''
+    def __init__(self, parent):
+        self._parent = parent
+        self._hosts_info = _OverlayDict(parent._hosts_info)
+        self._max_cpu = parent._max_cpu
+        self._max_memory = parent._max_memory
+        self._max_extra = parent._max_extra
+        self._resources = parent._resources
+        self._resources_owned = False
+        # The locations of the VMs that have been moved in the overlay (None if it has been removed)
+        self._vm_locations = {}
+        self._r_sum = parent._r_sum
+        self._r_sum2 = parent._r_sum2
+        self._changes = []
+        self._capacity_index = None
+        self._fingerprint = parent._fingerprint
+
+    def __setitem__(self, i, itm):
+        self._hosts_info[i] = itm
+        self._fingerprint = None
+        for vm in itm.vm_list:
+            self._set_vm_location(vm.id, i)
+
+    def _set_vm_location(self, vmid, h_id):
+        self._vm_locations[str(vmid)] = h_id
+
+    def get_vm_location(self, vmid):
+        vmid = str(vmid)
+        if vmid in self._vm_locations:
+            return self._vm_locations[vmid]
+        return self._parent.get_vm_location(vmid)
+
+    def _host_for_update(self, h_id):
+        if h_id not in self._hosts_info._local:
+            self._hosts_info._local[h_id] = self._hosts_info._parent[h_id].clone()
+        self._fingerprint = None
+        return self._hosts_info._local[h_id]
+
+    def _host_for_attributes(self, h_id):
+        return self._host_for_update(h_id)
+
+    def _resources_for_update(self):
+        if not self._resources_owned:
+            self._resources = self._resources.copy()
+            self._resources_owned = True
+        return self._resources
+
+    def _normalize_resources_v(self):
+        self._resources_owned = True
+        return HostsInfo._normalize_resources_v(self)
+
+    @profiling.timed("hostsinfo.clone")
+    def clone(self):
+        nhi = HostsInfo(dict(self._hosts_info.items()))
+        nhi._max_memory = self._max_memory
+        nhi._max_cpu = self._max_cpu
+        nhi._max_extra = self._max_extra
+        nhi._r_sum = self._r_sum
+        nhi._r_sum2 = self._r_sum2
+        nhi._fingerprint = self._fingerprint
+        return nhi
+
+    def _record_changes(self, h_ids):
+        # The hosts that are modified in the overlay are already tracked in the local dictionary
+        pass
+
+    def hosts_that_fit(self, vmdata):
+        local = self._hosts_info._local
+        fits = set([ h_id for h_id in self._parent.hosts_that_fit(vmdata) if h_id not in local ])
+        fits.update([ h_id for h_id, h in local.items() if h.vm_can_fit(vmdata) ])
+        return fits
+
+    def get_root(self):
+        return self._parent.get_root()
+
+    def touched_hosts(self):
+        '''
+        @return the identifiers of the hosts that have been modified in the overlay (or in the overlays under it)
+        '''
+        touched = self._parent.touched_hosts()
+        return touched + [ h_id for h_id in self._hosts_info._local.keys() if h_id not in touched ]
+
+    def commit(self):
+        '''
+        @description Moves the modifications made in the overlay to the parent structure. The overlay is left
+            empty, so it can be used again over the updated parent
+        '''
+        for h_id, h in self._hosts_info._local.items():
+            self._parent._hosts_info[h_id] = h
+        self._parent._record_changes(self._hosts_info._local.keys())
+        self._parent._max_cpu = self._max_cpu
+        self._parent._max_memory = self._max_memory
+        self._parent._max_extra = self._max_extra
+        self._parent._r_sum = self._r_sum
+        self._parent._r_sum2 = self._r_sum2
+        self._parent._fingerprint = self._fingerprint
+        if self._resources_owned:
+            self._parent._resources = self._resources
+            self._parent._resources_owned = True
+        for vmid, h_id in self._vm_locations.items():
+            self._parent._set_vm_location(vmid, h_id)
+        self._hosts_info._local = {}
+        self._resources_owned = False
+        self._vm_locations = {}
+
+    def rollback(self):
+        '''
+        @description Discards the modifications made in the overlay
+        '''
+        self._hosts_info._local = {}
+        self._max_cpu = self._parent._max_cpu
+        self._max_memory = self._parent._max_memory
+        self._max_extra = self._parent._max_extra
+        self._r_sum = self._parent._r_sum
+        self._r_sum2 = self._parent._r_sum2
+        self._fingerprint = self._parent._fingerprint
+        self._resources = self._parent._resources
+        self._resources_owned = False
+        self._vm_locations = {}
+
+class HostsInfo_Version(HostsInfo):
+    '''
+    A new version of a HostsInfo structure that shares the hosts with the previous version. The dictionary of the
+        hosts is copied (but not the hosts, nor their VMs) and each host is copied the first time that it is modified
+        by means of the methods of the structure (copy-on-write), so deriving a version is O(hosts) and it is not
+        needed to deep copy the whole structure.
+
+    * unlike the overlays, the version does not depend on the previous one once it is created, so the versions
+        can be derived one from the other without creating chains
+    * the previous version must not be modified while it shares hosts with the new one (i.e. it is intended to
+        derive versions from immutable snapshots, such as the ones published by the monitor)
+    '''
+    def __init__(self, previous):
+        self._hosts_info = dict(previous._hosts_info.items())
+        # The hosts that have been copied in this version (the rest of them are shared), and the ones that have been copied
+        # without their VMs (they are copied again, with their VMs, if they are updated)
+        self._owned = set()
+        self._shallow = set()
+        self._max_cpu = previous._max_cpu
+        self._max_memory = previous._max_memory
+        self._max_extra = previous._max_extra
+        self._resources = previous._resources
+        self._resources_owned = False
+        self._vm2host = None
+        self._r_sum = previous._r_sum
+        self._r_sum2 = previous._r_sum2
+        self._changes = []
+        self._capacity_index = None
+        self._fingerprint = previous._fingerprint
+
+    def _host_for_update(self, h_id):
+        if h_id not in self._owned:
+            self._hosts_info[h_id] = self._hosts_info[h_id].clone()
+            self._owned.add(h_id)
+        self._changes.append(h_id)
+        self._fingerprint = None
+        return self._hosts_info[h_id]
+
+    def _host_for_attributes(self, h_id):
+        # The capacity and the normalized values do not affect the VMs, so the host is copied without them
+        if (h_id not in self._owned) and (h_id not in self._shallow):
+            self._hosts_info[h_id] = self._hosts_info[h_id].shallow_clone()
+            self._shallow.add(h_id)
+        self._changes.append(h_id)
+        return self._hosts_info[h_id]
+
+    def __setitem__(self, i, itm):
+        self._owned.add(i)
+        HostsInfo.__setitem__(self, i, itm)
+
+    def _resources_for_update(self):
+        if not self._resources_owned:
+            self._resources = self._resources.copy()
+            self._resources_owned = True
+        return self._resources
+
+    def _normalize_resources_v(self):
+        self._resources_owned = True
+        return HostsInfo._normalize_resources_v(self)
+
+class IndexedHeap:
+    '''
+    Binary min-heap of items with a key, that keeps the position of each item in the heap, so that the key of any item
+        can be updated (or the item removed) in O(log n)
+    '''
+    def __init__(self):
+        self._heap = []
+        self._positions = {}
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, item):
+        return item in self._positions
+
+    def _swap(self, i, j):
+        self._heap[i], self._heap[j] = self._heap[j], self._heap[i]
+        self._positions[self._heap[i][1]] = i
+        self._positions[self._heap[j][1]] = j
+
+    def _sift_up(self, i):
+        while i > 0:
+            parent = (i - 1) >> 1
+            if self._heap[i][0] < self._heap[parent][0]:
+                self._swap(i, parent)
+                i = parent
+            else:
+                break
+
+    def _sift_down(self, i):
+        n = len(self._heap)
+        while True:
+            smallest = i
+            for child in [ 2*i + 1, 2*i + 2 ]:
+                if (child < n) and (self._heap[child][0] < self._heap[smallest][0]):
+                    smallest = child
+            if smallest == i:
+                break
+            self._swap(i, smallest)
+            i = smallest
+
+    def push(self, item, key):
+        '''
+        @description Inserts the item in the heap or, if it is already in the heap, updates its key
+        '''
+        if item in self._positions:
+            i = self._positions[item]
+            old_key = self._heap[i][0]
+            self._heap[i] = (key, item)
+            if key < old_key:
+                self._sift_up(i)
+            else:
+                self._sift_down(i)
+        else:
+            self._heap.append((key, item))
+            self._positions[item] = len(self._heap) - 1
+            self._sift_up(len(self._heap) - 1)
+
+    def remove(self, item):
+        if item not in self._positions:
+            return False
+        i = self._positions.pop(item)
+        last = self._heap.pop()
+        if i < len(self._heap):
+            self._heap[i] = last
+            self._positions[last[1]] = i
+            self._sift_up(i)
+            self._sift_down(self._positions[last[1]])
+        return True
+
+    def top(self):
+        if len(self._heap) == 0:
+            return None
+        return self._heap[0][1]
+
+    def ordered(self):
+        '''
+        @return a generator of the pairs (key, item) in the order of the keys, without modifying the heap (obtaining
+            the first k pairs costs O(k log k))
+        '''
+        if len(self._heap) == 0:
+            return
+        frontier = [ (self._heap[0], 0) ]
+        while len(frontier) > 0:
+            entry, i = heapq.heappop(frontier)
+            yield entry
+            for child in [ 2*i + 1, 2*i + 2 ]:
+                if child < len(self._heap):
+                    heapq.heappush(frontier, (self._heap[child], child))
+
+class CandidateHosts:
+    '''
+    The candidates to host a VM, expressed as a base list of hosts (that is the same for many selections, e.g. the possible
+        destinations of a defrag) from which some hosts are excluded and, optionally, the hosts without VMs. It is used
+        instead of building a new list for each VM: the rankings keep the base list indexed, and they only check the
+        exclusions for the hosts that they visit.
+    '''
+    def __init__(self, hosts_info, base, excluded = (), with_vms_only = False):
+        self.base = base
+        self._hosts_info = hosts_info
+        self._excluded = excluded
+        self._with_vms_only = with_vms_only
+        self._base_set = None
+
+    def accepts(self, h_id):
+        '''
+        @return True if the host, that is known to be in the base list, is not excluded
+        '''
+        if h_id in self._excluded:
+            return False
+        return (not self._with_vms_only) or (len(self._hosts_info[h_id].vm_list) > 0)
+
+    def __iter__(self):
+        for h_id in self.base:
+            if self.accepts(h_id):
+                yield h_id
+
+    def __contains__(self, h_id):
+        if self._base_set is None:
+            self._base_set = set(self.base)
+        return (h_id in self._base_set) and self.accepts(h_id)
+
+    def __len__(self):
+        return len([ h_id for h_id in self ])
+
+class HostsRanking:
+    '''
+    Keeps the candidate hosts of a HostsInfo structure sorted by a rank (greater rank first; in case of tie, the order of the
+        hosts is kept), so that selecting a host is a peek on a heap instead of sorting all the candidates. The ranking is
+        built once for a structure and then only the hosts that are modified (according to HostsInfo.get_changes, that
+        is fed by make_movement) are re-ranked. The hosts modified in an overlay are ranked on the fly, so the ranking can
+        be also used with the overlays that are created over the structure.
+
+    * rank_function(hosts_info, h_id) must return the rank of the host or None if the host must not be considered
+    * the heap only contains the candidates; they are only compared with the ones in the heap when a different list of
+      candidates is given (a CandidateHosts keeps the same base list for the selections that exclude some hosts)
+    * if order_by_candidates is True, the ties are solved using the order of the candidates when the ranking is built;
+      otherwise the order of the hosts in the structure is used
+    '''
+    def __init__(self, rank_function, order_by_candidates = False):
+        self._rank_function = rank_function
+        self._order_by_candidates = order_by_candidates
+        self._hosts_info = None
+        self._heap = None
+        self._order = None
+        self._members = None
+        self._source = None
+        self._source_len = 0
+        self._changes_seen = 0
+
+    def _key(self, hosts_info, h_id):
+        rank = self._rank_function(hosts_info, h_id)
+        if rank is None:
+            return None
+        if h_id not in self._order:
+            self._order[h_id] = len(self._order)
+        return (-rank, self._order[h_id])
+
+    def _update(self, hosts_info, h_id):
+        key = self._key(hosts_info, h_id)
+        if key is None:
+            self._heap.remove(h_id)
+        else:
+            self._heap.push(h_id, key)
+
+    def _build(self, root, candidates):
+        if self._order_by_candidates:
+            hosts = candidates
+        else:
+            hosts = root.keys()
+        self._order = dict([ (h_id, i) for i, h_id in enumerate(hosts) ])
+        self._hosts_info = root
+        self._heap = IndexedHeap()
+        self._members = set(candidates)
+        for h_id in candidates:
+            key = self._key(root, h_id)
+            if key is not None:
+                self._heap.push(h_id, key)
+        _, self._changes_seen = root.get_changes()
+
+    def _set_candidates(self, candidates):
+        # The heap is only updated for the hosts that enter or leave the candidates
+        self._source = candidates
+        self._source_len = len(candidates)
+        candidates = set(candidates)
+        if candidates == self._members:
+            return
+        for h_id in self._members.difference(candidates):
+            self._heap.remove(h_id)
+        for h_id in candidates.difference(self._members):
+            key = self._key(self._hosts_info, h_id)
+            if key is not None:
+                self._heap.push(h_id, key)
+        self._members = candidates
+
+    def _sync(self, hosts_info, candidates):
+        root = hosts_info.get_root()
+        if root is not self._hosts_info:
+            self._build(root, candidates)
+            self._source = candidates
+            self._source_len = len(candidates)
+            return
+
+        changed, self._changes_seen = root.get_changes(self._changes_seen)
+        for h_id in set(changed):
+            if h_id in self._members:
+                self._update(root, h_id)
+
+        if (candidates is not self._source) or (len(candidates) != self._source_len):
+            self._set_candidates(candidates)
+
+    def ordered(self, hosts_info, candidates):
+        '''
+        @param candidates a list of hosts or a CandidateHosts
+        @return a generator of the identifiers of the hosts in candidates, from the greater to the lower rank (the hosts
+            whose rank is None are skipped)
+        '''
+        accepts = None
+        if isinstance(candidates, CandidateHosts):
+            accepts = candidates.accepts
+            candidates = candidates.base
+        self._sync(hosts_info, candidates)
+
+        # The hosts that have been modified in the overlays have to be ranked again (they are expected to be a few)
+        touched = set([ h_id for h_id in hosts_info.touched_hosts() if h_id in self._members ])
+        fresh = []
+        for h_id in touched:
+            key = self._key(hosts_info, h_id)
+            if key is not None:
+                fresh.append((key, h_id))
+        fresh.sort()
+
+        from_heap = self._heap.ordered()
+        if len(touched) > 0:
+            from_heap = ( (key, h_id) for (key, h_id) in from_heap if h_id not in touched )
+        for _, h_id in heapq.merge(from_heap, fresh):
+            if (accepts is None) or accepts(h_id):
+                yield h_id
+
+    def first(self, hosts_info, candidates):
+        for h_id in self.ordered(hosts_info, candidates):
+            return h_id
+        return None
+
+class VMData(object):
+    __slots__ = [ 'id', 'cpu', 'memory', 'hostname', 'keywords', 'extra', 'timestamp_state', 'state' ]
+
     STATE_RUNNING = 0
     STATE_OTHER = 1
     STATE_MIGRATING = 2
     
-    def __init__(self, _id, cpu, memory, original_hostname, keyw = {}):
+    def __init__(self, _id, cpu, memory, original_hostname, keyw = None, extra = None):
         self.id = _id
         self.cpu = cpu
         self.memory = memory
         self.hostname = original_hostname
-        self.keywords = keyw
+        # The keywords are shared by the copies of the VM (use set_keyword to modify them)
+        self.keywords = _NO_KEYWORDS
+        if keyw is not None:
+            self.keywords = keyw
+        # The amount of the additional resources that the VM needs (e.g. disk or pci slots): name -> amount
+        self.extra = _NO_EXTRA
+        if extra is not None:
+            self.extra = extra
         self.timestamp_state = 0                       # TODO: se puede quitar?
         self.state = self.STATE_RUNNING
 
+    def set_keyword(self, name, value):
+        '''
+        @description Sets the value of a keyword of the VM. The keywords are copied before modifying them, because they are
+            shared with the copies of the VM
+        '''
+        keywords = self.keywords.copy()
+        keywords[name] = value
+        self.keywords = keywords
+
     def clone(self):
-        new_vm = VMData(self.id, self.cpu, self.memory, self.hostname, self.keywords.copy())
+        new_vm = VMData.__new__(VMData)
+        new_vm.id = self.id
+        new_vm.cpu = self.cpu
+        new_vm.memory = self.memory
+        new_vm.hostname = self.hostname
+        new_vm.keywords = self.keywords
+        new_vm.extra = self.extra
         new_vm.timestamp_state = self.timestamp_state
         new_vm.state = self.state
         return new_vm
@@ -514,7 +1762,9 @@ class VMData:
     def __str__(self):
         return "VM %s@%s; cpu: %f; memory: %.1f (hostname: %s)" % (self.id, self.timestamp_state, self.cpu, self.memory, self.hostname)
 
-class VMMigration:
+class VMMigration(object):
+    __slots__ = [ 'vmid', 'host_src', 'host_dst', 'cost', 'reward' ]
+
     def __init__(self, vmid, host_src, host_dst, cost, reward):
         self.vmid = vmid
         self.host_src = host_src
@@ -544,11 +1794,48 @@ class Evaluated_VMMigration_List:
 class Defragger_Base():
     def __init__(self):
         self._can_use_empty_hosts_as_destination=False
+        self._time_budget = None
+        self._deadline = None
+        self._converged = True
+
+    def __getstate__(self):
+        # The rankings of the hosts are caches bound to the structure that is being defragged, so they are not pickled
+        return dict([ (k, v) for (k, v) in self.__dict__.items() if not isinstance(v, HostsRanking) ])
         
     def can_use_empty_hosts_as_destination(self, can_use):
         retval = self._can_use_empty_hosts_as_destination
         self._can_use_empty_hosts_as_destination = can_use
         return retval
+
+    def set_time_budget(self, seconds):
+        '''
+        @description Sets the wall-clock time that the defrag method can spend (None or 0 means that there is no limit). When
+            the budget expires, defrag returns the migration plan obtained so far, whose migrations are consistent (see converged)
+        @return the previous time budget
+        '''
+        retval = self._time_budget
+        self._time_budget = seconds
+        return retval
+
+    def converged(self):
+        '''
+        @return False if the last call to defrag returned because the time budget expired (so that a better plan could exist)
+        '''
+        return self._converged
+
+    def _start_time_budget(self):
+        self._converged = True
+        self._deadline = None
+        if (self._time_budget is not None) and (self._time_budget > 0):
+            self._deadline = time.time() + self._time_budget
+
+    def _time_budget_expired(self):
+        if (self._deadline is None) or (time.time() < self._deadline):
+            return False
+        if self._converged:
+            logging.warning("the time budget of the defragger has expired, so the migration plan found so far will be used")
+        self._converged = False
+        return True
     
     def _make_migrations(self, hosts_info, migration_list):
         if len(migration_list) > 0:
@@ -661,10 +1948,11 @@ class Defragger_Base():
         This function makes the connection to the SCHEDULER
         @return the host which is most appropriate to host the vm stated by vmdata
         '''
-        for h_id in candidates:
-            h = hosts_info[h_id]
-            if h.vm_can_fit(vmdata):
-                return h_id
+        fits = hosts_info.hosts_that_fit(vmdata)
+        if len(fits) > 0:
+            for h_id in candidates:
+                if h_id in fits:
+                    return h_id
             
         return None
 
@@ -697,10 +1985,8 @@ class Defragger_Base():
         * other use e.g. we can get out those nodes that are offline, or include the nodes that are
           offline and are likely to host that VM
         '''
-        if self._can_use_empty_hosts_as_destination:
-            return [ h_id for h_id in possible_destinations if (h_id != vmdata.hostname) ]
-        else:
-            return [ h_id for h_id in possible_destinations if (h_id != vmdata.hostname) and (len(hosts_info[h_id].vm_list) > 0) ]
+        # The candidates are a view of possible_destinations, so that the rankings do not need to index a new list for each vm
+        return CandidateHosts(hosts_info, possible_destinations, (vmdata.hostname,), not self._can_use_empty_hosts_as_destination)
 
     def _sort_vms(self, vm_list):
         '''
@@ -716,6 +2002,7 @@ class Defragger_Base():
         
         return sorted_vm_list
 
+    @profiling.timed("defragger.schedule_vms_from_host")
     def schedule_vms_from_host(self, hosts_info, node_id, filtered_destination_candidate_hosts, fixed_vms = [], make_movements = False):
         '''
         This method schedules the VMs from one host to the other hosts in the platform, whose identifiers are included in filtered_destination_candidate_hosts
@@ -758,6 +2045,60 @@ class Defragger_Base():
         
         return migration_list
 
+    def _create_migration_plan(self, hosts_info, assignment):
+        '''
+        @return a migration plan that takes the VMs to the hosts in the assignment. Each list of the plan contains the
+            migrations that can be made at once in the state left by the previous lists (the resources freed by the
+            migrations of a list are not used by other migration of the same list). If some migrations depend on each
+            other, one of the VMs is moved to a host in which it fits, in order to break the cycle.
+        @param hosts_info the current placement of the VMs (the migrations are made over it)
+        @param assignment a dictionary vmid -> host in which the vm has to be placed
+        '''
+        pending = []
+        for vmid, h_dst in assignment.items():
+            h_src = hosts_info.get_vm_location(vmid)
+            if h_src != h_dst:
+                pending.append((vmid, h_src, h_dst))
+        pending.sort()
+
+        migration_plan = []
+        detours = len(pending)
+        while len(pending) > 0:
+            migration_list = []
+            sources = set()
+            still_pending = []
+            for (vmid, h_src, h_dst) in pending:
+                vm = hosts_info.get_vm_byid(vmid)
+                if (h_dst not in sources) and hosts_info[h_dst].vm_can_fit(vm):
+                    migration = self.evaluate_migration(hosts_info, vm, h_dst)
+                    hosts_info.make_movement(migration)
+                    migration_list.append(migration)
+                    sources.add(h_src)
+                else:
+                    still_pending.append((vmid, h_src, h_dst))
+
+            if len(migration_list) == 0:
+                # There is a cycle, so we try to move one of the VMs to an intermediate host
+                (vmid, h_src, h_dst) = still_pending[0]
+                vm = hosts_info.get_vm_byid(vmid)
+                h_tmp = None
+                for h_id in hosts_info.filter_hosts_that_fit([ h for h in hosts_info.keys() if h not in [ h_src, h_dst ] ], vm):
+                    h_tmp = h_id
+                    break
+                detours -= 1
+                if (h_tmp is None) or (detours < 0):
+                    logging.warning("could not find an order for the migrations to get the best placement, so %d migrations are discarded" % len(still_pending))
+                    break
+                migration = self.evaluate_migration(hosts_info, vm, h_tmp)
+                hosts_info.make_movement(migration)
+                migration_list.append(migration)
+                still_pending[0] = (vmid, h_tmp, h_dst)
+
+            migration_plan.append(migration_list)
+            pending = still_pending
+
+        return migration_plan
+
     def defrag(self, _hosts_info, hosts_fixed = [], vms_fixed = []):
         """
         @description Obtains the minimum movements needed to obtain the best
@@ -63,21 +63,33 @@ class Deployment:
             h.remove_any_vm()
 
         for vm_id, vm in vms_info.items():
-            h_id = vm.hostname
-            vm_state = vm.state
+            self._assign_vm_to_host(hosts_info, vm_id, vm)
+
+    def _assign_vm_to_host(self, hosts_info, vm_id, vm):
+        '''
+        @description Updates the tracking of the assignation of the vm and adds it to the host in which it is located
+        '''
+        h_id = vm.hostname
+        
+        if vm_id in self._vm2host:
+            self._vm2host[vm_id].update(vm)
+        else:
+            self._vm2host[vm_id] = VMAssign(vm)
             
-            if vm_id in self._vm2host:
-                self._vm2host[vm_id].update(vm)
+        vm.timestamp_state = self._vm2host[vm_id].timestamp
+        
+        if h_id is not None:
+            if h_id in hosts_info:
+                hosts_info[h_id].add_vm(vm)
             else:
-                self._vm2host[vm_id] = VMAssign(vm)
-                
-            vm.timestamp_state = self._vm2host[vm_id].timestamp
-            
-            if h_id is not None:
-                if h_id in hosts_info:
-                    hosts_info[h_id].add_vm(vm)
-                else:
-                    logging.warning("VM %s is supposed to be located into the non existing host %s" % (vm_id, h_id))
+                logging.warning("VM %s is supposed to be located into the non existing host %s" % (vm_id, h_id))
+
+    def _unassign_vm_from_host(self, hosts_info, vm):
+        '''
+        @description Removes the vm from the host in which it is located (if any)
+        '''
+        if (vm.hostname is not None) and (vm.hostname in hosts_info):
+            hosts_info[vm.hostname].remove_vm(vm)
                 
     def migrate_vm(self, vmid, host_src, host_dst):
         """
@@ -22,66 +22,69 @@ import logging
 MAX_ITERATIONS=-1
 
 class SelectHost_FF:
+    '''
+    The policies to select the host to move its vms are expressed as a rank for each host; the hosts are kept in a
+        ranking (defragger.HostsRanking) that is only updated for the hosts that change, so that it is not needed to
+        sort the whole list of candidates each time that a host is selected.
+    '''
+    def _rank_host_to_move_vms(self, hosts_info, h_id, reverse = False):
+        '''
+        @returns the rank of the host (the greater the rank, the sooner the host is taken) or None if the host
+            has not any vm to move
+        '''
+        if len(hosts_info[h_id].vm_list) > 0:
+            return 0
+        return None
+
     def _sort_hosts_to_move_vms(self, hosts_info, candidates, reverse = False):
         '''
-        @returns a list of pairs (rank, node_id) where node_id is in candidates and fits the vm
+        @returns a list of pairs (rank, node_id) where node_id is in candidates and has vms
             and the rank indicates the order in which the nodes are taken
         '''
         suitable_nodes = []
-        i = 0
         for h_id in candidates:
-            h = hosts_info[h_id]
-            if len(h.vm_list)>0:
-                value = -i
-                if reverse:
-                    value = -value
-                suitable_nodes.append((-i, h_id))
-                i += 1
+            value = self._rank_host_to_move_vms(hosts_info, h_id)
+            if value is not None:
+                suitable_nodes.append((value, h_id))
         return suitable_nodes
-        
-    def get_host_to_move_its_vms(self, hosts_info, candidates):
-        suitable_nodes = self._sort_hosts_to_move_vms(hosts_info, candidates)
 
-        if len(suitable_nodes) > 0:                
-            suitable_nodes.sort(key = lambda x: x[0], reverse = True)
-            return suitable_nodes[0][1]
+    def get_host_to_move_its_vms(self, hosts_info, candidates):
+        ranking = getattr(self, '_hosts_to_move_vms_ranking', None)
+        if ranking is None:
+            ranking = defragger.HostsRanking(self._rank_host_to_move_vms, True)
+            self._hosts_to_move_vms_ranking = ranking
 
-        return None
+        return ranking.first(hosts_info, candidates)
 
 class SelectHost_MoreVMs_First(SelectHost_FF):
-    def _sort_hosts_to_move_vms(self, hosts_info, candidates, reverse = False):
-        suitable_nodes = []
-        for h_id in candidates:
-            h = hosts_info[h_id]
-            if len(h.vm_list)>0:
-                value = len(h.vm_list)
-                if reverse:
-                    value = -value
-                suitable_nodes.append((value, h_id))
-        return suitable_nodes
+    def _rank_host_to_move_vms(self, hosts_info, h_id, reverse = False):
+        h = hosts_info[h_id]
+        if len(h.vm_list) > 0:
+            value = len(h.vm_list)
+            if reverse:
+                value = -value
+            return value
+        return None
 
 class SelectHost_LessVMs_First(SelectHost_MoreVMs_First):
-    def _sort_hosts_to_move_vms(self, hosts_info, candidates):
-        return SelectHost_MoreVMs_First._sort_hosts_to_move_vms(self, hosts_info, candidates, True)
+    def _rank_host_to_move_vms(self, hosts_info, h_id, reverse = False):
+        return SelectHost_MoreVMs_First._rank_host_to_move_vms(self, hosts_info, h_id, True)
 
 class SelectHost_MoreUsedResources_First(SelectHost_FF):
-    def _sort_hosts_to_move_vms(self, hosts_info, candidates, reverse = False):
-        suitable_nodes = []
-        for h_id in candidates:
-            h = hosts_info[h_id]
-            if len(h.vm_list)>0:
-                resource_t = hosts_info.euclid_normalized_resources_total(h.hostname)
-                resource_f = hosts_info.euclid_normalized_resources_free(h.hostname)
-                value = ((resource_t - resource_f) / resource_t)
-                if reverse:
-                    value = -value
-                suitable_nodes.append((value, h_id))
-                
-        return suitable_nodes
+    def _rank_host_to_move_vms(self, hosts_info, h_id, reverse = False):
+        h = hosts_info[h_id]
+        if len(h.vm_list) > 0:
+            resource_t = hosts_info.euclid_normalized_resources_total(h.hostname)
+            resource_f = hosts_info.euclid_normalized_resources_free(h.hostname)
+            value = ((resource_t - resource_f) / resource_t)
+            if reverse:
+                value = -value
+            return value
+        return None
 
 class SelectHost_LessUsedResources_First(SelectHost_MoreUsedResources_First):
-    def _sort_hosts_to_move_vms(self, hosts_info, candidates, reverse = False):
-        return SelectHost_MoreUsedResources_First._sort_hosts_to_move_vms(self, hosts_info, candidates, True)
+    def _rank_host_to_move_vms(self, hosts_info, h_id, reverse = False):
+        return SelectHost_MoreUsedResources_First._rank_host_to_move_vms(self, hosts_info, h_id, True)
 
 class Defragger_FF(defragger.Defragger_Base):
 
@@ -102,6 +105,8 @@ class Defragger_FF(defragger.Defragger_Base):
         return None
 
     def defrag(self, _hosts_info, hosts_fixed = [], fixed_vms = []):
+        self._start_time_budget()
+
         # First of all we create a copy to not to modify the original structure
         hosts_info = _hosts_info.clone()
         hosts_info.normalize_resources()
@@ -127,8 +132,9 @@ class Defragger_FF(defragger.Defragger_Base):
             
             logging.debug("trying to move vms from node %s" % current_node_id)
             
-            # * 3 we re-schedule the vms from the host
-            migration_list = self.schedule_vms_from_host(hosts_info.clone(), current_node_id, filtered_destination_candidate_hosts, fixed_vms, True)
+            # * 3 we re-schedule the vms from the host (the movements are simulated on an overlay, so only the hosts involved are copied)
+            working_hosts_info = hosts_info.overlay()
+            simulated_migration_list = self.schedule_vms_from_host(working_hosts_info, current_node_id, filtered_destination_candidate_hosts, fixed_vms, True)
 
             '''
             * We have an evaluated migration_list, so we can make FF or BF or FFd or BFd
@@ -139,9 +145,13 @@ class Defragger_FF(defragger.Defragger_Base):
             '''
             
             # Inside this function we check whether the migration is acceptable because we are First-fitting just in case that we can empty the node
-            migration_list = self.filter_migrations_for_host(hosts_info, current_node_id, migration_list)
+            migration_list = self.filter_migrations_for_host(hosts_info, current_node_id, simulated_migration_list)
             
-            self._make_migrations(hosts_info, migration_list)
+            # If the list has been accepted as-is, the overlay already contains the movements
+            if (len(migration_list) > 0) and (len(migration_list) == len(simulated_migration_list)):
+                working_hosts_info.commit()
+            else:
+                self._make_migrations(hosts_info, migration_list)
 
             # We store the the migration list in different rows, to enable the tracking of the different iterations of the algorithm
             migration_plan.append(migration_list)
@@ -154,4 +164,8 @@ class Defragger_FF(defragger.Defragger_Base):
             else:
                 continue_moving = (len(filtered_hosts_to_empty) != 0) 
 
+            # Each migration list is already consistent with the previous ones, so we can stop when the time budget expires
+            if continue_moving and self._time_budget_expired():
+                continue_moving = False
+
         return migration_plan
\ No newline at end of file
@@ -0,0 +1,286 @@
+# coding: utf-8
+#
+# Virtual Machine Consolidation Agent (VMCA)
+# Copyright (C) 2015 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import defragger
+import logging
+
+class Defragger_LocalSearch(defragger.Defragger_Base):
+    '''
+    Post-optimisation of the migration plans obtained by other defragger (e.g. Defragger_FF leaves hosts nearly empty,
+        because the migration lists that do not empty a host are discarded). The placement reached by the migration
+        plan is improved by means of a local search, and a new migration plan is created for the improved placement.
+
+    * the objective is the number of hosts with VMs and then the number of VMs that are not in their original host.
+      The change of the objective is evaluated incrementally for each movement, from the hosts involved
+    * the neighbourhoods are:
+        - emptying a host: its VMs are moved to other hosts with VMs (best fit) and, if a VM does not fit in any of
+          them, a smaller VM of other host is moved elsewhere to make room for it
+        - returning a VM to its original host, or swapping it with a VM of its original host, if the number of
+          migrations decreases
+    * the search stops when no neighbour improves the placement, when max_evaluations neighbours have been evaluated
+      or when the time budget expires (the budget is shared with the defragger)
+    * the new plan is only used if it empties more hosts or, emptying the same number of hosts, it needs less
+      migrations; otherwise the plan of the defragger is returned as is
+    '''
+    def __init__(self, defragger_used, max_evaluations = 100000):
+        defragger.Defragger_Base.__init__(self)
+        self._defragger = defragger_used
+        self._max_evaluations = max_evaluations
+        self.evaluations = 0
+
+    def __str__(self):
+        return "%s with local search" % str(self._defragger)
+
+    # The VMs are filtered and scheduled by the defragger that obtains the plan (they are also used to repair the plan)
+    def can_use_empty_hosts_as_destination(self, can_use):
+        self._defragger.can_use_empty_hosts_as_destination(can_use)
+        return defragger.Defragger_Base.can_use_empty_hosts_as_destination(self, can_use)
+
+    def prefilter_possible_destinations(self, hosts_info):
+        return self._defragger.prefilter_possible_destinations(hosts_info)
+
+    def filter_hosts_to_empty(self, hosts_info, hosts_to_empty, fixed_vms):
+        return self._defragger.filter_hosts_to_empty(hosts_info, hosts_to_empty, fixed_vms)
+
+    def schedule_vm(self, hosts_info, candidates, vmdata):
+        return self._defragger.schedule_vm(hosts_info, candidates, vmdata)
+
+    def get_cost_estimation_for_migration(self, host_info, vmdata, host_dst):
+        return self._defragger.get_cost_estimation_for_migration(host_info, vmdata, host_dst)
+
+    def get_reward_for_migration(self, host_info, vmdata, host_dst):
+        return self._defragger.get_reward_for_migration(host_info, vmdata, host_dst)
+
+    def defrag(self, _hosts_info, hosts_fixed = [], fixed_vms = []):
+        self._start_time_budget()
+        previous_time_budget = self._defragger.set_time_budget(self._time_budget)
+        migration_plan = self._defragger.defrag(_hosts_info, hosts_fixed, fixed_vms)
+        self._defragger.set_time_budget(previous_time_budget)
+        self._converged = self._defragger.converged()
+        if self._time_budget_expired():
+            return migration_plan
+
+        hosts_info = _hosts_info.clone()
+        hosts_info.normalize_resources()
+
+        self._original = {}
+        for h_id, h in hosts_info.items():
+            for vm in h.vm_list:
+                self._original[str(vm.id)] = h_id
+
+        hosts_to_empty = [ x for x in _hosts_info.keys() if x not in hosts_fixed ]
+        filtered_hosts_to_empty = set(self.filter_hosts_to_empty(hosts_info, hosts_to_empty, fixed_vms))
+        self._movable = set([ vmid for vmid, h_id in self._original.items() if (h_id in filtered_hosts_to_empty) ])
+        self._movable.difference_update([ str(vmid) for vmid in fixed_vms ])
+        self._destinations = set(self.prefilter_possible_destinations(hosts_info))
+
+        # The placement obtained by the defragger is the starting point of the search
+        migration_count = 0
+        for migration_list in migration_plan:
+            for migration in migration_list:
+                if not hosts_info.make_movement(migration):
+                    logging.error("could not simulate the migration plan of the defragger, so it is not improved")
+                    return migration_plan
+                self._movable.add(str(migration.vmid))
+                migration_count += 1
+
+        empty_hosts = hosts_info.empty_hosts()
+        self._active = len(hosts_info.keys()) - empty_hosts
+        self._migrations = len([ vm for vm in hosts_info.get_vms() if self._original[str(vm.id)] != vm.hostname ])
+        active_before = self._active
+        migrations_before = self._migrations
+
+        self.evaluations = 0
+        improved = True
+        while improved and not self._stop():
+            improved = self._empty_hosts(hosts_info)
+            improved = self._reduce_migrations(hosts_info) or improved
+
+        if (self._active == active_before) and (self._migrations >= migrations_before):
+            return migration_plan
+
+        logging.debug("the local search has improved the placement from %d to %d hosts with VMs and from %d to %d migrated VMs (%d evaluations)" % (active_before, self._active, migrations_before, self._migrations, self.evaluations))
+
+        assignment = {}
+        for h_id, h in hosts_info.items():
+            for vm in h.vm_list:
+                if self._original[str(vm.id)] != h_id:
+                    assignment[vm.id] = h_id
+
+        new_hosts_info = _hosts_info.clone()
+        new_hosts_info.normalize_resources()
+        new_migration_plan = self._create_migration_plan(new_hosts_info, assignment)
+        new_migration_count = sum([ len(migration_list) for migration_list in new_migration_plan ])
+
+        # The order of the migrations may need detours (or may not be found), so the plans are compared once they are created
+        new_empty_hosts = new_hosts_info.empty_hosts()
+        if (new_empty_hosts < empty_hosts) or ((new_empty_hosts == empty_hosts) and (new_migration_count >= migration_count)):
+            logging.debug("the migration plan for the improved placement is not better than the plan of the defragger")
+            return migration_plan
+        return new_migration_plan
+
+    def _stop(self):
+        if self._time_budget_expired():
+            return True
+        if (self._max_evaluations > 0) and (self.evaluations >= self._max_evaluations):
+            self._converged = False
+            return True
+        return False
+
+    def _move(self, hosts_info, vmid, h_dst):
+        '''
+        @description Moves the vm to the host h_dst and updates the objective
+        '''
+        h_src = hosts_info.get_vm_location(vmid)
+        h_original = self._original[str(vmid)]
+        if len(hosts_info[h_dst].vm_list) == 0:
+            self._active += 1
+        hosts_info.make_movement(defragger.VMMigration(vmid, h_src, h_dst, 0, 0))
+        if len(hosts_info[h_src].vm_list) == 0:
+            self._active -= 1
+        self._migrations += int(h_original != h_dst) - int(h_original != h_src)
+
+    def _fits_instead(self, h, vm_in, vm_out):
+        if (h.cpu_free + vm_out.cpu < vm_in.cpu) or (h.memory_free + vm_out.memory < vm_in.memory):
+            return False
+        for name, amount in vm_in.extra.items():
+            if (name in h.extra_free) and (h.extra_free[name] + vm_out.extra.get(name, 0) < amount):
+                return False
+        return True
+
+    def _active_destinations(self, hosts_info, excluded):
+        return [ h_id for h_id in self._destinations if (h_id not in excluded) and (len(hosts_info[h_id].vm_list) > 0) ]
+
+    def _best_fit(self, hosts_info, candidates, vm):
+        '''
+        @return the host in candidates in which the vm fits, leaving less free resources (the original host of the vm
+            is preferred, as it saves a migration)
+        '''
+        best = None
+        best_key = None
+        for h_id in hosts_info.filter_hosts_that_fit(candidates, vm):
+            self.evaluations += 1
+            key = (self._original[str(vm.id)] != h_id, hosts_info.euclid_normalized_resources_free(h_id))
+            if (best_key is None) or (key < best_key):
+                best = h_id
+                best_key = key
+        return best
+
+    def _make_room(self, hosts_info, candidates, vm):
+        '''
+        @description Tries to move a smaller VM out of one of the candidates to other candidate, so that the vm fits
+            in its place
+        @return the host in which the vm fits once the other VM has been moved (None if it was not possible)
+        '''
+        for h_id in candidates:
+            h = hosts_info[h_id]
+            for vm_out in h.vm_list:
+                if self._stop():
+                    return None
+                self.evaluations += 1
+                if (str(vm_out.id) not in self._movable) or not self._fits_instead(h, vm, vm_out):
+                    continue
+                h_out = self._best_fit(hosts_info, [ x for x in candidates if x != h_id ], vm_out)
+                if h_out is not None:
+                    self._move(hosts_info, vm_out.id, h_out)
+                    return h_id
+        return None
+
+    def _try_to_empty(self, hosts_info, h_id):
+        '''
+        @description Tries to move every VM out of the host. The movements are made on an overlay, so that they are
+            discarded if the host cannot be emptied
+        @return True if the host has been emptied
+        '''
+        h = hosts_info[h_id]
+        for vm in h.vm_list:
+            if str(vm.id) not in self._movable:
+                return False
+
+        overlay = hosts_info.overlay()
+        active = self._active
+        migrations = self._migrations
+        candidates = self._active_destinations(overlay, [ h_id ])
+        vms = sorted(h.vm_list, key = lambda vm: hosts_info.calculate_euclid_normalized_resources(vm.memory, vm.cpu, vm.extra), reverse = True)
+        for vm in vms:
+            h_dst = self._best_fit(overlay, candidates, vm)
+            if h_dst is None:
+                h_dst = self._make_room(overlay, candidates, vm)
+            if (h_dst is None) or self._stop():
+                overlay.rollback()
+                self._active = active
+                self._migrations = migrations
+                return False
+            self._move(overlay, vm.id, h_dst)
+
+        overlay.commit()
+        return True
+
+    def _empty_hosts(self, hosts_info):
+        '''
+        @description Tries to empty the hosts with VMs, starting by the ones with less used resources
+        @return True if any host has been emptied
+        '''
+        used = lambda h_id: hosts_info.euclid_normalized_resources_total(h_id) - hosts_info.euclid_normalized_resources_free(h_id)
+        hosts = [ h_id for h_id, h in hosts_info.items() if len(h.vm_list) > 0 ]
+        hosts.sort(key = lambda h_id: (used(h_id), len(hosts_info[h_id].vm_list)))
+
+        improved = False
+        for h_id in hosts:
+            if self._stop():
+                break
+            if (len(hosts_info[h_id].vm_list) > 0) and self._try_to_empty(hosts_info, h_id):
+                improved = True
+        return improved
+
+    def _reduce_migrations(self, hosts_info):
+        '''
+        @description Returns the migrated VMs to their original host if it has VMs, or swaps them with a migrated VM of
+            their original host (only if the swap reduces the number of migrations)
+        @return True if the number of migrations has been reduced
+        '''
+        improved = False
+        for vm in hosts_info.get_vms():
+            if self._stop():
+                break
+            h_src = vm.hostname
+            h_original = self._original[str(vm.id)]
+            if (h_original == h_src) or (str(vm.id) not in self._movable):
+                continue
+            h = hosts_info[h_original]
+            if len(h.vm_list) == 0:
+                continue
+
+            self.evaluations += 1
+            if h.vm_can_fit(vm):
+                self._move(hosts_info, vm.id, h_original)
+                improved = True
+                continue
+
+            for vm_out in h.vm_list:
+                self.evaluations += 1
+                # The VM that leaves the original host must be a migrated VM, otherwise the number of migrations is kept
+                if (str(vm_out.id) not in self._movable) or (self._original[str(vm_out.id)] == h_original) or (h_src not in self._destinations):
+                    continue
+                if self._fits_instead(h, vm, vm_out) and self._fits_instead(hosts_info[h_src], vm_out, vm):
+                    vm_out_id = vm_out.id
+                    self._move(hosts_info, vm.id, h_original)
+                    self._move(hosts_info, vm_out_id, h_src)
+                    improved = True
+                    break
+        return improved
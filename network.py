@@ -0,0 +1,246 @@
+# coding: utf-8
+#
+# Virtual Machine Consolidation Agent (VMCA)
+# Copyright (C) 2015 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import heapq
+import logging
+import config
+
+def migration_depends_on(migration, previous):
+    '''
+    @return True if the migration cannot be started until the previous migration (from a previous list of the migration plan)
+        has finished: the previous migration frees resources in the destination host, moves VMs to the source host or moves
+        the same VM
+    '''
+    return (previous.host_src == migration.host_dst) or (previous.host_dst == migration.host_src) or (previous.vmid == migration.vmid)
+
+class NetworkModel:
+    '''
+    Model of the network links used by the migrations: each host has a NIC with a bandwidth and, optionally, the hosts are
+        grouped in racks that are connected by uplinks with their own bandwidth. The bandwidth is expressed in the same
+        units of memory of the VMs per second (e.g. MB/s).
+
+    * a migration uses the NICs of the source and the destination hosts and, if the hosts are in different racks, the
+      uplinks of both racks
+    * a migration is transferred at the bandwidth of the slowest link that it uses
+    '''
+    def __init__(self, host_bandwidth, hosts_bandwidth = None, racks = None, uplink_bandwidth = None):
+        '''
+        @param host_bandwidth the bandwidth of the NIC of the hosts
+        @param hosts_bandwidth a dictionary host -> bandwidth of its NIC, for the hosts that differ from host_bandwidth
+        @param racks a dictionary host -> rack (the hosts that are not included are considered to be in their own rack, without uplink)
+        @param uplink_bandwidth the bandwidth of the uplinks of the racks (a number or a dictionary rack -> bandwidth)
+        '''
+        self._host_bandwidth = host_bandwidth
+        self._hosts_bandwidth = {}
+        if hosts_bandwidth is not None:
+            self._hosts_bandwidth = hosts_bandwidth
+        self._racks = {}
+        if racks is not None:
+            self._racks = racks
+        self._uplink_bandwidth = uplink_bandwidth
+
+    def links(self, host_src, host_dst):
+        '''
+        @return the list of the links used by a migration from host_src to host_dst
+        '''
+        links = [ ('nic', host_src), ('nic', host_dst) ]
+        rack_src = self._racks.get(host_src, None)
+        rack_dst = self._racks.get(host_dst, None)
+        if (rack_src is not None) and (rack_dst is not None) and (rack_src != rack_dst) and (self._uplink_bandwidth is not None):
+            links.append(('uplink', rack_src))
+            links.append(('uplink', rack_dst))
+        return links
+
+    def capacity(self, link):
+        (kind, name) = link
+        if kind == 'nic':
+            return self._hosts_bandwidth.get(name, self._host_bandwidth)
+        if isinstance(self._uplink_bandwidth, dict):
+            return self._uplink_bandwidth[name]
+        return self._uplink_bandwidth
+
+    def rate(self, host_src, host_dst):
+        '''
+        @return the bandwidth at which a migration from host_src to host_dst is transferred
+        '''
+        return min([ self.capacity(link) for link in self.links(host_src, host_dst) ])
+
+    def migration_time(self, memory, host_src, host_dst):
+        rate = self.rate(host_src, host_dst)
+        if rate <= 0:
+            return float('inf')
+        return float(memory) / rate
+
+def create_network_model():
+    '''
+    @return the NetworkModel defined by HOST_BANDWIDTH, RACKS and UPLINK_BANDWIDTH in the configuration, or None if HOST_BANDWIDTH
+        is not set
+    '''
+    if config.config_vmca.HOST_BANDWIDTH <= 0:
+        return None
+    uplink_bandwidth = None
+    if config.config_vmca.UPLINK_BANDWIDTH > 0:
+        uplink_bandwidth = config.config_vmca.UPLINK_BANDWIDTH
+    return NetworkModel(config.config_vmca.HOST_BANDWIDTH, racks = config.config_vmca.RACKS, uplink_bandwidth = uplink_bandwidth)
+
+class LinksUsage:
+    '''
+    Bandwidth that is being used in each link of a NetworkModel by a set of migrations, to avoid oversubscribing the links
+    '''
+    def __init__(self, network):
+        self._network = network
+        self._used = {}
+
+    def fits(self, host_src, host_dst):
+        rate = self._network.rate(host_src, host_dst)
+        for link in self._network.links(host_src, host_dst):
+            if self._used.get(link, 0) + rate > self._network.capacity(link):
+                return False
+        return True
+
+    def add(self, host_src, host_dst):
+        rate = self._network.rate(host_src, host_dst)
+        for link in self._network.links(host_src, host_dst):
+            self._used[link] = self._used.get(link, 0) + rate
+
+    def remove(self, host_src, host_dst):
+        rate = self._network.rate(host_src, host_dst)
+        for link in self._network.links(host_src, host_dst):
+            self._used[link] = self._used.get(link, 0) - rate
+
+class ScheduledMigration:
+    def __init__(self, migration, start, end):
+        self.migration = migration
+        self.start = start
+        self.end = end
+
+    def __str__(self):
+        return "%s (from %.2f to %.2f)" % (self.migration, self.start, self.end)
+
+class MigrationScheduler_Bandwidth:
+    '''
+    Obtains the order and the start time of the migrations of a migration plan, that try to minimize the makespan of the
+        plan without oversubscribing any link of the network.
+
+    * a migration depends on the migrations of the previous migration lists of the plan (see migration_depends_on)
+    * it is a list scheduling: each time that a migration ends, the migrations whose dependencies have finished are started
+      (the longest first) if all the links that they use have enough bandwidth
+    '''
+    def __init__(self, network):
+        self._network = network
+
+    def _memory(self, hosts_info, migration):
+        if hosts_info is not None:
+            vm = hosts_info.get_vm_byid(migration.vmid)
+            if vm is not None:
+                return vm.memory
+        # The default cost of a migration is the memory of the VM
+        return migration.cost
+
+    def _dependencies(self, migration_plan):
+        migrations = []
+        dependencies = []
+        previous = []
+        for migration_list in migration_plan:
+            current = []
+            for migration in migration_list:
+                deps = [ i for i in previous if migration_depends_on(migration, migrations[i]) ]
+                migrations.append(migration)
+                dependencies.append(deps)
+                current.append(len(migrations) - 1)
+            previous.extend(current)
+        return migrations, dependencies
+
+    def schedule(self, migration_plan, hosts_info = None):
+        '''
+        @return a list of ScheduledMigration objects, sorted by their start time
+        '''
+        migrations, dependencies = self._dependencies(migration_plan)
+        durations = [ self._network.migration_time(self._memory(hosts_info, m), m.host_src, m.host_dst) for m in migrations ]
+
+        pending_deps = [ len(deps) for deps in dependencies ]
+        dependants = [ [] for m in migrations ]
+        for i, deps in enumerate(dependencies):
+            for j in deps:
+                dependants[j].append(i)
+
+        usage = LinksUsage(self._network)
+        ready = [ i for i in range(len(migrations)) if pending_deps[i] == 0 ]
+        running = []
+        scheduled = []
+        now = 0.0
+
+        while (len(ready) > 0) or (len(running) > 0):
+            # The longest migrations are started first (in case of tie, the order of the plan is kept)
+            ready.sort(key = lambda i: (-durations[i], i))
+            for i in ready[:]:
+                m = migrations[i]
+                if usage.fits(m.host_src, m.host_dst):
+                    usage.add(m.host_src, m.host_dst)
+                    heapq.heappush(running, (now + durations[i], i))
+                    scheduled.append(ScheduledMigration(m, now, now + durations[i]))
+                    ready.remove(i)
+
+            if len(running) == 0:
+                # The remaining migrations cannot be started because some link has not enough bandwidth, even when it is not used
+                logging.error("some migrations cannot be scheduled because of the bandwidth of the links")
+                break
+
+            now, i = heapq.heappop(running)
+            finished = [ i ]
+            while (len(running) > 0) and (running[0][0] <= now):
+                finished.append(heapq.heappop(running)[1])
+
+            for i in finished:
+                usage.remove(migrations[i].host_src, migrations[i].host_dst)
+                for j in dependants[i]:
+                    pending_deps[j] -= 1
+                    if pending_deps[j] == 0:
+                        ready.append(j)
+
+        return scheduled
+
+    def makespan(self, migration_plan, hosts_info = None):
+        scheduled = self.schedule(migration_plan, hosts_info)
+        if len(scheduled) == 0:
+            return 0.0
+        return max([ s.end for s in scheduled ])
+
+    def reorder(self, migration_plan, hosts_info = None):
+        '''
+        @return a copy of the migration plan in which the migrations of each list are sorted by their start time in the schedule
+        '''
+        order = {}
+        for i, s in enumerate(self.schedule(migration_plan, hosts_info)):
+            order[id(s.migration)] = i
+        return [ sorted(migration_list, key = lambda m: order.get(id(m), len(order))) for migration_list in migration_plan ]
+
+class Cost_MigrationTime:
+    '''
+    Mixin for the defraggers to use the time of the migration in the network model as the cost of the migration (instead
+        of the memory of the VM). It must precede the defragger in the bases of the class, and the model is set by means of
+        set_network_model (while it is not set, the cost is the memory of the VM).
+    '''
+    def set_network_model(self, network_model):
+        self._network = network_model
+
+    def get_cost_estimation_for_migration(self, host_info, vmdata, host_dst):
+        network = getattr(self, '_network', None)
+        if network is None:
+            return vmdata.memory
+        return network.migration_time(vmdata.memory, vmdata.hostname, host_dst)
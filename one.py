@@ -22,6 +22,8 @@ import cpyutils.oneconnect
 import deployment
 import defragger
 import config
+import profiling
+import cpyutils.eventloop
 
 ALREADY_MIGRATED = False
 
@@ -30,6 +32,22 @@ class HostONE(defragger.HostData):
         defragger.HostData.__init__(self, oneinfo.NAME, oneinfo.total_slots / 100.0, oneinfo.memory_total / 1024.0, oneinfo.keywords)
         self.ID = int(oneinfo.ID)
 
+    def update(self, oneinfo):
+        '''
+        @description Updates the capacity of the host from the info obtained from ONE, keeping the VMs that it hosts
+        '''
+        cpu_total = oneinfo.total_slots / 100.0
+        memory_total = oneinfo.memory_total / 1024.0
+        self.cpu_free += cpu_total - self.cpu_total
+        self.cpu_total = cpu_total
+        self.memory_free += memory_total - self.memory_total
+        self.memory_total = memory_total
+        self.ID = int(oneinfo.ID)
+        # The keywords are monitored values (e.g. FREE_CPU), so they are replaced as a whole
+        self.keywords = defragger._NO_KEYWORDS
+        if oneinfo.keywords is not None:
+            self.keywords = oneinfo.keywords
+
 class Deployment(deployment.Deployment):
     def __init__(self, one_xmlrpc, one_auth):
         deployment.Deployment.__init__(self)
@@ -44,77 +62,143 @@ class Deployment(deployment.Deployment):
         self._migrating_vms = []
         self._locked_vms = []
 
+        # The information about each VM obtained in the last monitorization: vm_id -> (signature, vmdata, locked, migrating)
+        self._vm_cache = {}
+        self._timestamp_info = None
+
     def get_migrating_vms(self):
         return self._migrating_vms
             
     def get_locked_vms(self):
         return self._migrating_vms + self._locked_vms
     
+    @staticmethod
+    def _vm_signature(vm, host):
+        # The fields of the VM from ONE that are used by VMCA; if none of them changes, the VM does not need to be processed again
+        seq = None
+        if len(vm.HISTORY_RECORDS.HISTORY) > 0:
+            seq = vm.HISTORY_RECORDS.HISTORY[-1].SEQ
+        return (vm.STATE, vm.LCM_STATE, host, seq, vm.TEMPLATE.CPU, vm.TEMPLATE.MEMORY, vm.UID, vm.GID, vm.TEMPLATE.TEMPLATE_ID)
+
+    def _create_vmdata(self, vm, host):
+        '''
+        @return a tuple (vmdata, locked, migrating) for the VM obtained from ONE
+        '''
+        vmdata = defragger.VMData(vm.ID, vm.TEMPLATE.CPU, vm.TEMPLATE.MEMORY, host)
+        locked = False
+        migrating = False
+
+        if (vm.STATE == cpyutils.oneconnect.VM.STATE_ACTIVE):
+            if (vm.LCM_STATE == cpyutils.oneconnect.VM.LCM_RUNNING):
+                vmdata.state = defragger.VMData.STATE_RUNNING
+                if (vm.ID in config.config_one.LOCKED_VM_IDS) or (vm.UID in config.config_one.LOCKED_VM_UID) or (vm.GID in config.config_one.LOCKED_VM_GID) or (vm.TEMPLATE.TEMPLATE_ID in config.config_one.LOCKED_TEMPLATES):
+                    # logging.debug("locking vm %s because of configuration" % vm.ID)
+                    locked = True
+                if (len(config.config_one.ONLY_GIDS) > 0) and (vm.GID not in config.config_one.ONLY_GIDS):
+                    # logging.debug("locking vm %s because its GID is not allowed" % vm.ID)
+                    locked = True
+                if (len(config.config_one.ONLY_UIDS) > 0) and (vm.UID not in config.config_one.ONLY_UIDS):
+                    # logging.debug("locking vm %s because its UID is not allowed" % vm.ID)
+                    locked = True
+                if (len(config.config_one.ONLY_TEMPLATES) > 0) and (vm.TEMPLATE.TEMPLATE_ID not in config.config_one.ONLY_TEMPLATES):
+                    # logging.debug("locking vm %s because its TEMPLATE is not allowed" % vm.ID)
+                    locked = True
+                    
+            elif (vm.LCM_STATE in [ cpyutils.oneconnect.VM.LCM_PROLOG_MIGRATE, cpyutils.oneconnect.VM.LCM_SAVE_MIGRATE, cpyutils.oneconnect.VM.LCM_MIGRATE ]):
+                vmdata.state = defragger.VMData.STATE_MIGRATING
+                migrating = True
+            else:
+                logging.debug("vm %s is locked because it is not in running state" % vm.ID)
+                vmdata.state = defragger.VMData.STATE_OTHER
+                locked = True
+        else:
+            logging.debug("vm %s is locked because it is not in active state" % vm.ID)
+            vmdata.state = defragger.VMData.STATE_OTHER
+            locked = True
+
+        return vmdata, locked, migrating
+
+    def invalidate_cache(self):
+        '''
+        @description Forces that the next call to get_info obtains the information from ONE
+        '''
+        self._timestamp_info = None
+
+    @profiling.timed("one.get_info")
     def get_info(self):
         
         # WARNING: cuando una maquina se esta migrando a veces se ha puesto en "UNKNOWN" al migrarlo y parece que se queda en el nodo origen
         
         # WARNING (2): cuando se migra una maquina, en la siguiente monitorizacion ya tiene que aparecer en el destino; si no, se considerara que ha fallado la migracion
+
+        # If the information has been obtained recently, we do not query ONE again (to avoid saturating it)
+        now = cpyutils.eventloop.now()
+        if (self._timestamp_info is not None) and ((now - self._timestamp_info) < config.config_one.MONITORING_CACHE_TIME):
+            return deployment.Deployment.get_info(self)
         
-        hosts = self._one.get_hosts()
+        with profiling.span("one.get_hosts"):
+            hosts = self._one.get_hosts()
         if hosts is None:
             return None
 
+        new_hosts = set()
         for h in hosts:
             # if h.STATE != h.DISABLED:
             if h.STATE in [ h.MONITORING_MONITORED, h.MONITORED ]:
-                hi = HostONE(h)
-                self._hosts_info[hi.hostname] = hi
+                # The hosts that are already known are updated in place, to keep the VMs that they host
+                if h.NAME in self._hosts_info:
+                    self._hosts_info[h.NAME].update(h)
+                else:
+                    hi = HostONE(h)
+                    self._hosts_info[hi.hostname] = hi
+                    new_hosts.add(hi.hostname)
 
-        vms = self._one.get_vms()
-        
-        self._vms_info = {}
-        self._migrating_vms = []
-        self._locked_vms = []
+        # The cached VMs may be located in a host that was not monitored when they were processed, so they are attached
+        # to the new hosts here (they are not processed again if they have not changed)
+        if len(new_hosts) > 0:
+            for vm_id, vmdata in self._vms_info.items():
+                if vmdata.hostname in new_hosts:
+                    self._hosts_info[vmdata.hostname].add_vm(vmdata)
+
+        with profiling.span("one.get_vms"):
+            vms = self._one.get_vms()
+        if vms is None:
+            return None
+
+        # Only the VMs that have changed since the last monitorization are processed again
+        vms_seen = set()
         for vm in vms:
             
             if vm.STATE not in [cpyutils.oneconnect.VM.STATE_INIT, cpyutils.oneconnect.VM.STATE_PENDING, cpyutils.oneconnect.VM.STATE_HOLD, cpyutils.oneconnect.VM.STATE_ACTIVE]:
                 continue
             
             # TODO: revisar esto de que el host sea None
+            # (the history records are already sorted by SEQ)
             if len(vm.HISTORY_RECORDS.HISTORY) > 0:
-                vm.HISTORY_RECORDS.HISTORY.sort(lambda x : x.SEQ)
-                host = vm.HISTORY_RECORDS.HISTORY[0].HOSTNAME
+                host = vm.HISTORY_RECORDS.HISTORY[-1].HOSTNAME
             else:
                 host = None
 
-            vmdata = defragger.VMData(vm.ID, vm.TEMPLATE.CPU, vm.TEMPLATE.MEMORY, host)
+            vms_seen.add(vm.ID)
+            signature = self._vm_signature(vm, host)
+            if (vm.ID in self._vm_cache) and (self._vm_cache[vm.ID][0] == signature):
+                continue
 
+            vmdata, locked, migrating = self._create_vmdata(vm, host)
+            if vm.ID in self._vms_info:
+                self._unassign_vm_from_host(self._hosts_info, self._vms_info[vm.ID])
+            self._vm_cache[vm.ID] = (signature, vmdata, locked, migrating)
             self._vms_info[vm.ID] = vmdata
-            if (vm.STATE == cpyutils.oneconnect.VM.STATE_ACTIVE):
-                if (vm.LCM_STATE == cpyutils.oneconnect.VM.LCM_RUNNING):
-                    vmdata.state = defragger.VMData.STATE_RUNNING
-                    if (vm.ID in config.config_one.LOCKED_VM_IDS) or (vm.UID in config.config_one.LOCKED_VM_UID) or (vm.GID in config.config_one.LOCKED_VM_GID) or (vm.TEMPLATE.TEMPLATE_ID in config.config_one.LOCKED_TEMPLATES):
-                        # logging.debug("locking vm %s because of configuration" % vm.ID)
-                        self._locked_vms.append(vm.ID)
-                    if (len(config.config_one.ONLY_GIDS) > 0) and (vm.GID not in config.config_one.ONLY_GIDS):
-                        # logging.debug("locking vm %s because its GID is not allowed" % vm.ID)
-                        self._locked_vms.append(vm.ID)
-                    if (len(config.config_one.ONLY_UIDS) > 0) and (vm.UID not in config.config_one.ONLY_UIDS):
-                        # logging.debug("locking vm %s because its UID is not allowed" % vm.ID)
-                        self._locked_vms.append(vm.ID)
-                    if (len(config.config_one.ONLY_TEMPLATES) > 0) and (vm.TEMPLATE.TEMPLATE_ID not in config.config_one.ONLY_TEMPLATES):
-                        # logging.debug("locking vm %s because its TEMPLATE is not allowed" % vm.ID)
-                        self._locked_vms.append(vm.ID)
-                        
-                elif (vm.LCM_STATE in [ cpyutils.oneconnect.VM.LCM_PROLOG_MIGRATE, cpyutils.oneconnect.VM.LCM_SAVE_MIGRATE, cpyutils.oneconnect.VM.LCM_MIGRATE ]):
-                    vmdata.state = defragger.VMData.STATE_MIGRATING
-                    self._migrating_vms.append(vm.ID)
-                else:
-                    logging.debug("vm %s is locked because it is not in running state" % vm.ID)
-                    vmdata.state = defragger.VMData.STATE_OTHER
-                    self._locked_vms.append(vm.ID)
-            else:
-                logging.debug("vm %s is locked because it is not in active state" % vm.ID)
-                vmdata.state = defragger.VMData.STATE_OTHER
-                self._locked_vms.append(vm.ID)
-        
-        self._update_vms_to_hosts(self._hosts_info, self._vms_info)
+            self._assign_vm_to_host(self._hosts_info, vm.ID, vmdata)
+
+        for vm_id in [ x for x in self._vm_cache.keys() if x not in vms_seen ]:
+            self._unassign_vm_from_host(self._hosts_info, self._vms_info[vm_id])
+            del self._vm_cache[vm_id]
+            del self._vms_info[vm_id]
+
+        self._migrating_vms = [ vm_id for vm_id, (_, _, _, migrating) in self._vm_cache.items() if migrating ]
+        self._locked_vms = [ vm_id for vm_id, (_, _, locked, _) in self._vm_cache.items() if locked ]
+        self._timestamp_info = now
         return deployment.Deployment.get_info(self)
 
 
@@ -139,6 +223,11 @@ class Deployment(deployment.Deployment):
             if self._one.migrate_vm(int(vmid), h_dst.ID, True):
                 ALREADY_MIGRATED = True
                 deployment.Deployment.migrate_vm(self, vmid, host_src, host_dst)
+
+                # The VM has been modified locally, so it must be processed again in the next monitorization (that must query ONE)
+                if vmid in self._vm_cache:
+                    del self._vm_cache[vmid]
+                self.invalidate_cache()
                 return True
             else:
                 logging.error("ONE connector could not migrate vm %s from %s to %s" % (vmid, host_src, host_dst))
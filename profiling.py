@@ -0,0 +1,200 @@
+# coding: utf-8
+#
+# Virtual Machine Consolidation Agent (VMCA)
+# Copyright (C) 2016 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Instrumentation of the defrag cycle: named spans that accumulate the time spent in each phase (monitoring, cloning,
+    normalization, scheduling, comparison of plans...) and counters of the hot operations (e.g. vm_can_fit). It also
+    enables to capture a cProfile of one whole cycle on demand.
+
+* the spans and the counters are only recorded if ENABLED is True (see ENABLE_PROFILING in vmca.cfg). When it is False,
+  span() returns a shared object that does nothing and the callers of count() check ENABLED first, so the overhead is
+  a lookup of a global variable
+* the counters are not protected by a lock (they are incremented in the hot paths), so they may lose some increments
+  if several threads are defragging at the same time
+* the cProfile capture does not depend on ENABLED, and it only profiles the thread that runs the cycle
+'''
+import time
+import threading
+import cProfile
+import pstats
+import StringIO
+
+ENABLED = False
+
+# Number of functions of the cProfile capture that are included in the report
+PROFILE_LINES = 40
+
+_lock = threading.Lock()
+_spans = {}
+_counters = {}
+_profile_requested = False
+_last_profile = None
+
+def enable(enabled = True):
+    global ENABLED
+    ENABLED = enabled
+
+def reset():
+    '''
+    @description Discards the spans and the counters recorded so far (the last cProfile capture is kept)
+    '''
+    global _spans, _counters
+    _lock.acquire()
+    _spans = {}
+    _counters = {}
+    _lock.release()
+
+def count(name, n = 1):
+    '''
+    @description Increments the counter "name" (the callers should check ENABLED before calling, to avoid the call)
+    '''
+    _counters[name] = _counters.get(name, 0) + n
+
+def record(name, elapsed):
+    '''
+    @description Adds the seconds elapsed to the span "name"
+    '''
+    _lock.acquire()
+    span_stats = _spans.get(name)
+    if span_stats is None:
+        _spans[name] = [ 1, elapsed, elapsed, elapsed ]
+    else:
+        span_stats[0] += 1
+        span_stats[1] += elapsed
+        span_stats[2] = max(span_stats[2], elapsed)
+        span_stats[3] = elapsed
+    _lock.release()
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+class _Span:
+    def __init__(self, name):
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record(self._name, time.time() - self._start)
+        return False
+
+def span(name):
+    '''
+    @description Measures the time spent in a block of code, that is accumulated in the span "name"
+        (e.g. with profiling.span("defrag.monitor"): ...)
+    '''
+    if not ENABLED:
+        return _NO_SPAN
+    return _Span(name)
+
+def timed(name):
+    '''
+    @description Decorator that accumulates the time spent in each call to the function in the span "name"
+    '''
+    def decorator(function):
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, time.time() - start)
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+    return decorator
+
+def request_profile():
+    '''
+    @description Requests a cProfile capture of the next cycle that is run by means of run_cycle
+    '''
+    global _profile_requested
+    _profile_requested = True
+
+def run_cycle(function, *args, **kwargs):
+    '''
+    @description Calls the function, under cProfile if a capture has been requested (then the request is consumed
+        and the statistics are stored as the last profile)
+    @return the value returned by the function
+    '''
+    global _profile_requested, _last_profile
+    if not _profile_requested:
+        return function(*args, **kwargs)
+
+    _profile_requested = False
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        output = StringIO.StringIO()
+        pstats.Stats(profiler, stream = output).sort_stats("cumulative").print_stats(PROFILE_LINES)
+        _last_profile = (time.time(), output.getvalue())
+
+def get_stats():
+    '''
+    @return a dictionary with the spans (name -> dictionary with calls, total, max and last seconds) and the counters
+    '''
+    _lock.acquire()
+    spans = dict([ (name, { "calls": s[0], "total": s[1], "max": s[2], "last": s[3] }) for name, s in _spans.items() ])
+    counters = dict(_counters)
+    _lock.release()
+    return { "spans": spans, "counters": counters }
+
+def report():
+    '''
+    @return the text of a table with the spans and the counters, followed by the last cProfile capture (if any)
+    '''
+    stats = get_stats()
+    lines = []
+    if not ENABLED:
+        lines.append("the spans and the counters are disabled (set ENABLE_PROFILING=True to enable them)")
+
+    if len(stats["spans"]) > 0:
+        width = max([ len(name) for name in stats["spans"].keys() ] + [ len("span") ])
+        lines.append("%s %8s %12s %12s %12s %12s" % ("span".ljust(width), "calls", "total (s)", "mean (ms)", "max (ms)", "last (ms)"))
+        for name in sorted(stats["spans"].keys()):
+            s = stats["spans"][name]
+            lines.append("%s %8d %12.3f %12.3f %12.3f %12.3f" % (name.ljust(width), s["calls"], s["total"], 1000.0 * s["total"] / s["calls"], 1000.0 * s["max"], 1000.0 * s["last"]))
+
+    if len(stats["counters"]) > 0:
+        width = max([ len(name) for name in stats["counters"].keys() ] + [ len("counter") ])
+        lines.append("")
+        lines.append("%s %12s" % ("counter".ljust(width), "count"))
+        for name in sorted(stats["counters"].keys()):
+            lines.append("%s %12d" % (name.ljust(width), stats["counters"][name]))
+
+    if _profile_requested:
+        lines.append("")
+        lines.append("a cProfile capture of the next defrag cycle has been requested (it will be included in the next report)")
+    if _last_profile is not None:
+        timestamp, text = _last_profile
+        lines.append("")
+        lines.append("cProfile of the defrag cycle at %s:" % time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)))
+        lines.append(text)
+
+    return "\n".join(lines)
@@ -20,78 +20,67 @@ import defragger
 import logging
 
 class Scheduler_FF:
+    '''
+    The scheduling policies are expressed as a rank for each host; the hosts are kept in a ranking
+        (defragger.HostsRanking) that is only updated for the hosts that change, and the vm is scheduled in the
+        host with the greater rank that fits the vm.
+    '''
+    def _rank_host_to_schedule(self, hosts_info, h_id):
+        '''
+        @returns the rank of the host (the greater the rank, the sooner the host is taken) or None if the host
+            must not be considered
+        '''
+        return 0
+
     def _sort_hosts_to_schedule(self, hosts_info, candidates, vmdata):
         '''
         @returns a list of pairs (rank, node_id) where node_id is in candidates and fits the vm
             and the rank indicates the order in which the nodes are taken
         '''
         suitable_nodes = []
-        i = 0
-        for h_id in candidates:
-            h = hosts_info[h_id]
-            if h.vm_can_fit(vmdata):
-                suitable_nodes.append((-i, h_id))
-                i += 1
+        for h_id in hosts_info.filter_hosts_that_fit(candidates, vmdata):
+            value = self._rank_host_to_schedule(hosts_info, h_id)
+            if value is not None:
+                suitable_nodes.append((value, h_id))
         return suitable_nodes
         
     def schedule_vm(self, hosts_info, candidates, vmdata):
         '''
         @return the host which is most appropriate to host the vm stated by vmdata
         '''
+        ranking = getattr(self, '_hosts_to_schedule_ranking', None)
+        if ranking is None:
+            ranking = defragger.HostsRanking(self._rank_host_to_schedule)
+            self._hosts_to_schedule_ranking = ranking
 
-        suitable_nodes = self._sort_hosts_to_schedule(hosts_info, candidates, vmdata)
-
-        if len(suitable_nodes) > 0:                
-            suitable_nodes.sort(key = lambda x: x[0], reverse = True)
-            return suitable_nodes[0][1]
+        fits = hosts_info.hosts_that_fit(vmdata)
+        if len(fits) > 0:
+            for h_id in ranking.ordered(hosts_info, candidates):
+                if h_id in fits:
+                    return h_id
         
         return None
 
 class Scheduler_Packing(Scheduler_FF):
-    def _sort_hosts_to_schedule(self, hosts_info, candidates, vmdata):
-        '''
-        @returns a list of pairs (rank, node_id) where node_id is in candidates and fits the vm
-        '''
-        suitable_nodes = []
-        for h_id in candidates:
-            h = hosts_info[h_id]
-            if h.vm_can_fit(vmdata):
-                suitable_nodes.append((len(h.vm_list), h_id))
-        return suitable_nodes
+    def _rank_host_to_schedule(self, hosts_info, h_id):
+        return len(hosts_info[h_id].vm_list)
 
 class Scheduler_Stripping(Scheduler_FF):
-    def _sort_hosts_to_schedule(self, hosts_info, candidates, vmdata):
-        '''
-        @returns a list of pairs (rank, node_id) where node_id is in candidates and fits the vm
-        '''
-        suitable_nodes = []
-        for h_id in candidates:
-            h = hosts_info[h_id]
-            if h.vm_can_fit(vmdata):
-                suitable_nodes.append((-len(h.vm_list), h_id))
-        return suitable_nodes
+    def _rank_host_to_schedule(self, hosts_info, h_id):
+        return -len(hosts_info[h_id].vm_list)
 
 class Scheduler_Load(Scheduler_FF):
-    def _sort_hosts_to_schedule(self, hosts_info, candidates, vmdata):
-        '''
-        @returns a list of pairs (rank, node_id) where node_id is in candidates and fits the vm
-        '''
-        suitable_nodes = []
-        for h_id in candidates:
-            h = hosts_info[h_id]
-            if h.vm_can_fit(vmdata):
+    def _rank_host_to_schedule(self, hosts_info, h_id):
+        h = hosts_info[h_id]
+        f_cpu = 0.0
+        if 'FREE_CPU' in h.keywords:
+            try:
+                f_cpu = float(h.keywords['FREE_CPU'])
+            except:
                 f_cpu = 0.0
-                if 'FREE_CPU' in h.keywords:
-                    try:
-                        f_cpu = float(h.keywords['FREE_CPU'])
-                    except:
-                        f_cpu = 0.0
-                    suitable_nodes.append((f_cpu, h_id))
-                else:
-                    logging.warning("trying to use FREE_CPU as rank, but the host does not have such keyword. Setting FREE_CPU as zero")
-                    
-                suitable_nodes.append((f_cpu, h_id))
-        return suitable_nodes
+        else:
+            logging.warning("trying to use FREE_CPU as rank, but the host does not have such keyword. Setting FREE_CPU as zero")
+        return f_cpu
 
 '''
 class Reward_VMCount():
@@ -0,0 +1,267 @@
+# coding: utf-8
+#
+# Virtual Machine Consolidation Agent (VMCA)
+# Copyright (C) 2016 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import sys
+import logging
+import time
+import json
+import random
+import platform
+import resource
+import multiprocessing
+import vmca.defragger
+import vmca.firstfit
+import vmca.bestfit
+import vmca.schedule
+import vmca.binpacking
+import vmca.localsearch
+import vmca.snapshotfile
+import vmca.version
+import vmca.config
+import deployment
+import cpyutils.eventloop
+import cpyutils.parameters
+
+'''
+Benchmark of the defraggers over synthetic clusters, created by means of FAKE_Deployment.create_from_random. Each defragger
+    is run for each size of the cluster (in a new process, to measure the peak memory of the run), and the results are written
+    in JSON format to enable the tracking of the regressions between releases. The lower bound of the number of active hosts
+    and the exact defragger (vmca.binpacking.Defragger_BinPacking) are the baseline for the quality of the plans. The clusters
+    can also be the frames of a binary snapshot file (see vmca.snapshotfile), to benchmark the defraggers over real traces.
+'''
+
+class Defragger_FF_LessVMs(vmca.schedule.Scheduler_Packing, vmca.firstfit.SelectHost_LessVMs_First, vmca.firstfit.Defragger_FF): pass
+class Defragger_BF_Variance(vmca.bestfit.MigrationList_Variance, vmca.bestfit.Defragger_BF_Reward): pass
+
+class Defragger_FF_LocalSearch(vmca.localsearch.Defragger_LocalSearch):
+    def __init__(self):
+        vmca.localsearch.Defragger_LocalSearch.__init__(self, Defragger_FF_LessVMs())
+
+DEFRAGGERS = [
+    "vmca.firstfit.Defragger_FF",
+    "Defragger_FF_LessVMs",
+    "Defragger_FF_LocalSearch",
+    "vmca.bestfit.Defragger_BF_Cost",
+    "vmca.bestfit.Defragger_BF_Reward",
+    "Defragger_BF_Variance",
+    "vmca.bestfit.Defragger_Distribute",
+    "vmca.bestfit.Defragger_Refill",
+    "vmca.bestfit.Defragger_Refill_Relative",
+    "vmca.binpacking.Defragger_BinPacking",
+]
+
+HOST_TYPES = [ vmca.defragger.HostData("host", 8, 16384), vmca.defragger.HostData("bighost", 16, 32768) ]
+VM_TYPES = [ vmca.defragger.VMData(0, 1, 1024, None), vmca.defragger.VMData(0, 2, 2048, None), vmca.defragger.VMData(0, 4, 4096, None) ]
+VM_TYPES_PROB = [ 5, 3, 1 ]
+
+def get_class(classname):
+    classparts = classname.split(".")
+    modulename = ".".join(classparts[:-1])
+    if modulename == "":
+        modulename = __name__
+    classname = classparts[-1]
+
+    if modulename not in sys.modules:
+        __import__(modulename)
+
+    return getattr(sys.modules[modulename], classname)
+
+def get_value(values, name):
+    # The values from the commandline are lists, but the default values are not
+    value = values[name]
+    if isinstance(value, list):
+        value = value[0]
+    return value
+
+def create_cluster(host_count, vms_per_host, seed):
+    random.seed(seed)
+    return deployment.FAKE_Deployment.create_from_random(HOST_TYPES, host_count, VM_TYPES, VM_TYPES_PROB, int(host_count * vms_per_host), save_to_file = False)
+
+def load_cluster(trace, frame):
+    reader = vmca.snapshotfile.SnapshotReader(trace)
+    hosts_info = reader.frame(frame).hosts_info()
+    reader.close()
+    cluster = deployment.FAKE_Deployment.create_from_hosts_info(hosts_info)
+    cluster.stabilize_vms(600)
+    return cluster
+
+def run_defragger(classname, host_count, vms_per_host, seed, trace = None, frame = None):
+    '''
+    @return a dictionary with the measures of the run of the defragger over a random cluster (or over the frame of the trace)
+    '''
+    if trace is None:
+        cluster = create_cluster(host_count, vms_per_host, seed)
+    else:
+        cluster = load_cluster(trace, frame)
+        host_count = len(cluster.get_info().keys())
+    hosts_info = cluster.get_info()
+    defragger = get_class(classname)()
+
+    maxrss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t_wall = time.time()
+    t_cpu = time.clock()
+    migration_plan = defragger.defrag(hosts_info, fixed_vms = [])
+    t_cpu = time.clock() - t_cpu
+    t_wall = time.time() - t_wall
+    maxrss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    final_hosts_info = hosts_info.clone()
+    migration_count = 0
+    for migration_list in migration_plan:
+        for migration in migration_list:
+            final_hosts_info.make_movement(migration)
+            migration_count += 1
+
+    run = {
+        "defragger": classname,
+        "hosts": host_count,
+        "vms": cluster.vmcount(),
+        "seed": seed,
+        "wall_time": t_wall,
+        "cpu_time": t_cpu,
+        "peak_rss_kb": maxrss_after,
+        "peak_rss_increment_kb": maxrss_after - maxrss_before,
+        "migrations": migration_count,
+        "empty_hosts_initial": hosts_info.empty_hosts(),
+        "empty_hosts_final": final_hosts_info.empty_hosts(),
+        "active_hosts_lower_bound": vmca.binpacking.active_hosts_lower_bound(hosts_info),
+        "converged": defragger.converged(),
+    }
+    if trace is not None:
+        run["frame"] = frame
+    return run
+
+def _run_defragger_in_process(queue, classname, host_count, vms_per_host, seed, trace, frame):
+    try:
+        queue.put(run_defragger(classname, host_count, vms_per_host, seed, trace, frame))
+    except Exception, e:
+        queue.put({ "defragger": classname, "hosts": host_count, "seed": seed, "error": str(e) })
+
+def run_defragger_in_process(classname, host_count, vms_per_host, seed, trace = None, frame = None):
+    '''
+    @description runs the defragger in a new process, so that the peak memory is not influenced by the previous runs
+    '''
+    queue = multiprocessing.Queue()
+    p = multiprocessing.Process(target = _run_defragger_in_process, args = (queue, classname, host_count, vms_per_host, seed, trace, frame))
+    p.start()
+    result = queue.get()
+    p.join()
+    return result
+
+if __name__ == "__main__":
+    logging.basicConfig(filename=None, level=logging.CRITICAL,
+                        format='%(asctime)s: %(levelname)-8s %(message)s',
+                        datefmt='%m-%d-%Y %H:%M:%S')
+    cpyutils.eventloop.create_eventloop(False)
+    vmca.config.config_vmca.CONSIDER_VMS_STABLE_ON_STARTUP = True
+
+    p = cpyutils.parameters.CmdLineParser("vmca-benchmark", desc = "The VMCA benchmark utility", arguments = [
+            cpyutils.parameters.Parameter("-s", "--sizes", desc = "Comma separated list of the number of hosts of the clusters", default = "10,100,1000,10000"),
+            cpyutils.parameters.Parameter("-v", "--vms-per-host", desc = "Mean number of VMs per host", default = "3"),
+            cpyutils.parameters.Parameter("-d", "--defraggers", desc = "Comma separated list of the classes of the defraggers to benchmark (default: all the defraggers)", default = ",".join(DEFRAGGERS)),
+            cpyutils.parameters.Parameter("-r", "--repeat", desc = "Number of random clusters for each size", default = "1"),
+            cpyutils.parameters.Parameter("--seed", desc = "Seed for the first random cluster", default = "0"),
+            cpyutils.parameters.Parameter("-l", "--limit", desc = "Seconds for a run of a defragger, after which the greater sizes are skipped for that defragger (0 means no limit)", default = "0"),
+            cpyutils.parameters.Parameter("-o", "--output", desc = "File to write the results in JSON format (default: standard output)"),
+            cpyutils.parameters.Parameter("-t", "--trace", desc = "Binary snapshot file whose frames are used as the clusters, instead of the random ones (the sizes are ignored)"),
+        ])
+
+    parsed, result, info = p.parse(sys.argv[1:])
+    if not parsed:
+        if (result is None):
+            print "Error:", info
+            sys.exit(-1)
+        else:
+            print info
+            sys.exit(0)
+
+    try:
+        sizes = [ int(x) for x in get_value(result.values, '-s').split(",") ]
+        vms_per_host = float(get_value(result.values, '-v'))
+        repeat = int(get_value(result.values, '-r'))
+        seed = int(get_value(result.values, '--seed'))
+        limit = float(get_value(result.values, '-l'))
+    except:
+        print "Error: invalid numeric parameter"
+        sys.exit(-1)
+
+    defraggers = [ x.strip() for x in get_value(result.values, '-d').split(",") if x.strip() != "" ]
+    for classname in defraggers:
+        try:
+            get_class(classname)
+        except:
+            print "could not use class %s" % classname
+            sys.exit(-1)
+
+    trace = get_value(result.values, '-t')
+    frames = []
+    if trace is not None:
+        try:
+            reader = vmca.snapshotfile.SnapshotReader(trace)
+            frames = range(len(reader))
+            reader.close()
+        except Exception, e:
+            print "Error: could not read the trace %s (%s)" % (trace, e)
+            sys.exit(-1)
+
+    results = []
+    for classname in defraggers:
+        for frame in frames:
+            run = run_defragger_in_process(classname, 0, vms_per_host, seed, trace, frame)
+            results.append(run)
+            if 'error' in run:
+                sys.stderr.write("%s with frame %d failed: %s\n" % (classname, frame, run['error']))
+            else:
+                sys.stderr.write("%s with frame %d (%d hosts): %.2fs, %d migrations, %d empty hosts\n" % (classname, frame, run['hosts'], run['wall_time'], run['migrations'], run['empty_hosts_final']))
+        if trace is not None:
+            continue
+
+        skip = False
+        for host_count in sorted(sizes):
+            if skip:
+                results.append({ "defragger": classname, "hosts": host_count, "skipped": True })
+                continue
+            for i in range(0, repeat):
+                run = run_defragger_in_process(classname, host_count, vms_per_host, seed + i)
+                results.append(run)
+                if 'error' in run:
+                    sys.stderr.write("%s with %d hosts failed: %s\n" % (classname, host_count, run['error']))
+                else:
+                    sys.stderr.write("%s with %d hosts: %.2fs, %d migrations, %d empty hosts\n" % (classname, host_count, run['wall_time'], run['migrations'], run['empty_hosts_final']))
+                    if (limit > 0) and (run['wall_time'] > limit):
+                        skip = True
+
+    report = {
+        "version": vmca.version.VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "vms_per_host": vms_per_host,
+        "results": results,
+    }
+    if trace is not None:
+        report["trace"] = trace
+
+    output = get_value(result.values, '-o')
+    if output is None:
+        print json.dumps(report, indent = 2, sort_keys = True)
+    else:
+        f = open(output, "w")
+        json.dump(report, f, indent = 2, sort_keys = True)
+        f.close()
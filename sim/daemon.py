@@ -51,7 +51,7 @@ class Daemon(vmca.vmcaserver.Daemon):
 
         new_migration_plan = self._defragger_periodical.defrag(self._hosts_info, fixed_vms = self._deployment.migration_vms.keys())
         if not isempty_migration_plan(new_migration_plan):
-            self._migration_plan.start(new_migration_plan)
+            self._migration_plan.start(new_migration_plan, self._defragger_periodical)
             eventloop = cpyutils.eventloop.get_eventloop()
             eventloop.add_event(cpyutils.eventloop.Event(0, callback = self.migration_plan_step, description = "Next migration plan step"))
             eventloop.limit_walltime(1000)
@@ -78,10 +78,20 @@ class FAKE_Deployment(vmca.deployment.Deployment):
 
     def get_migrating_vms(self):
         return self.migration_vms.keys()
+
+    def get_locked_vms(self):
+        # As in ONE, the VMs that are being migrated cannot be moved
+        return self.migration_vms.keys()
     
     def __init__(self, vm_count = 8, host_count = 10, host_mem_size = 4096, host_proc_count = 4):
         vmca.deployment.Deployment.__init__(self)
         self.migration_vms = {}
+        # If a network model (vmca.network.NetworkModel) is set, the time of the migrations is calculated using it
+        self.network = None
+        # If an accounting of the usage of the hosts is set (e.g. tracesim.HostUsage), it is notified before and after the hosts change
+        self.usage = None
+        self.migration_count = 0
+        self.migration_time = 0.0
 
     @staticmethod
     def create_from_filename(filename):
@@ -147,7 +157,7 @@ class FAKE_Deployment(vmca.deployment.Deployment):
         if save_to_file:
             original_hosts_info = ndeployment.get_info()
             import time
-            original_hosts_info.csv("use-cases/caso-%s" % time.strftime("%Y%m%d_%H%M%S"))
+            original_hosts_info.write_csv("use-cases/caso-%s" % time.strftime("%Y%m%d_%H%M%S"))
         return ndeployment
 
     @staticmethod
@@ -167,6 +177,9 @@ class FAKE_Deployment(vmca.deployment.Deployment):
         # return deployment.Deployment.get_info(self)
     
     def _calculate_migration_time(self, vm, host_src, host_dst):
+        if self.network is not None:
+            return self.network.migration_time(self._vms_info[vm].memory, host_src, host_dst)
+
         import random
         base = 1.0 * random.randint(30,90)
         extra = random.random() * random.randint(30, 60)
@@ -181,12 +194,15 @@ class FAKE_Deployment(vmca.deployment.Deployment):
             now = cpyutils.eventloop.now()
             
         self.migration_vms[vmid] = (host_src, host_dst, now)
+        self.migration_count += 1
 
         h_s = self._hosts_info[host_src]
         h_d = self._hosts_info[host_dst]
         vm = h_s.get_vm_byid(vmid)
+        self._changing([ host_src, host_dst ])
         h_s.remove_vm(vm)
         h_d.add_vm(vm)
+        self._changed([ host_src, host_dst ])
         vm.hostname = host_dst
         vm.timestamp_state = cpyutils.eventloop.now()
         vm.state = vmca.defragger.VMData.STATE_MIGRATING
@@ -197,10 +213,14 @@ class FAKE_Deployment(vmca.deployment.Deployment):
         
     def _end_migration(self, vmid):
         if vmid not in self.migration_vms:
+            if vmid not in self._vms_info:
+                logging.info("(T: %.2f) vm %s was destroyed while it was being migrated" % (cpyutils.eventloop.now(), vmid))
+                return
             logging.error("vm %s is not being migrated" % vmid)
             raise Exception()
 
         host_src, host_dst, timestamp = self.migration_vms[vmid]
+        self.migration_time += cpyutils.eventloop.now() - timestamp
         h_s = self._hosts_info[host_src]
         h_d = self._hosts_info[host_dst]
         vm = h_d.get_vm_byid(vmid)
@@ -219,6 +239,83 @@ class FAKE_Deployment(vmca.deployment.Deployment):
         # TODO: this is the time to ensure that the defrag method is executed in simulated time
         # cpyutils.eventloop.get_eventloop().add_control_event(10)
         
+    def set_usage(self, usage):
+        '''
+        @description Sets the accounting of the usage of the hosts (it is notified of the current hosts at once)
+        '''
+        self.usage = usage
+        if usage is not None:
+            usage.changed(self._hosts_info, self._hosts_info.keys())
+
+    def has_vm(self, vmid):
+        return vmid in self._vms_info
+
+    def _changing(self, h_ids):
+        if self.usage is not None:
+            self.usage.changing(self._hosts_info, h_ids)
+
+    def _changed(self, h_ids):
+        if self.usage is not None:
+            self.usage.changed(self._hosts_info, h_ids)
+
+    def create_vm(self, vm, host_dst = None):
+        '''
+        @description Starts a new vm. If the host is not stated, the vm is scheduled as the cloud would do: in the host that
+            fits it and has more VMs (i.e. packing)
+        @return the host in which the vm has been started (None if it does not fit in any host)
+        '''
+        if host_dst is None:
+            best = None
+            for h_id, h in self._hosts_info.items():
+                if h.vm_can_fit(vm):
+                    key = (len(h.vm_list), h_id)
+                    if (best is None) or (key > best):
+                        best = key
+            if best is None:
+                return None
+            host_dst = best[1]
+
+        vm.hostname = host_dst
+        vm.state = vmca.defragger.VMData.STATE_RUNNING
+        self._changing([ host_dst ])
+        self._hosts_info[host_dst].add_vm(vm)
+        self._changed([ host_dst ])
+        self._vms_info[vm.id] = vm
+        self._vm2host[vm.id] = vmca.deployment.VMAssign(vm)
+        vm.timestamp_state = self._vm2host[vm.id].timestamp
+        return host_dst
+
+    def destroy_vm(self, vmid):
+        '''
+        @return True if the vm existed (it is destroyed even if it is being migrated)
+        '''
+        vm = self._vms_info.pop(vmid, None)
+        if vm is None:
+            return False
+        self._changing([ vm.hostname ])
+        self._hosts_info[vm.hostname].remove_vm(vm)
+        self._changed([ vm.hostname ])
+        self._vm2host.pop(vmid, None)
+        self.migration_vms.pop(vmid, None)
+        return True
+
+    def resize_vm(self, vmid, cpu, memory):
+        '''
+        @description Changes the resources of the vm, in the host in which it is (the host may become overloaded)
+        @return True if the vm exists
+        '''
+        vm = self._vms_info.get(vmid, None)
+        if vm is None:
+            return False
+        h = self._hosts_info[vm.hostname]
+        self._changing([ vm.hostname ])
+        h.remove_vm(vm)
+        vm.cpu = cpu
+        vm.memory = memory
+        h.add_vm(vm)
+        self._changed([ vm.hostname ])
+        return True
+
     def stabilize_vms(self, min_stable_time):
         for vm_id, vm in self._vms_info.items():
             vm.timestamp_state = vm.timestamp_state - min_stable_time
@@ -21,6 +21,7 @@ import sys
 import logging
 import time
 import vmca.vmcaserver
+import vmca.snapshotfile
 import daemon
 import deployment
 import cpyutils.parameters
@@ -33,7 +34,9 @@ if __name__ == "__main__":
     cpyutils.eventloop.create_eventloop(False)
     
     p = cpyutils.parameters.CmdLineParser("vmca-simulation", desc = "The VMCA simulation utility", arguments = [
-            cpyutils.parameters.Parameter("-f", "--file", desc = "CSV file to load"),
+            cpyutils.parameters.Parameter("-f", "--file", desc = "CSV file (it may be compressed with gzip) or binary snapshot file to load"),
+            cpyutils.parameters.Parameter("--frame", desc = "Frame of the binary snapshot file to load", default = "0"),
+            cpyutils.parameters.Parameter("-s", "--snapshot", desc = "Binary snapshot file to which the initial and the final configurations are appended"),
             cpyutils.parameters.Flag("--pi", "--print-initial", desc = "prints the initial configuration"),
             cpyutils.parameters.Flag("--hi", "--hosts-initial", desc = "prints the information about hosts in initial configuration"),
             cpyutils.parameters.Flag("--si", "--summary-initial", desc = "prints the summary of the initial configuration"),
@@ -55,7 +58,15 @@ if __name__ == "__main__":
     csv_file = None
     try:
         csv_file = result.values['-f'][0]
-        hostsinfo = vmca.defragger.HostsInfo.createfromfile(csv_file)
+        if vmca.snapshotfile.is_snapshot_file(csv_file):
+            frame = result.values['--frame']
+            if isinstance(frame, list):
+                frame = frame[0]
+            reader = vmca.snapshotfile.SnapshotReader(csv_file)
+            hostsinfo = reader.frame(int(frame)).hosts_info()
+            reader.close()
+        else:
+            hostsinfo = vmca.defragger.HostsInfo.createfromfile(csv_file)
     except:
         if csv_file is None:
             print "you must provide a file name to load using parameter -f (currently we have not any random feature implemented)"
@@ -66,6 +77,11 @@ if __name__ == "__main__":
     deployment = deployment.FAKE_Deployment.create_from_hosts_info(hostsinfo)
     deployment_info = deployment.get_info()
 
+    snapshot_writer = None
+    if result.values['-s'] is not None:
+        snapshot_writer = vmca.snapshotfile.SnapshotWriter(result.values['-s'][0], append = True)
+        snapshot_writer.write(deployment_info, cpyutils.eventloop.now())
+
     pi = ""
     if result.values['--pi']:
         pi = deployment_info.csv()
@@ -109,11 +125,15 @@ if __name__ == "__main__":
     monitor.monitor()
     new_migration_plan = defragger.defrag(deployment.get_info(), fixed_vms = [])
     plan = vmca.vmcaserver.MigrationPlan(monitor)
-    plan.start(new_migration_plan)
+    plan.start(new_migration_plan, defragger)
     plan.update()
     while plan._migrate_next_vm(): pass
     deployment_info = deployment.get_info()
 
+    if snapshot_writer is not None:
+        snapshot_writer.write(deployment_info, cpyutils.eventloop.now())
+        snapshot_writer.close()
+
     pf = ""
     if result.values['--pf']:
         pf = deployment_info.csv()
@@ -0,0 +1,275 @@
+# coding: utf-8
+#
+# Virtual Machine Consolidation Agent (VMCA)
+# Copyright (C) 2016 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Parameter sweep over the trace-driven simulation (see tracesim.py): the simulation is run for each combination of the
+    values of the configuration variables and the defraggers (the whole grid or a random sample of it). Each simulation is
+    run in a new worker process, which sets its own values in config.config_vmca, and the workers use all the cores. The
+    results are aggregated in a table, sorted by one of the metrics, to choose the settings for production.
+'''
+import sys
+import logging
+import time
+import json
+import random
+import itertools
+import multiprocessing
+import vmca.config
+import tracesim
+import benchmark
+import cpyutils.eventloop
+import cpyutils.parameters
+
+TABLE_METRICS = [ "host_hours_on", "mean_active_hosts", "migrations", "rejected_arrivals", "overloaded_host_hours", "migrating_vm_hours", "wall_time" ]
+
+def parse_value(name, text):
+    '''
+    @return the value of the configuration variable, with the type of its current value (e.g. STABLE_TIME is an int)
+    '''
+    config = vmca.config.config_vmca
+    if name.startswith("WEIGHT_") and (name[len("WEIGHT_"):].lower() in config.RESOURCE_WEIGHTS):
+        return float(text)
+    if not hasattr(config, name):
+        raise ValueError("%s is not a configuration variable" % name)
+
+    current = getattr(config, name)
+    text = text.strip()
+    if isinstance(current, bool):
+        if text.lower() in [ "true", "yes", "1" ]:
+            return True
+        if text.lower() in [ "false", "no", "0" ]:
+            return False
+        raise ValueError("%s is not a valid value for %s" % (text, name))
+    if isinstance(current, (int, long)):
+        try:
+            return int(text)
+        except ValueError:
+            return float(text)
+    if isinstance(current, float):
+        return float(text)
+    return text
+
+def parse_parameters(text):
+    '''
+    @description Parses the values of the variables to sweep, as NAME=value,value;NAME=value,...
+    @return a list of pairs (name, list of values)
+    '''
+    parameters = []
+    for spec in text.split(";"):
+        if spec.strip() == "":
+            continue
+        if "=" not in spec:
+            raise ValueError("the values of %s are not stated (use NAME=value,value)" % spec.strip())
+        name, values = spec.split("=", 1)
+        name = name.strip().upper()
+        parameters.append((name, [ parse_value(name, v) for v in values.split(",") if v.strip() != "" ]))
+    return parameters
+
+def set_config(values):
+    config = vmca.config.config_vmca
+    for name, value in values.items():
+        if name.startswith("WEIGHT_") and (name[len("WEIGHT_"):].lower() in config.RESOURCE_WEIGHTS):
+            config.RESOURCE_WEIGHTS[name[len("WEIGHT_"):].lower()] = value
+        else:
+            setattr(config, name, value)
+
+def create_runs(defraggers, parameters, samples = 0, seed = 0):
+    '''
+    @return the list of pairs (defragger, dictionary of values) of the grid, or a random sample of the grid with "samples"
+        combinations (without repetitions, unless the grid is smaller)
+    '''
+    names = [ name for name, _ in parameters ]
+    axes = [ defraggers ] + [ values for _, values in parameters ]
+    grid_size = 1
+    for axis in axes:
+        grid_size *= len(axis)
+
+    if (samples <= 0) or (samples >= grid_size):
+        combinations = itertools.product(*axes)
+    else:
+        # The combinations are sampled by their index in the grid, so the grid is not built
+        rnd = random.Random(seed)
+        combinations = []
+        for index in rnd.sample(xrange(grid_size), samples):
+            combination = []
+            for axis in reversed(axes):
+                index, i = divmod(index, len(axis))
+                combination.insert(0, axis[i])
+            combinations.append(combination)
+
+    return [ (c[0], dict(zip(names, c[1:]))) for c in combinations ]
+
+def run_simulation(args):
+    '''
+    @description Entry point of the worker processes: runs a simulation with its own configuration
+    @return the report of the simulation, with the defragger and the values of the variables
+    '''
+    (run_id, classname, values, filename, events_file, trace, until, seed) = args
+    try:
+        logging.getLogger("[ELOOP]").setLevel(logging.CRITICAL)
+        cpyutils.eventloop.create_eventloop(False)
+        vmca.config.config_vmca.ENABLE_MIGRATION = True
+        set_config(values)
+        # The time of the migrations is random, so each run has the same seed
+        random.seed(seed)
+        fake_deployment, events = tracesim.load_simulation(filename, events_file, trace)
+        defragger = benchmark.get_class(classname)()
+        report = tracesim.TraceSimulation(fake_deployment, defragger, events, until = until).run()
+    except Exception, e:
+        report = { "error": str(e) }
+    report["run"] = run_id
+    report["defragger"] = classname
+    report["parameters"] = values
+    return report
+
+def sweep(runs, filename, events_file, trace, until = None, seed = 0, processes = None, progress = None):
+    '''
+    @description Runs the simulations in a pool of processes (each process only runs one simulation, so that the
+        configuration and the state of the modules are not shared between simulations)
+    @param progress function called with each report, as the simulations finish
+    @return the list of reports, in the order of the runs
+    '''
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes, maxtasksperchild = 1)
+    reports = []
+    try:
+        arguments = [ (i, classname, values, filename, events_file, trace, until, seed) for i, (classname, values) in enumerate(runs) ]
+        for report in pool.imap_unordered(run_simulation, arguments):
+            reports.append(report)
+            if progress is not None:
+                progress(report)
+    finally:
+        pool.close()
+        pool.join()
+    reports.sort(key = lambda r: r["run"])
+    return reports
+
+def format_table(reports, names, sort_by = "host_hours_on"):
+    '''
+    @return the text of a table with a row for each simulation (sorted by the metric sort_by) and a column for the defragger,
+        each variable and each metric
+    '''
+    header = [ "defragger" ] + names + TABLE_METRICS
+    rows = []
+    for report in sorted(reports, key = lambda r: ('error' in r, r.get(sort_by, 0))):
+        row = [ report["defragger"] ] + [ str(report["parameters"].get(name, "")) for name in names ]
+        if 'error' in report:
+            row += [ "error: %s" % report["error"] ]
+        else:
+            for metric in TABLE_METRICS:
+                value = report[metric]
+                if isinstance(value, float):
+                    value = "%.2f" % value
+                row.append(str(value))
+        rows.append(row)
+
+    widths = [ len(x) for x in header ]
+    for row in rows:
+        for i, value in enumerate(row[:len(widths)]):
+            widths[i] = max(widths[i], len(value))
+    lines = [ "  ".join([ x.ljust(w) for x, w in zip(header, widths) ]) ]
+    for row in rows:
+        lines.append("  ".join([ x.ljust(w) for x, w in zip(row, widths) ]))
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    logging.basicConfig(filename=None, level=logging.CRITICAL,
+                        format='%(asctime)s: %(levelname)-8s %(message)s',
+                        datefmt='%m-%d-%Y %H:%M:%S')
+
+    p = cpyutils.parameters.CmdLineParser("vmca-sweep", desc = "The VMCA parameter sweep utility", arguments = [
+            cpyutils.parameters.Parameter("-f", "--file", desc = "CSV file (it may be compressed with gzip) or binary snapshot file with the initial state of the hosts"),
+            cpyutils.parameters.Parameter("-e", "--events", desc = "Trace file with the events of the VMs"),
+            cpyutils.parameters.Parameter("-t", "--trace", desc = "Binary snapshot file whose first frame is the initial state and whose next frames are replayed as events (instead of -f and -e)"),
+            cpyutils.parameters.Parameter("-d", "--defraggers", desc = "Comma separated list of the classes of the defraggers", default = "vmca.firstfit.Defragger_FF"),
+            cpyutils.parameters.Parameter("-p", "--parameters", desc = "Values of the configuration variables, as NAME=value,value;NAME=value,... (e.g. STABLE_TIME=600,3600;WEIGHT_CPU=1,2)", default = ""),
+            cpyutils.parameters.Parameter("-n", "--samples", desc = "Number of combinations of a random search (default: the whole grid)", default = "0"),
+            cpyutils.parameters.Parameter("--seed", desc = "Seed for the random search and for the simulations", default = "0"),
+            cpyutils.parameters.Parameter("-u", "--until", desc = "Seconds of simulated time (default: until the last event of the trace)"),
+            cpyutils.parameters.Parameter("-j", "--processes", desc = "Number of worker processes (default: the number of cores)"),
+            cpyutils.parameters.Parameter("-s", "--sort", desc = "Metric to sort the table (%s)" % ", ".join(TABLE_METRICS), default = "host_hours_on"),
+            cpyutils.parameters.Parameter("-o", "--output", desc = "File to write all the reports in JSON format"),
+        ])
+
+    parsed, result, info = p.parse(sys.argv[1:])
+    if not parsed:
+        if (result is None):
+            print "Error:", info
+            sys.exit(-1)
+        else:
+            print info
+            sys.exit(0)
+
+    try:
+        samples = int(benchmark.get_value(result.values, '-n'))
+        seed = int(benchmark.get_value(result.values, '--seed'))
+        until = benchmark.get_value(result.values, '-u')
+        if until is not None:
+            until = float(until)
+        processes = benchmark.get_value(result.values, '-j')
+        if processes is not None:
+            processes = int(processes)
+    except:
+        print "Error: invalid numeric parameter"
+        sys.exit(-1)
+
+    try:
+        parameters = parse_parameters(benchmark.get_value(result.values, '-p'))
+    except ValueError, e:
+        print "Error: %s" % e
+        sys.exit(-1)
+
+    defraggers = [ x.strip() for x in benchmark.get_value(result.values, '-d').split(",") if x.strip() != "" ]
+    for classname in defraggers:
+        try:
+            benchmark.get_class(classname)
+        except:
+            print "could not use class %s" % classname
+            sys.exit(-1)
+
+    sort_by = benchmark.get_value(result.values, '-s')
+    if sort_by not in TABLE_METRICS:
+        print "Error: the table cannot be sorted by %s" % sort_by
+        sys.exit(-1)
+
+    filename = benchmark.get_value(result.values, '-f')
+    trace = benchmark.get_value(result.values, '-t')
+    if (filename is None) and (trace is None):
+        print "Error: you must provide the initial state of the hosts (-f) or a binary snapshot trace (-t)"
+        sys.exit(-1)
+
+    runs = create_runs(defraggers, parameters, samples, seed)
+    sys.stderr.write("running %d simulations\n" % len(runs))
+    def progress(report):
+        if 'error' in report:
+            sys.stderr.write("run %d failed: %s\n" % (report["run"], report["error"]))
+        else:
+            sys.stderr.write("run %d: %s %s (%.1fs)\n" % (report["run"], report["defragger"], report["parameters"], report["wall_time"]))
+
+    t_wall = time.time()
+    reports = sweep(runs, filename, benchmark.get_value(result.values, '-e'), trace, until, seed, processes, progress)
+    sys.stderr.write("%d simulations in %.1fs\n" % (len(reports), time.time() - t_wall))
+
+    print format_table(reports, [ name for name, _ in parameters ], sort_by)
+
+    output = benchmark.get_value(result.values, '-o')
+    if output is not None:
+        f = open(output, "w")
+        json.dump({ "parameters": dict(parameters), "defraggers": defraggers, "results": reports }, f, indent = 2, sort_keys = True)
+        f.close()
@@ -0,0 +1,389 @@
+# coding: utf-8
+#
+# Virtual Machine Consolidation Agent (VMCA)
+# Copyright (C) 2016 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Trace-driven simulation of VMCA: the VMs of a recorded trace arrive, depart and are resized on a FAKE_Deployment, while
+    the daemon defrags the deployment every DEFRAGGER_FREQUENCY seconds and executes the migration plans. The simulation
+    runs in the eventloop in non real-time mode, so weeks of simulated time take minutes.
+
+The trace is a text file (it may be compressed with gzip) with one event per line, sorted by time (in seconds since the
+    start of the simulation):
+
+    <time>;arrive;<vmid>;<cpu>;<memory>[;<resource>=<amount>...]
+    <time>;depart;<vmid>
+    <time>;resize;<vmid>;<cpu>;<memory>
+
+The events can also be obtained from the frames of a binary snapshot file (see vmca.snapshotfile), by comparing each
+    frame with the previous one. The report includes an energy proxy (the hours of the hosts that are powered on, i.e.
+    that have any VM), the migrations and SLA proxies (arrivals that could not be placed, hours of overloaded hosts because
+    of resizes and hours of VMs being migrated).
+'''
+import sys
+import logging
+import time
+import json
+import vmca.defragger
+import vmca.vmcaserver
+import vmca.snapshotfile
+import vmca.config
+import deployment
+import benchmark
+import cpyutils.eventloop
+import cpyutils.parameters
+
+class TraceEvent(object):
+    __slots__ = [ 'time', 'kind', 'vmid', 'cpu', 'memory', 'extra' ]
+
+    ARRIVAL = "arrive"
+    DEPARTURE = "depart"
+    RESIZE = "resize"
+
+    def __init__(self, t, kind, vmid, cpu = 0, memory = 0, extra = None):
+        self.time = t
+        self.kind = kind
+        self.vmid = vmid
+        self.cpu = cpu
+        self.memory = memory
+        self.extra = extra
+
+    def __str__(self):
+        return "%.2f;%s;%s;%f;%f" % (self.time, self.kind, self.vmid, self.cpu, self.memory)
+
+def read_trace(filename):
+    '''
+    @description Reads the events of a trace file line by line
+    @return a generator of TraceEvent
+    '''
+    f = vmca.defragger.open_csv(filename, "r")
+    try:
+        last_time = None
+        for n, l in enumerate(f):
+            l = l.strip()
+            if (l == "") or l.startswith("#"):
+                continue
+            fields = l.split(";")
+            t = float(fields[0])
+            if (last_time is not None) and (t < last_time):
+                raise ValueError("the events of the trace must be sorted by time (line %d)" % (n + 1))
+            last_time = t
+            kind = fields[1].strip().lower()
+            if kind == TraceEvent.DEPARTURE:
+                yield TraceEvent(t, kind, fields[2])
+            elif kind in [ TraceEvent.ARRIVAL, TraceEvent.RESIZE ]:
+                yield TraceEvent(t, kind, fields[2], float(fields[3]), float(fields[4]), vmca.defragger.HostsInfo._csv_extra(fields[5:]) or None)
+            else:
+                raise ValueError("unknown event %s (line %d)" % (kind, n + 1))
+    finally:
+        f.close()
+
+def events_from_snapshots(reader):
+    '''
+    @description Obtains the events that transform each frame of the snapshot file in the next one (the first frame is the
+        initial state of the deployment, and the times are relative to it)
+    @return a generator of TraceEvent
+    '''
+    previous = None
+    t0 = None
+    for frame in reader:
+        vms = dict([ (vm.id, vm) for vm in frame.hosts_info().get_vms() ])
+        if previous is None:
+            t0 = frame.timestamp
+        else:
+            t = frame.timestamp - t0
+            for vmid in sorted(previous.keys()):
+                if vmid not in vms:
+                    yield TraceEvent(t, TraceEvent.DEPARTURE, vmid)
+            for vmid in sorted(vms.keys()):
+                vm = vms[vmid]
+                if vmid not in previous:
+                    yield TraceEvent(t, TraceEvent.ARRIVAL, vmid, vm.cpu, vm.memory, vm.extra or None)
+                elif (vm.cpu != previous[vmid].cpu) or (vm.memory != previous[vmid].memory):
+                    yield TraceEvent(t, TraceEvent.RESIZE, vmid, vm.cpu, vm.memory)
+        previous = vms
+
+class HostUsage:
+    '''
+    Integrates over the simulated time the number of hosts that are powered on (i.e. that have any VM; the VMs are in the
+        destination host from the start of their migration) and the number of overloaded hosts. The deployment notifies
+        the hosts that are going to change and the hosts that have changed, so the accounting is incremental.
+    '''
+    def __init__(self, now):
+        self.active = 0
+        self.overloaded = 0
+        self.max_active = 0
+        self.active_seconds = 0.0
+        self.overloaded_seconds = 0.0
+        self._start = now
+        self._last = now
+
+    @staticmethod
+    def _is_overloaded(h):
+        if (h.cpu_free < 0) or (h.memory_free < 0):
+            return True
+        for amount in h.extra_free.values():
+            if amount < 0:
+                return True
+        return False
+
+    def advance(self, now):
+        self.active_seconds += self.active * (now - self._last)
+        self.overloaded_seconds += self.overloaded * (now - self._last)
+        self._last = now
+
+    def changing(self, hosts, h_ids):
+        self.advance(cpyutils.eventloop.now())
+        for h_id in set(h_ids):
+            h = hosts[h_id]
+            self.active -= int(len(h.vm_list) > 0)
+            self.overloaded -= int(self._is_overloaded(h))
+
+    def changed(self, hosts, h_ids):
+        for h_id in set(h_ids):
+            h = hosts[h_id]
+            self.active += int(len(h.vm_list) > 0)
+            self.overloaded += int(self._is_overloaded(h))
+        self.max_active = max(self.max_active, self.active)
+
+    def elapsed(self):
+        return self._last - self._start
+
+class TraceSimulation:
+    '''
+    Replays the events of a trace on a FAKE_Deployment. Only the next event of the trace is programmed in the eventloop at
+        each moment (the eventloop sorts its events each time that it executes one), so the length of the trace does not
+        slow down the simulation.
+    '''
+    def __init__(self, fake_deployment, defragger, events, defrag_frequency = None, until = None):
+        '''
+        @param events an iterable of TraceEvent, sorted by time (e.g. the generator of read_trace)
+        @param defrag_frequency seconds between the calls to the defragger (DEFRAGGER_FREQUENCY if it is None and ENABLE_DEFRAGGER
+            is set; 0 disables it)
+        @param until seconds of simulated time (the time of the last event of the trace if it is None)
+        '''
+        self._deployment = fake_deployment
+        self._daemon = vmca.vmcaserver.Daemon(fake_deployment, defragger)
+        self._events = iter(events)
+        self._next_event = None
+        self._defrag_frequency = defrag_frequency
+        if self._defrag_frequency is None:
+            # As the daemon, the defragger is only called periodically if it is enabled
+            self._defrag_frequency = 0
+            if vmca.config.config_vmca.ENABLE_DEFRAGGER:
+                self._defrag_frequency = vmca.config.config_vmca.DEFRAGGER_FREQUENCY
+        self._until = until
+        self._start = 0
+        self._end = None
+        self.usage = None
+        self._host_count = 0
+        self.counters = { TraceEvent.ARRIVAL: 0, TraceEvent.DEPARTURE: 0, TraceEvent.RESIZE: 0, "rejected_arrivals": 0, "ignored_events": 0 }
+        self.defrag_count = 0
+        self.defrag_time = 0.0
+
+    def _apply(self, event):
+        if event.kind == TraceEvent.ARRIVAL:
+            if self._deployment.has_vm(event.vmid):
+                logging.warning("vm %s arrives but it already exists" % event.vmid)
+                self.counters["ignored_events"] += 1
+                return
+            vm = vmca.defragger.VMData(event.vmid, event.cpu, event.memory, None, extra = event.extra)
+            if self._deployment.create_vm(vm) is None:
+                logging.info("(T: %.2f) vm %s does not fit in any host" % (cpyutils.eventloop.now(), event.vmid))
+                self.counters["rejected_arrivals"] += 1
+                return
+        elif event.kind == TraceEvent.DEPARTURE:
+            if not self._deployment.destroy_vm(event.vmid):
+                self.counters["ignored_events"] += 1
+                return
+        elif event.kind == TraceEvent.RESIZE:
+            if not self._deployment.resize_vm(event.vmid, event.cpu, event.memory):
+                self.counters["ignored_events"] += 1
+                return
+        self.counters[event.kind] += 1
+
+    def _program_next_event(self):
+        eventloop = cpyutils.eventloop.get_eventloop()
+        if self._next_event is not None:
+            delay = max(0, self._start + self._next_event.time - cpyutils.eventloop.now())
+            eventloop.add_event(cpyutils.eventloop.Event(delay, description = "trace event", callback = self._trace_step, mute = True))
+        elif self._until is None:
+            self._end = cpyutils.eventloop.now()
+            eventloop.limit_walltime(0)
+
+    def _trace_step(self):
+        # All the events of the trace that happen at this moment are applied at once
+        now = cpyutils.eventloop.now()
+        while (self._next_event is not None) and (self._start + self._next_event.time <= now):
+            self._apply(self._next_event)
+            self._next_event = next(self._events, None)
+        self._program_next_event()
+
+    def _defrag(self):
+        t = time.time()
+        self._daemon.defrag()
+        self.defrag_time += time.time() - t
+        self.defrag_count += 1
+
+    def run(self):
+        '''
+        @description Runs the simulation in the current eventloop (it must have been created in non real-time mode)
+        @return a dictionary with the metrics of the simulation
+        '''
+        eventloop = cpyutils.eventloop.get_eventloop()
+        t_wall = time.time()
+        self._start = cpyutils.eventloop.now()
+        self._host_count = len(self._deployment.get_info().keys())
+        self.usage = HostUsage(self._start)
+        self._deployment.set_usage(self.usage)
+
+        if self._until is not None:
+            self._end = self._start + self._until
+            eventloop.limit_walltime(self._until)
+        if self._defrag_frequency > 0:
+            eventloop.add_event(cpyutils.eventloop.Event_Periodical(self._defrag_frequency, self._defrag_frequency, description = "defrag", callback = self._defrag, mute = True))
+        self._next_event = next(self._events, None)
+        self._program_next_event()
+        eventloop.loop()
+
+        self.usage.advance(self._end)
+        self._deployment.set_usage(None)
+        return self.report(time.time() - t_wall)
+
+    def report(self, wall_time):
+        simulated = self.usage.elapsed()
+        hours = lambda seconds: seconds / 3600.0
+        mean_active_hosts = 0.0
+        if simulated > 0:
+            mean_active_hosts = self.usage.active_seconds / simulated
+        return {
+            "simulated_hours": hours(simulated),
+            "wall_time": wall_time,
+            "hosts": self._host_count,
+            "vms_final": self._deployment.vmcount(),
+            "arrivals": self.counters[TraceEvent.ARRIVAL],
+            "departures": self.counters[TraceEvent.DEPARTURE],
+            "resizes": self.counters[TraceEvent.RESIZE],
+            "ignored_events": self.counters["ignored_events"],
+            "host_hours_on": hours(self.usage.active_seconds),
+            "mean_active_hosts": mean_active_hosts,
+            "max_active_hosts": self.usage.max_active,
+            "active_hosts_final": self.usage.active,
+            "defrag_runs": self.defrag_count,
+            "defrag_wall_time": self.defrag_time,
+            "migrations": self._deployment.migration_count,
+            "rejected_arrivals": self.counters["rejected_arrivals"],
+            "overloaded_host_hours": hours(self.usage.overloaded_seconds),
+            "migrating_vm_hours": hours(self._deployment.migration_time),
+        }
+
+def load_deployment(filename, frame = 0):
+    '''
+    @return the FAKE_Deployment with the hosts of the file (a CSV file, that may be compressed, or a frame of a binary snapshot file)
+    '''
+    if vmca.snapshotfile.is_snapshot_file(filename):
+        reader = vmca.snapshotfile.SnapshotReader(filename)
+        hosts_info = reader.frame(frame).hosts_info()
+        reader.close()
+    else:
+        hosts_info = vmca.defragger.HostsInfo.createfromfile(filename)
+    return deployment.FAKE_Deployment.create_from_hosts_info(hosts_info)
+
+def load_simulation(filename = None, events_file = None, trace = None):
+    '''
+    @description Loads the initial state of the deployment and the events to replay, either from a file with the hosts and a
+        trace file, or from a binary snapshot trace. The VMs of the initial state are stable, but the VMs that arrive must wait
+        STABLE_TIME to be moved (the eventloop must have been created)
+    @return the FAKE_Deployment and the iterable of TraceEvent
+    '''
+    if trace is not None:
+        fake_deployment = load_deployment(trace)
+        events = events_from_snapshots(vmca.snapshotfile.SnapshotReader(trace))
+    else:
+        if filename is None:
+            raise ValueError("the initial state of the hosts or a binary snapshot trace is needed")
+        fake_deployment = load_deployment(filename)
+        events = []
+        if events_file is not None:
+            events = read_trace(events_file)
+
+    fake_deployment.get_info()
+    fake_deployment.stabilize_vms(vmca.config.config_vmca.STABLE_TIME)
+    return fake_deployment, events
+
+if __name__ == "__main__":
+    logging.basicConfig(filename=None, level=logging.CRITICAL,
+                        format='%(asctime)s: %(levelname)-8s %(message)s',
+                        datefmt='%m-%d-%Y %H:%M:%S')
+    # The eventloop logs each event that it executes, and a long simulation executes millions of them
+    logging.getLogger("[ELOOP]").setLevel(logging.CRITICAL)
+    cpyutils.eventloop.create_eventloop(False)
+    vmca.config.config_vmca.ENABLE_MIGRATION = True
+
+    p = cpyutils.parameters.CmdLineParser("vmca-tracesim", desc = "The VMCA trace-driven simulation utility", arguments = [
+            cpyutils.parameters.Parameter("-f", "--file", desc = "CSV file (it may be compressed with gzip) or binary snapshot file with the initial state of the hosts"),
+            cpyutils.parameters.Parameter("-e", "--events", desc = "Trace file with the events of the VMs"),
+            cpyutils.parameters.Parameter("-t", "--trace", desc = "Binary snapshot file whose first frame is the initial state and whose next frames are replayed as events (instead of -f and -e)"),
+            cpyutils.parameters.Parameter("-d", "--defragger", desc = "Class of the defragger to use", default = "vmca.firstfit.Defragger_FF"),
+            cpyutils.parameters.Parameter("--frequency", desc = "Seconds between calls to the defragger (default: DEFRAGGER_FREQUENCY; 0 disables the defragger)"),
+            cpyutils.parameters.Parameter("-u", "--until", desc = "Seconds of simulated time (default: until the last event of the trace)"),
+            cpyutils.parameters.Parameter("-o", "--output", desc = "File to write the report in JSON format (default: standard output)"),
+        ])
+
+    parsed, result, info = p.parse(sys.argv[1:])
+    if not parsed:
+        if (result is None):
+            print "Error:", info
+            sys.exit(-1)
+        else:
+            print info
+            sys.exit(0)
+
+    try:
+        fake_deployment, events = load_simulation(benchmark.get_value(result.values, '-f'), benchmark.get_value(result.values, '-e'), benchmark.get_value(result.values, '-t'))
+    except Exception, e:
+        print "Error: could not load the deployment or the trace (%s)" % e
+        sys.exit(-1)
+
+    try:
+        frequency = benchmark.get_value(result.values, '--frequency')
+        if frequency is not None:
+            frequency = float(frequency)
+        until = benchmark.get_value(result.values, '-u')
+        if until is not None:
+            until = float(until)
+    except:
+        print "Error: invalid numeric parameter"
+        sys.exit(-1)
+
+    classname = benchmark.get_value(result.values, '-d')
+    try:
+        defragger = benchmark.get_class(classname)()
+    except:
+        print "could not use class %s" % classname
+        sys.exit(-1)
+
+    simulation = TraceSimulation(fake_deployment, defragger, events, frequency, until)
+    report = simulation.run()
+    report["defragger"] = classname
+
+    output = benchmark.get_value(result.values, '-o')
+    if output is None:
+        print json.dumps(report, indent = 2, sort_keys = True)
+    else:
+        f = open(output, "w")
+        json.dump(report, f, indent = 2, sort_keys = True)
+        f.close()
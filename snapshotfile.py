@@ -0,0 +1,449 @@
+# coding: utf-8
+#
+# Virtual Machine Consolidation Agent (VMCA)
+# Copyright (C) 2015 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Binary snapshots of the hosts and the VMs (HostsInfo), that are read by means of mmap.
+
+A snapshot file contains a sequence of frames (i.e. a trace of the deployment), each one with the state of the hosts
+    and their VMs at some timestamp. All the values are little-endian and the sections are aligned to 8 bytes:
+
+* file header: magic, version of the format, number of frames and offset of the directory of frames
+* frame: header with the counts and the offsets of the sections, and the sections:
+    - table of the hosts (fixed-width records, see HOST_RECORD) and table of the VMs (see VM_RECORD), where the
+      VMs of each host are consecutive
+    - names of the additional resources, and matrices hosts x resources (total and free amount) and VMs x resources
+      (the amount needed); NaN means that the resource is not declared
+    - the sets of keywords (shared by the hosts and VMs that have the same dictionary) and their entries
+    - the string table (offsets and data) for the names of the hosts, the ids of the VMs and the keywords
+* directory: the timestamp and the offset of each frame
+
+The values of the keywords are kept if they are str, int, long, float or bool (any other value is stored as its str).
+    The hosts are restored as HostData, so the attributes of the subclasses are not stored.
+'''
+import defragger
+import struct
+import mmap
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = "VMCASNAP"
+VERSION = 1
+
+class SnapshotFormatException(Exception): pass
+
+_FILE_HEADER = struct.Struct("<8sIIQQ")
+_DIRECTORY_ENTRY = struct.Struct("<dQ")
+# timestamp, hosts, vms, resources, strings, keyword sets, keywords and the offsets of the 10 sections
+_FRAME_HEADER = struct.Struct("<d6Q10Q")
+# name, keyword set, maxvms, cpu total, cpu free, memory total, memory free, first vm, vm count
+HOST_RECORD = struct.Struct("<QQqddddQQ")
+# kind of id (0 str, 1 int), id (int or string), keyword set, cpu, memory, timestamp_state, state, host
+VM_RECORD = struct.Struct("<qqQdddqQ")
+# name, kind of value (0 str, 1 int, 2 float, 3 bool) and value (int or string, or float)
+_KEYWORD_INT = struct.Struct("<QQq")
+_KEYWORD_FLOAT = struct.Struct("<QQd")
+_OFFSET = struct.Struct("<Q")
+
+_ID_STR = 0
+_ID_INT = 1
+_VALUE_STR = 0
+_VALUE_INT = 1
+_VALUE_FLOAT = 2
+_VALUE_BOOL = 3
+
+if numpy is not None:
+    HOST_DTYPE = numpy.dtype([ ('name', '<u8'), ('keywords', '<u8'), ('maxvms', '<i8'), ('cpu_total', '<f8'), ('cpu_free', '<f8'),
+                               ('memory_total', '<f8'), ('memory_free', '<f8'), ('first_vm', '<u8'), ('vm_count', '<u8') ])
+    VM_DTYPE = numpy.dtype([ ('id_kind', '<i8'), ('id', '<i8'), ('keywords', '<u8'), ('cpu', '<f8'), ('memory', '<f8'),
+                             ('timestamp_state', '<f8'), ('state', '<i8'), ('host', '<u8') ])
+
+def is_snapshot_file(filename):
+    '''
+    @return True if the file is a binary snapshot (instead of, e.g., a CSV file)
+    '''
+    f = open(filename, "rb")
+    magic = f.read(len(MAGIC))
+    f.close()
+    return magic == MAGIC
+
+def _pad(f):
+    position = f.tell()
+    if position % 8 != 0:
+        f.write("\0" * (8 - position % 8))
+    return f.tell()
+
+class _StringTable:
+    def __init__(self):
+        self._index = {}
+        self.strings = []
+
+    def add(self, s):
+        if isinstance(s, unicode):
+            s = s.encode("utf-8")
+        else:
+            s = str(s)
+        i = self._index.get(s, None)
+        if i is None:
+            i = len(self.strings)
+            self._index[s] = i
+            self.strings.append(s)
+        return i
+
+class SnapshotWriter:
+    '''
+    Writes the frames of a snapshot file, one after the other (the directory is written when the file is closed)
+    '''
+    def __init__(self, filename, append = False):
+        '''
+        @param append if True, the frames are added to the existing file (if it exists)
+        '''
+        self._directory = []
+        self._f = None
+        if append:
+            try:
+                reader = SnapshotReader(filename)
+                self._directory = [ (reader.timestamp(i), reader.frame_offset(i)) for i in range(len(reader)) ]
+                directory_offset = reader.directory_offset()
+                reader.close()
+                self._f = open(filename, "r+b")
+                # The new frames overwrite the old directory
+                self._f.seek(directory_offset)
+                self._f.truncate()
+            except IOError:
+                self._f = None
+        if self._f is None:
+            self._f = open(filename, "wb")
+            self._f.write(_FILE_HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+
+    def write(self, hosts_info, timestamp = 0.0):
+        '''
+        @description Writes the state of the hosts in hosts_info as a new frame
+        '''
+        f = self._f
+        frame_offset = _pad(f)
+        f.write("\0" * _FRAME_HEADER.size)
+
+        strings = _StringTable()
+        keyword_sets = [ {} ]
+        keyword_set_index = {}
+        def keyword_set(keywords):
+            if len(keywords) == 0:
+                return 0
+            i = keyword_set_index.get(id(keywords), None)
+            if i is None:
+                i = len(keyword_sets)
+                keyword_set_index[id(keywords)] = i
+                keyword_sets.append(keywords)
+            return i
+
+        h_ids = sorted(hosts_info.keys())
+        resources = set()
+        for h_id in h_ids:
+            h = hosts_info[h_id]
+            resources.update(h.extra_total.keys())
+            for vm in h.vm_list:
+                resources.update(vm.extra.keys())
+        resources = sorted(resources)
+
+        offsets = []
+        offsets.append(_pad(f))
+        for name in resources:
+            f.write(_OFFSET.pack(strings.add(name)))
+
+        offsets.append(_pad(f))
+        vm_count = 0
+        for h_id in h_ids:
+            h = hosts_info[h_id]
+            f.write(HOST_RECORD.pack(strings.add(h_id), keyword_set(h.keywords), h.maxvms, h.cpu_total, h.cpu_free, h.memory_total,
+                                     h.memory_free, vm_count, len(h.vm_list)))
+            vm_count += len(h.vm_list)
+
+        offsets.append(_pad(f))
+        for i_host, h_id in enumerate(h_ids):
+            for vm in hosts_info[h_id].vm_list:
+                if isinstance(vm.id, (int, long)):
+                    id_kind, id_value = _ID_INT, vm.id
+                else:
+                    id_kind, id_value = _ID_STR, strings.add(vm.id)
+                f.write(VM_RECORD.pack(id_kind, id_value, keyword_set(vm.keywords), vm.cpu, vm.memory, vm.timestamp_state, vm.state, i_host))
+
+        nan = float("nan")
+        row = struct.Struct("<%dd" % len(resources))
+        offsets.append(_pad(f))
+        for h_id in h_ids:
+            extra = hosts_info[h_id].extra_total
+            f.write(row.pack(*[ extra.get(name, nan) for name in resources ]))
+        offsets.append(_pad(f))
+        for h_id in h_ids:
+            h = hosts_info[h_id]
+            f.write(row.pack(*[ h.extra_free.get(name, nan) if name in h.extra_total else nan for name in resources ]))
+        offsets.append(_pad(f))
+        for h_id in h_ids:
+            for vm in hosts_info[h_id].vm_list:
+                f.write(row.pack(*[ vm.extra.get(name, nan) for name in resources ]))
+
+        # The sets of keywords are written once all of them have been found
+        offsets.append(_pad(f))
+        keyword_count = 0
+        for keywords in keyword_sets:
+            f.write(_OFFSET.pack(keyword_count))
+            keyword_count += len(keywords)
+        f.write(_OFFSET.pack(keyword_count))
+        offsets.append(_pad(f))
+        for keywords in keyword_sets:
+            for name in sorted(keywords.keys()):
+                value = keywords[name]
+                if isinstance(value, bool):
+                    f.write(_KEYWORD_INT.pack(strings.add(name), _VALUE_BOOL, int(value)))
+                elif isinstance(value, (int, long)):
+                    f.write(_KEYWORD_INT.pack(strings.add(name), _VALUE_INT, value))
+                elif isinstance(value, float):
+                    f.write(_KEYWORD_FLOAT.pack(strings.add(name), _VALUE_FLOAT, value))
+                else:
+                    f.write(_KEYWORD_INT.pack(strings.add(name), _VALUE_STR, strings.add(value)))
+
+        offsets.append(_pad(f))
+        position = 0
+        for s in strings.strings:
+            f.write(_OFFSET.pack(position))
+            position += len(s)
+        f.write(_OFFSET.pack(position))
+        offsets.append(_pad(f))
+        for s in strings.strings:
+            f.write(s)
+
+        end = _pad(f)
+        f.seek(frame_offset)
+        f.write(_FRAME_HEADER.pack(timestamp, len(h_ids), vm_count, len(resources), len(strings.strings), len(keyword_sets),
+                                   keyword_count, *offsets))
+        f.seek(end)
+        self._directory.append((timestamp, frame_offset))
+
+    def close(self):
+        f = self._f
+        directory_offset = _pad(f)
+        for timestamp, frame_offset in self._directory:
+            f.write(_DIRECTORY_ENTRY.pack(timestamp, frame_offset))
+        f.seek(0)
+        f.write(_FILE_HEADER.pack(MAGIC, VERSION, 0, len(self._directory), directory_offset))
+        f.close()
+
+def write_snapshot(filename, hosts_info, timestamp = 0.0):
+    '''
+    @description Writes a snapshot file with a single frame
+    '''
+    writer = SnapshotWriter(filename)
+    writer.write(hosts_info, timestamp)
+    writer.close()
+
+class SnapshotFrame:
+    '''
+    The state of the hosts in one frame of a snapshot file. Nothing is read until it is needed, and the tables are
+        read directly from the mapped file
+    '''
+    def __init__(self, mm, offset):
+        self._mm = mm
+        header = _FRAME_HEADER.unpack_from(mm, offset)
+        (self.timestamp, self.host_count, self.vm_count, self._resource_count, self._string_count, self._keyword_set_count,
+            self._keyword_count) = header[:7]
+        (self._resources_offset, self._hosts_offset, self._vms_offset, self._host_extra_total_offset, self._host_extra_free_offset,
+            self._vm_extra_offset, self._keyword_sets_offset, self._keywords_offset, self._string_offsets_offset,
+            self._strings_offset) = header[7:]
+        self._row = struct.Struct("<%dd" % self._resource_count)
+        self._strings = {}
+        self._keyword_sets = {}
+        self._vm_extras = {}
+        self.resources = [ self.string(_OFFSET.unpack_from(mm, self._resources_offset + i * _OFFSET.size)[0]) for i in range(self._resource_count) ]
+
+    def string(self, i):
+        s = self._strings.get(i, None)
+        if s is None:
+            start, end = struct.unpack_from("<QQ", self._mm, self._string_offsets_offset + i * _OFFSET.size)
+            s = self._mm[self._strings_offset + start:self._strings_offset + end]
+            self._strings[i] = s
+        return s
+
+    def keywords(self, i):
+        '''
+        @return the dictionary of keywords i (the hosts and VMs that had the same dictionary share it again)
+        '''
+        if i == 0:
+            return None
+        keywords = self._keyword_sets.get(i, None)
+        if keywords is None:
+            keywords = {}
+            start, end = struct.unpack_from("<QQ", self._mm, self._keyword_sets_offset + i * _OFFSET.size)
+            for j in range(start, end):
+                offset = self._keywords_offset + j * _KEYWORD_INT.size
+                name, kind, value = _KEYWORD_INT.unpack_from(self._mm, offset)
+                if kind == _VALUE_STR:
+                    value = self.string(value)
+                elif kind == _VALUE_FLOAT:
+                    value = _KEYWORD_FLOAT.unpack_from(self._mm, offset)[2]
+                elif kind == _VALUE_BOOL:
+                    value = bool(value)
+                keywords[self.string(name)] = value
+            self._keyword_sets[i] = keywords
+        return keywords
+
+    def _extra(self, offset, i):
+        if self._resource_count == 0:
+            return {}
+        values = self._row.unpack_from(self._mm, offset + i * self._row.size)
+        return dict([ (name, value) for name, value in zip(self.resources, values) if not math.isnan(value) ])
+
+    def _vm_extra(self, i):
+        '''
+        @return the additional resources of the VM i (the VMs that need the same amounts share the dictionary, as the
+            copies of a VM do)
+        '''
+        if self._resource_count == 0:
+            return None
+        offset = self._vm_extra_offset + i * self._row.size
+        row = self._mm[offset:offset + self._row.size]
+        if row not in self._vm_extras:
+            self._vm_extras[row] = self._extra(self._vm_extra_offset, i) or None
+        return self._vm_extras[row]
+
+    def hosts_table(self):
+        '''
+        @return a numpy record array with the table of the hosts (see HOST_DTYPE), that is a view of the mapped file
+        '''
+        return numpy.frombuffer(self._mm, dtype = HOST_DTYPE, count = self.host_count, offset = self._hosts_offset)
+
+    def vms_table(self):
+        '''
+        @return a numpy record array with the table of the VMs (see VM_DTYPE), that is a view of the mapped file
+        '''
+        return numpy.frombuffer(self._mm, dtype = VM_DTYPE, count = self.vm_count, offset = self._vms_offset)
+
+    def extra_tables(self):
+        '''
+        @return the numpy matrices (views of the mapped file) with the total and free amount of the additional resources
+            of the hosts and the amount needed by the VMs (the columns are the resources, in the order of self.resources)
+        '''
+        n = self._resource_count
+        return (numpy.frombuffer(self._mm, dtype = '<f8', count = self.host_count * n, offset = self._host_extra_total_offset).reshape((self.host_count, n)),
+                numpy.frombuffer(self._mm, dtype = '<f8', count = self.host_count * n, offset = self._host_extra_free_offset).reshape((self.host_count, n)),
+                numpy.frombuffer(self._mm, dtype = '<f8', count = self.vm_count * n, offset = self._vm_extra_offset).reshape((self.vm_count, n)))
+
+    def host_names(self):
+        return [ self.string(HOST_RECORD.unpack_from(self._mm, self._hosts_offset + i * HOST_RECORD.size)[0]) for i in range(self.host_count) ]
+
+    def hosts_info(self, host_class = defragger.HostsInfo):
+        '''
+        @description Restores the structure of the hosts of the frame (the resources are not normalized)
+        @param host_class the class of the structure (e.g. a subclass of HostsInfo used by the simulator)
+        '''
+        mm = self._mm
+        if numpy is not None:
+            host_records = self.hosts_table().tolist()
+            vm_records = self.vms_table().tolist()
+        else:
+            host_records = [ HOST_RECORD.unpack_from(mm, self._hosts_offset + i * HOST_RECORD.size) for i in range(self.host_count) ]
+            vm_records = [ VM_RECORD.unpack_from(mm, self._vms_offset + j * VM_RECORD.size) for j in range(self.vm_count) ]
+
+        hosts = {}
+        for i, (name, keywords, maxvms, cpu_total, cpu_free, memory_total, memory_free, first_vm, vm_count) in enumerate(host_records):
+            h_id = self.string(name)
+            h = defragger.HostData(h_id, cpu_total, memory_total, self.keywords(keywords))
+            h.maxvms = maxvms
+            for resource, total in self._extra(self._host_extra_total_offset, i).items():
+                h.set_extra_resource(resource, total)
+            vms = []
+            for j in range(first_vm, first_vm + vm_count):
+                (id_kind, vmid, keywords, cpu, memory, timestamp_state, state, _) = vm_records[j]
+                if id_kind == _ID_STR:
+                    vmid = self.string(vmid)
+                vm = defragger.VMData(vmid, cpu, memory, h_id, self.keywords(keywords), self._vm_extra(j))
+                vm.timestamp_state = timestamp_state
+                vm.state = state
+                vms.append(vm)
+            h.add_vms(vms)
+            # The free resources are restored as they were stored (e.g. the capacity may have been reduced)
+            h.cpu_free = cpu_free
+            h.memory_free = memory_free
+            h.extra_free = self._extra(self._host_extra_free_offset, i)
+            hosts[h_id] = h
+
+        # The hosts have just been created, so they are not cloned by the constructor
+        hosts_info = host_class({})
+        hosts_info._hosts_info = hosts
+        return hosts_info
+
+class SnapshotReader:
+    '''
+    Reads a snapshot file by means of mmap: opening the file only reads its header and the directory of frames, and the
+        frames are read when they are used
+    '''
+    def __init__(self, filename):
+        self._file = open(filename, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            self._file.close()
+            raise SnapshotFormatException("%s is not a snapshot file" % filename)
+
+        if len(self._mm) < _FILE_HEADER.size:
+            self.close()
+            raise SnapshotFormatException("%s is not a snapshot file" % filename)
+        magic, version, _, self._frame_count, self._directory_offset = _FILE_HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise SnapshotFormatException("%s is not a snapshot file" % filename)
+        if version != VERSION:
+            self.close()
+            raise SnapshotFormatException("the version %d of the snapshot file %s is not supported" % (version, filename))
+        if self._directory_offset == 0:
+            self.close()
+            raise SnapshotFormatException("the snapshot file %s is incomplete (it was not closed)" % filename)
+
+    def __len__(self):
+        return self._frame_count
+
+    def directory_offset(self):
+        return self._directory_offset
+
+    def _directory_entry(self, i):
+        if (i < 0) or (i >= self._frame_count):
+            raise IndexError("frame %d not in the snapshot file" % i)
+        return _DIRECTORY_ENTRY.unpack_from(self._mm, self._directory_offset + i * _DIRECTORY_ENTRY.size)
+
+    def timestamp(self, i):
+        return self._directory_entry(i)[0]
+
+    def frame_offset(self, i):
+        return self._directory_entry(i)[1]
+
+    def frame(self, i):
+        return SnapshotFrame(self._mm, self.frame_offset(i))
+
+    def __iter__(self):
+        for i in range(self._frame_count):
+            yield self.frame(i)
+
+    def close(self):
+        '''
+        @description Closes the file (the numpy views of the frames must not be used once it is closed)
+        '''
+        self._mm.close()
+        self._file.close()
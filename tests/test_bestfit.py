@@ -0,0 +1,61 @@
+# coding: utf-8
+#
+# Virtual Machine Consolidation Agent (VMCA)
+# Copyright (C) 2016 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Tests of the best-fit defraggers: the hosts to empty evaluated in a pool of processes must give the same plans as the
+    hosts evaluated in the main process, and the plan returned when the time budget expires must be valid.
+'''
+import unittest
+import testutils
+import bestfit
+
+class TestPool(unittest.TestCase):
+    def test_same_plan_as_main_process(self):
+        # The defragger is defined here (so it cannot be pickled) as the defraggers that are composed in vmcad.py
+        class Defragger_BF(bestfit.MigrationList_Variance, bestfit.Defragger_BF_Reward): pass
+
+        for seed in range(2):
+            hosts_info = testutils.create_random_hosts_info(20, seed)
+            plans = []
+            for processes in [ 1, 2 ]:
+                testutils.set_config(self, DEFRAGGER_PROCESSES = processes)
+                plans.append(testutils.plan_to_str(Defragger_BF().defrag(hosts_info)))
+            self.assertTrue(len(plans[0]) > 0)
+            self.assertEqual(plans[0], plans[1])
+
+class TestTimeBudget(unittest.TestCase):
+    def test_expired(self):
+        class Defragger_BF(bestfit.MigrationList_Variance, bestfit.Defragger_BF_Reward): pass
+
+        hosts_info = testutils.create_random_hosts_info(20, 0)
+        d = Defragger_BF()
+        self.assertTrue(len(d.defrag(hosts_info)) > 1)
+        self.assertTrue(d.converged())
+
+        # The budget expires once the first host has been evaluated, so its migration list is the only one in the plan
+        d.set_time_budget(1e-9)
+        migration_plan = d.defrag(hosts_info)
+        self.assertFalse(d.converged())
+        self.assertEqual(len(migration_plan), 1)
+        self.assertTrue(len(migration_plan[0]) > 0)
+        moved = hosts_info.clone()
+        self.assertTrue(testutils.apply_plan(moved, migration_plan))
+        self.assertFalse(testutils.is_overloaded(moved))
+
+if __name__ == '__main__':
+    unittest.main()
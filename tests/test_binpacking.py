@@ -0,0 +1,91 @@
+# coding: utf-8
+#
+# Virtual Machine Consolidation Agent (VMCA)
+# Copyright (C) 2016 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Tests of the lower bounds and of the branch-and-bound defragger: its plans must be valid and they must not use more
+    hosts than the first fit.
+'''
+import unittest
+import testutils
+import binpacking
+
+def active_hosts(hosts_info, migration_plan):
+    '''
+    @return the number of hosts with VMs after making the plan, or None if the plan cannot be made or it overloads any host
+    '''
+    hosts_info = hosts_info.clone()
+    if not testutils.apply_plan(hosts_info, migration_plan) or testutils.is_overloaded(hosts_info):
+        return None
+    return len(hosts_info.keys()) - hosts_info.empty_hosts()
+
+class TestLowerBound(unittest.TestCase):
+    def test_l2_lower_bound(self):
+        self.assertEqual(binpacking.l2_lower_bound([], 10), 0)
+        self.assertEqual(binpacking.l2_lower_bound([ 6, 6, 6, 4, 4, 4 ], 10), 3)
+        self.assertEqual(binpacking.l2_lower_bound([ 7, 7, 7 ], 10), 3)
+        # The sum of the sizes would need 5 bins, but no two items greater than the half fit together
+        self.assertEqual(binpacking.l2_lower_bound([ 5.5 ] * 4 + [ 4.5 ] * 4, 10), 4)
+
+    def test_active_hosts_lower_bound(self):
+        hosts_info = testutils.create_hosts_info([ [ 3, 2, 4 ], [ 2, 2, 4 ], [ 7 ], [ 3, 5 ], [ 3, 2, 3 ] ], 10, 100000)
+        self.assertEqual(binpacking.active_hosts_lower_bound(hosts_info), 4)
+
+class TestBinPacking(unittest.TestCase):
+    # The first fit cannot empty any host of this placement, but the VMs fit in 4 hosts
+    PLACEMENT = [ [ 3, 2, 4 ], [ 2, 2, 4 ], [ 7 ], [ 3, 5 ], [ 3, 2, 3 ] ]
+
+    def test_better_than_first_fit(self):
+        hosts_info = testutils.create_hosts_info(self.PLACEMENT, 10, 100000)
+        self.assertEqual(active_hosts(hosts_info, testutils.Defragger_FF().defrag(hosts_info)), 5)
+        d = binpacking.Defragger_BinPacking()
+        self.assertEqual(active_hosts(hosts_info, d.defrag(hosts_info)), 4)
+        self.assertTrue(d.converged())
+        self.assertEqual(d.lower_bound, 4)
+
+    def test_not_worse_than_first_fit(self):
+        for seed in range(4):
+            hosts_info = testutils.create_random_hosts_info(10, seed, cpu = 8, memory = 16384)
+            original = hosts_info.csv()
+            first_fit = active_hosts(hosts_info, testutils.Defragger_FF().defrag(hosts_info))
+            lower_bound = binpacking.active_hosts_lower_bound(hosts_info)
+            # The search may not converge, so it is limited to keep the test short (the plan must be valid anyway)
+            active = active_hosts(hosts_info, binpacking.Defragger_BinPacking(20000).defrag(hosts_info))
+            self.assertTrue(active is not None)
+            self.assertTrue(lower_bound <= active <= first_fit)
+            self.assertEqual(hosts_info.csv(), original)
+
+    def test_hosts_fixed(self):
+        hosts_info = testutils.create_hosts_info(self.PLACEMENT, 10, 100000)
+        migration_plan = binpacking.Defragger_BinPacking().defrag(hosts_info, hosts_fixed = [ 0, 1 ])
+        self.assertTrue(active_hosts(hosts_info, migration_plan) is not None)
+        for migration_list in migration_plan:
+            for migration in migration_list:
+                self.assertTrue(migration.host_src not in [ 0, 1 ])
+
+    def test_migrations_to_intermediate_hosts(self):
+        # Emptying host 2 by moving vm 0 to it and vm 5 to host 0 is a cycle that needs a migration to an intermediate
+        #   host, while moving vm 0 to host 1 and vm 1 and vm 3 to host 2 empties host 0 with 3 migrations
+        hosts_info = testutils.create_hosts_info([ [ (0, 3, 5), (1, 3, 4) ], [ (2, 1, 3), (3, 5, 1), (4, 3, 2) ], [ (5, 1, 5) ] ], 10, 10)
+        d = binpacking.Defragger_BinPacking()
+        migration_plan = d.defrag(hosts_info)
+        self.assertEqual(active_hosts(hosts_info, migration_plan), 2)
+        self.assertEqual(sum([ len(migration_list) for migration_list in migration_plan ]), 3)
+        self.assertTrue(d.converged())
+
+if __name__ == '__main__':
+    unittest.main()
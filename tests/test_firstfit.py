@@ -0,0 +1,47 @@
+# coding: utf-8
+#
+# Virtual Machine Consolidation Agent (VMCA)
+# Copyright (C) 2016 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Tests of the time budget of the first fit defragger: when the budget expires, the plan obtained so far is returned and
+    it must be valid.
+'''
+import unittest
+import testutils
+
+class TestTimeBudget(unittest.TestCase):
+    def test_expired(self):
+        hosts_info = testutils.create_random_hosts_info(20, 0)
+        d = testutils.Defragger_FF()
+        migration_plan = d.defrag(hosts_info)
+        self.assertTrue(d.converged())
+        self.assertTrue(len(migration_plan) > 1)
+
+        # The budget expires at once, so only the first migration list is obtained
+        self.assertTrue(d.set_time_budget(1e-9) is None)
+        partial_plan = d.defrag(hosts_info)
+        self.assertFalse(d.converged())
+        self.assertEqual(testutils.plan_to_str(partial_plan), testutils.plan_to_str(migration_plan[:1]))
+        self.assertTrue(testutils.apply_plan(hosts_info.clone(), partial_plan))
+
+        # Without a budget the defragger converges again
+        self.assertEqual(d.set_time_budget(0), 1e-9)
+        self.assertEqual(testutils.plan_to_str(d.defrag(hosts_info)), testutils.plan_to_str(migration_plan))
+        self.assertTrue(d.converged())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+# coding: utf-8
+#
+# Virtual Machine Consolidation Agent (VMCA)
+# Copyright (C) 2016 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Tests of the HostsInfo structure. The structures that avoid cloning the HostsInfo are tested against clone(): the movements
+    made on them must give the same structure, the same fingerprint and the same migration plans as the ones made on a clone.
+    The CSV representation (plain or compressed with gzip) must give the same structure when it is read.
+'''
+import os
+import shutil
+import tempfile
+import unittest
+import testutils
+from testutils import defragger
+
+class TestOverlay(unittest.TestCase):
+    def setUp(self):
+        self.hosts_info = testutils.create_random_hosts_info(40, 1)
+        self.original = self.hosts_info.csv()
+        self.movements = testutils.random_movements(self.hosts_info, 15, 2)
+
+    def _moved_clone(self):
+        hosts_info = self.hosts_info.clone()
+        self.assertTrue(testutils.apply_plan(hosts_info, [ self.movements ]))
+        return hosts_info
+
+    def test_overlay_is_the_same_as_clone(self):
+        expected = self._moved_clone()
+        overlay = self.hosts_info.overlay()
+        self.assertTrue(testutils.apply_plan(overlay, [ self.movements ]))
+        self.assertEqual(overlay.csv(), expected.csv())
+        self.assertEqual(overlay.fingerprint(), expected.fingerprint())
+        self.assertEqual(testutils.plan_to_str(testutils.Defragger_FF().defrag(overlay)), testutils.plan_to_str(testutils.Defragger_FF().defrag(expected)))
+        # The structure under the overlay is not modified
+        self.assertEqual(self.hosts_info.csv(), self.original)
+
+    def test_commit(self):
+        expected = self._moved_clone()
+        overlay = self.hosts_info.overlay()
+        testutils.apply_plan(overlay, [ self.movements ])
+        overlay.commit()
+        self.assertEqual(self.hosts_info.csv(), expected.csv())
+        self.assertEqual(self.hosts_info.fingerprint(), expected.fingerprint())
+        for vm in expected.get_vms():
+            self.assertEqual(self.hosts_info.get_vm_location(vm.id), vm.hostname)
+        self.assertEqual(testutils.plan_to_str(testutils.Defragger_FF().defrag(self.hosts_info)), testutils.plan_to_str(testutils.Defragger_FF().defrag(expected)))
+        # The overlay is left empty over the updated structure
+        self.assertEqual(overlay.touched_hosts(), [])
+        self.assertEqual(overlay.csv(), expected.csv())
+
+    def test_rollback(self):
+        expected = testutils.Defragger_FF().defrag(self.hosts_info.clone())
+        overlay = self.hosts_info.overlay()
+        testutils.apply_plan(overlay, [ self.movements ])
+        overlay.rollback()
+        self.assertEqual(overlay.csv(), self.original)
+        self.assertEqual(overlay.fingerprint(), self.hosts_info.fingerprint())
+        self.assertEqual(self.hosts_info.csv(), self.original)
+        self.assertEqual(testutils.plan_to_str(testutils.Defragger_FF().defrag(overlay)), testutils.plan_to_str(expected))
+
+    def test_movements_in_several_steps(self):
+        # Half of the movements are committed and the rest are tried and discarded, as the local search does
+        half = len(self.movements) // 2
+        expected = self.hosts_info.clone()
+        testutils.apply_plan(expected, [ self.movements[:half] ])
+        overlay = self.hosts_info.overlay()
+        testutils.apply_plan(overlay, [ self.movements[:half] ])
+        overlay.commit()
+        testutils.apply_plan(overlay, [ self.movements[half:] ])
+        overlay.rollback()
+        self.assertEqual(self.hosts_info.csv(), expected.csv())
+        self.assertEqual(overlay.csv(), expected.csv())
+
+class TestVersion(unittest.TestCase):
+    def setUp(self):
+        self.hosts_info = testutils.create_random_hosts_info(40, 3)
+        self.original = self.hosts_info.csv()
+
+    def test_version_is_the_same_as_clone(self):
+        movements = testutils.random_movements(self.hosts_info, 15, 4)
+        expected = self.hosts_info.clone()
+        testutils.apply_plan(expected, [ movements ])
+        version = self.hosts_info.derive()
+        self.assertTrue(testutils.apply_plan(version, [ movements ]))
+        self.assertEqual(version.csv(), expected.csv())
+        self.assertEqual(version.fingerprint(), expected.fingerprint())
+        self.assertEqual(testutils.plan_to_str(testutils.Defragger_FF().defrag(version)), testutils.plan_to_str(testutils.Defragger_FF().defrag(expected)))
+        self.assertEqual(self.hosts_info.csv(), self.original)
+
+    def test_reduce_capacity(self):
+        expected = self.hosts_info.clone()
+        expected.reduce_capacity(2, 2048, 0, 0)
+        expected.normalize_resources()
+        version = self.hosts_info.derive()
+        version.reduce_capacity(2, 2048, 0, 0)
+        version.normalize_resources()
+        self.assertEqual(version.csv(), expected.csv())
+        # The VMs are shared with the previous version until the hosts are moved
+        for h_id in version.keys():
+            self.assertTrue(version[h_id].vm_list is self.hosts_info[h_id].vm_list)
+
+        plan = testutils.Defragger_FF().defrag(version)
+        self.assertEqual(testutils.plan_to_str(plan), testutils.plan_to_str(testutils.Defragger_FF().defrag(expected)))
+        self.assertTrue(testutils.apply_plan(version, plan))
+        self.assertEqual(self.hosts_info.csv(), self.original)
+
+class TestFingerprint(unittest.TestCase):
+    def setUp(self):
+        # The structure is read from its CSV representation, as the fingerprints are compared with the ones of structures
+        #   built from scratch (and the hosts are identified by strings in the CSV)
+        self.hosts_info = defragger.HostsInfo.createfromstr(testutils.create_random_hosts_info(30, 5).csv())
+
+    def test_incremental_fingerprint(self):
+        self.hosts_info.fingerprint()
+        movements = testutils.random_movements(self.hosts_info, 20, 6)
+        testutils.apply_plan(self.hosts_info, [ movements ])
+        # The fingerprint maintained by make_movement is the same as the one calculated from scratch
+        self.assertEqual(self.hosts_info.fingerprint(), defragger.HostsInfo.createfromstr(self.hosts_info.csv()).fingerprint())
+
+    def test_same_placement(self):
+        moved = self.hosts_info.clone()
+        movements = testutils.random_movements(moved, 10, 7)
+        testutils.apply_plan(moved, [ movements ])
+        self.assertNotEqual(moved.fingerprint(), self.hosts_info.fingerprint())
+        for movement in reversed(movements):
+            moved.make_movement(defragger.VMMigration(movement.vmid, movement.host_dst, movement.host_src, 0, 0))
+        self.assertEqual(moved.fingerprint(), self.hosts_info.fingerprint())
+
+    def test_vms_excluded(self):
+        vmids = [ vm.id for vm in self.hosts_info.get_vms()[:5] ]
+        without = self.hosts_info.clone()
+        without.remove_vms(vmids)
+        self.assertEqual(self.hosts_info.fingerprint(vmids), defragger.HostsInfo.createfromstr(without.csv()).fingerprint())
+
+    def test_diff(self):
+        moved = self.hosts_info.clone()
+        movements = testutils.random_movements(moved, 10, 8)
+        testutils.apply_plan(moved, [ movements ])
+        expected = {}
+        for movement in movements:
+            source = expected.get(movement.vmid, (movement.host_src, None))[0]
+            expected[movement.vmid] = (source, movement.host_dst)
+        expected = dict([ (vmid, hosts) for vmid, hosts in expected.items() if hosts[0] != hosts[1] ])
+        self.assertEqual(dict([ (m.vmid, (m.host_src, m.host_dst)) for m in self.hosts_info.diff(moved) ]), expected)
+        self.assertEqual(self.hosts_info.diff(self.hosts_info.clone()), [])
+
+    def test_diff_with_the_same_fingerprint(self):
+        moved = self.hosts_info.clone()
+        movements = testutils.random_movements(moved, 3, 9)
+        testutils.apply_plan(moved, [ movements ])
+        # A collision of the fingerprints of the structures must not hide the changes
+        moved._fingerprint = self.hosts_info.fingerprint()
+        self.assertEqual(len(self.hosts_info.diff(moved)), len(set([ m.vmid for m in movements ])))
+
+class TestCSV(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.hosts_info = testutils.create_detailed_hosts_info()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _check(self, hosts_info):
+        self.assertEqual(hosts_info.csv(), self.hosts_info.csv())
+        self.assertEqual(sorted(hosts_info.keys()), sorted(self.hosts_info.keys()))
+        for h_id, h in self.hosts_info.items():
+            self.assertEqual((hosts_info[h_id].cpu_free, hosts_info[h_id].memory_free, hosts_info[h_id].extra_free), (h.cpu_free, h.memory_free, h.extra_free))
+            self.assertEqual([ str(vm.id) for vm in hosts_info[h_id].vm_list ], [ str(vm.id) for vm in h.vm_list ])
+        self.assertEqual(hosts_info.fingerprint(), self.hosts_info.fingerprint())
+
+    def test_string(self):
+        self._check(defragger.HostsInfo.createfromstr(self.hosts_info.csv()))
+
+    def test_file(self):
+        for filename in [ "hosts.csv", "hosts.csv.gz" ]:
+            filename = os.path.join(self.folder, filename)
+            self.hosts_info.write_csv(filename)
+            self._check(defragger.HostsInfo.createfromfile(filename))
+
+    def test_compressed(self):
+        filename = os.path.join(self.folder, "hosts.csv.gz")
+        self.hosts_info.csv(filename = filename)
+        self.assertEqual(open(filename, "rb").read(2), "\x1f\x8b")
+
+    def test_lines(self):
+        # The structure can be read from any iterable of lines
+        self._check(defragger.HostsInfo.createfromcsv(self.hosts_info.iter_csv()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# coding: utf-8
+#
+# Virtual Machine Consolidation Agent (VMCA)
+# Copyright (C) 2016 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Tests of the local search over the plans of the first fit: its plans must be valid and they must not be worse than the
+    plans of the first fit.
+'''
+import unittest
+import testutils
+import localsearch
+
+def hosts_and_migrations(hosts_info, migration_plan):
+    '''
+    @return a tuple with the number of hosts with VMs after making the plan and the number of migrations of the plan, or
+        None if the plan cannot be made or it overloads any host
+    '''
+    hosts_info = hosts_info.clone()
+    if not testutils.apply_plan(hosts_info, migration_plan) or testutils.is_overloaded(hosts_info):
+        return None
+    return (len(hosts_info.keys()) - hosts_info.empty_hosts(), sum([ len(migration_list) for migration_list in migration_plan ]))
+
+class TestLocalSearch(unittest.TestCase):
+    # The first fit cannot empty any host of this placement, but the VMs fit in 4 hosts
+    PLACEMENT = [ [ 3, 2, 4 ], [ 2, 2, 4 ], [ 7 ], [ 3, 5 ], [ 3, 2, 3 ] ]
+
+    def test_better_than_first_fit(self):
+        hosts_info = testutils.create_hosts_info(self.PLACEMENT, 10, 100000)
+        self.assertEqual(hosts_and_migrations(hosts_info, testutils.Defragger_FF().defrag(hosts_info)), (5, 0))
+        d = localsearch.Defragger_LocalSearch(testutils.Defragger_FF())
+        self.assertEqual(hosts_and_migrations(hosts_info, d.defrag(hosts_info))[0], 4)
+        self.assertTrue(d.converged())
+
+    def test_not_worse_than_first_fit(self):
+        for seed in range(4):
+            hosts_info = testutils.create_random_hosts_info(10, seed, cpu = 8, memory = 16384)
+            original = hosts_info.csv()
+            (first_fit_hosts, first_fit_migrations) = hosts_and_migrations(hosts_info, testutils.Defragger_FF().defrag(hosts_info))
+            result = hosts_and_migrations(hosts_info, localsearch.Defragger_LocalSearch(testutils.Defragger_FF()).defrag(hosts_info))
+            self.assertTrue(result is not None)
+            (active, migrations) = result
+            self.assertTrue((active < first_fit_hosts) or ((active == first_fit_hosts) and (migrations <= first_fit_migrations)))
+            self.assertEqual(hosts_info.csv(), original)
+
+    def test_hosts_fixed(self):
+        hosts_info = testutils.create_hosts_info(self.PLACEMENT, 10, 100000)
+        migration_plan = localsearch.Defragger_LocalSearch(testutils.Defragger_FF()).defrag(hosts_info, hosts_fixed = [ 0, 1 ])
+        self.assertTrue(hosts_and_migrations(hosts_info, migration_plan) is not None)
+        for migration_list in migration_plan:
+            for migration in migration_list:
+                self.assertTrue(migration.host_src not in [ 0, 1 ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# coding: utf-8
+#
+# Virtual Machine Consolidation Agent (VMCA)
+# Copyright (C) 2016 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Tests of the model of the network and of the schedule of the migrations that does not oversubscribe its links.
+'''
+import unittest
+import testutils
+from testutils import defragger
+import network
+
+def migration(vmid, host_src, host_dst, memory):
+    # The memory of the VM is used as the cost of the migration, so the schedule does not need the hosts
+    return defragger.VMMigration(vmid, host_src, host_dst, memory, 0)
+
+class TestNetworkModel(unittest.TestCase):
+    def setUp(self):
+        self.network = network.NetworkModel(100, { "d": 50 }, { "a": "r1", "b": "r1", "c": "r2" }, 80)
+
+    def test_links(self):
+        self.assertEqual(self.network.links("a", "b"), [ ('nic', "a"), ('nic', "b") ])
+        self.assertEqual(self.network.links("a", "c"), [ ('nic', "a"), ('nic', "c"), ('uplink', "r1"), ('uplink', "r2") ])
+        # The hosts that are not in any rack do not use the uplinks
+        self.assertEqual(self.network.links("a", "d"), [ ('nic', "a"), ('nic', "d") ])
+
+    def test_rate(self):
+        self.assertEqual(self.network.rate("a", "b"), 100)
+        self.assertEqual(self.network.rate("a", "c"), 80)
+        self.assertEqual(self.network.rate("a", "d"), 50)
+        self.assertEqual(self.network.migration_time(400, "a", "c"), 5.0)
+
+    def test_uplinks(self):
+        model = network.NetworkModel(100, racks = { "a": "r1", "c": "r2" }, uplink_bandwidth = { "r1": 80, "r2": 20 })
+        self.assertEqual(model.rate("a", "c"), 20)
+        # Without the bandwidth of the uplinks, the racks are not taken into account
+        model = network.NetworkModel(100, racks = { "a": "r1", "c": "r2" })
+        self.assertEqual(model.links("a", "c"), [ ('nic', "a"), ('nic', "c") ])
+
+    def test_create_network_model(self):
+        testutils.set_config(self, HOST_BANDWIDTH = 0)
+        self.assertTrue(network.create_network_model() is None)
+        testutils.set_config(self, HOST_BANDWIDTH = 100, RACKS = { "a": "r1", "c": "r2" }, UPLINK_BANDWIDTH = 40)
+        self.assertEqual(network.create_network_model().rate("a", "c"), 40)
+
+class TestLinksUsage(unittest.TestCase):
+    def test_usage(self):
+        usage = network.LinksUsage(network.NetworkModel(100, { "c": 200 }))
+        self.assertTrue(usage.fits("a", "c"))
+        usage.add("a", "c")
+        # The NIC of a is full, but the NIC of c can take another migration
+        self.assertFalse(usage.fits("a", "b"))
+        self.assertTrue(usage.fits("b", "c"))
+        usage.add("b", "c")
+        self.assertFalse(usage.fits("d", "c"))
+        usage.remove("a", "c")
+        self.assertTrue(usage.fits("a", "d"))
+        self.assertTrue(usage.fits("d", "c"))
+        self.assertFalse(usage.fits("a", "b"))
+
+class TestMigrationScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = network.MigrationScheduler_Bandwidth(network.NetworkModel(100))
+
+    def _schedule(self, migration_plan):
+        return [ (s.migration.vmid, s.start, s.end) for s in self.scheduler.schedule(migration_plan) ]
+
+    def test_bandwidth(self):
+        # The migrations of vm 1 and vm 3 share the NIC of a, and vm 2 shares the NIC of c with vm 3
+        m1 = migration(1, "a", "b", 100)
+        m2 = migration(2, "c", "d", 200)
+        m3 = migration(3, "a", "c", 300)
+        # The longest migration is started first, and the others are started when it finishes
+        self.assertEqual(self._schedule([ [ m1, m2, m3 ] ]), [ (3, 0.0, 3.0), (2, 3.0, 5.0), (1, 3.0, 4.0) ])
+        self.assertEqual(self.scheduler.makespan([ [ m1, m2, m3 ] ]), 5.0)
+        self.assertEqual(self.scheduler.reorder([ [ m1, m2, m3 ] ]), [ [ m3, m2, m1 ] ])
+
+    def test_dependencies(self):
+        # vm 2 cannot be moved to a until vm 1 has left it, while vm 3 can be moved at once
+        m1 = migration(1, "a", "b", 100)
+        m2 = migration(2, "c", "a", 100)
+        m3 = migration(3, "d", "e", 100)
+        self.assertEqual(self._schedule([ [ m1 ], [ m2, m3 ] ]), [ (1, 0.0, 1.0), (3, 0.0, 1.0), (2, 1.0, 2.0) ])
+        self.assertEqual(self.scheduler.reorder([ [ m1 ], [ m2, m3 ] ]), [ [ m1 ], [ m3, m2 ] ])
+
+    def test_memory_of_the_vms(self):
+        # If the hosts are known, the time of the migration depends on the memory of the VM instead of the cost
+        hosts_info = testutils.create_hosts_info({ "a": [ (1, 1, 500) ], "b": [] })
+        self.assertEqual(self.scheduler.makespan([ [ migration(1, "a", "b", 100) ] ], hosts_info), 5.0)
+
+if __name__ == '__main__':
+    unittest.main()
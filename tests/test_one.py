@@ -0,0 +1,145 @@
+# coding: utf-8
+#
+# Virtual Machine Consolidation Agent (VMCA)
+# Copyright (C) 2016 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Tests of the monitorization of ONE, against a connection that parses the XML documents of the pools set by the test
+    instead of obtaining them from the XML-RPC server.
+'''
+import unittest
+import testutils
+from testutils import config, defragger
+import cpyutils.oneconnect
+import one
+
+HOST_XML = "<HOST><ID>%d</ID><NAME>%s</NAME><STATE>%d</STATE><HOST_SHARE><MAX_CPU>800</MAX_CPU><MAX_MEM>16777216</MAX_MEM><CPU_USAGE>0</CPU_USAGE><MEM_USAGE>0</MEM_USAGE>%s</HOST_SHARE><TEMPLATE></TEMPLATE></HOST>"
+VM_XML = "<VM><ID>%d</ID><STATE>3</STATE><LCM_STATE>%d</LCM_STATE><UID>0</UID><GID>0</GID><TEMPLATE><CPU>1</CPU><MEMORY>1024</MEMORY><TEMPLATE_ID>1</TEMPLATE_ID></TEMPLATE><HISTORY_RECORDS>%s</HISTORY_RECORDS></VM>"
+HISTORY_XML = "<HISTORY><SEQ>%d</SEQ><HOSTNAME>%s</HOSTNAME></HISTORY>"
+
+_ONEConnect = cpyutils.oneconnect.ONEConnect
+
+class ONEConnect_Test(_ONEConnect):
+    '''
+    Connection to ONE whose pools are the hosts and the VMs set by the test
+    '''
+    def __init__(self, one_xmlrpc, one_auth):
+        _ONEConnect.__init__(self, one_xmlrpc, one_auth)
+        self.hosts = {}
+        self.vms = {}
+        self.queries = 0
+        self.migrations = []
+
+    def set_host(self, h_id, name, state = cpyutils.oneconnect.HOST.MONITORED, free_cpu = None):
+        keywords = ""
+        if free_cpu is not None:
+            keywords = "<FREE_CPU>%d</FREE_CPU>" % free_cpu
+        self.hosts[h_id] = HOST_XML % (h_id, name, state, keywords)
+
+    def set_vm(self, vmid, hosts, lcm_state = cpyutils.oneconnect.VM.LCM_RUNNING):
+        '''
+        @param hosts the hosts in which the VM has been, in order (they are its history records)
+        '''
+        self.vms[vmid] = VM_XML % (vmid, lcm_state, "".join([ HISTORY_XML % (seq, host) for seq, host in enumerate(hosts) ]))
+
+    def get_server_ref(self):
+        return True
+
+    def get_hosts(self):
+        self.queries += 1
+        return cpyutils.oneconnect.HOST_POOL("<HOST_POOL>%s</HOST_POOL>" % "".join(self.hosts.values())).HOST
+
+    def get_vms(self, get_only_owned_vms = False):
+        return cpyutils.oneconnect.VM_POOL("<VM_POOL>%s</VM_POOL>" % "".join(self.vms.values())).VM
+
+    def migrate_vm(self, vmid, hostid, live = True):
+        self.migrations.append((vmid, hostid))
+        return True
+
+def placement(hosts_info):
+    return dict([ (h_id, sorted([ vm.id for vm in h.vm_list ])) for h_id, h in hosts_info.items() ])
+
+class TestDeploymentONE(unittest.TestCase):
+    def setUp(self):
+        # The deployment creates its connection to ONE
+        self.addCleanup(setattr, cpyutils.oneconnect, "ONEConnect", _ONEConnect)
+        cpyutils.oneconnect.ONEConnect = ONEConnect_Test
+        self.deployment = one.Deployment("http://localhost:2633/RPC2", "vmca:vmcapass")
+        self.one = self.deployment._one
+
+        self.one.set_host(0, "a")
+        self.one.set_host(1, "b")
+        self.one.set_vm(1, [ "a" ])
+        self.one.set_vm(2, [ "a" ])
+        # The host of a VM is the one of its last history record
+        self.one.set_vm(3, [ "a", "b" ])
+
+    def test_last_history_record(self):
+        self.assertEqual(placement(self.deployment.get_info()), { "a": [ 1, 2 ], "b": [ 3 ] })
+
+    def test_cache_time(self):
+        testutils.set_config(self, config.config_one, MONITORING_CACHE_TIME = 60)
+        self.deployment.get_info()
+        self.one.set_vm(2, [ "a", "b" ])
+        # The info is obtained from the cache, until it is invalidated
+        self.assertEqual(placement(self.deployment.get_info()), { "a": [ 1, 2 ], "b": [ 3 ] })
+        self.assertEqual(self.one.queries, 1)
+        self.deployment.invalidate_cache()
+        self.assertEqual(placement(self.deployment.get_info()), { "a": [ 1 ], "b": [ 2, 3 ] })
+        self.assertEqual(self.one.queries, 2)
+
+    def test_changes(self):
+        testutils.set_config(self, config.config_one, MONITORING_CACHE_TIME = 0)
+        self.deployment.get_info()
+        vm_3 = self.deployment._vm_cache[3]
+
+        self.one.set_vm(1, [ "a", "b" ], cpyutils.oneconnect.VM.LCM_MIGRATE)
+        del self.one.vms[2]
+        hosts_info = self.deployment.get_info()
+        self.assertEqual(placement(hosts_info), { "a": [], "b": [ 1, 3 ] })
+        self.assertEqual(hosts_info["a"].cpu_free, hosts_info["a"].cpu_total)
+        self.assertEqual(self.deployment.get_migrating_vms(), [ 1 ])
+        # The VMs that have not changed are not processed again
+        self.assertTrue(self.deployment._vm_cache[3] is vm_3)
+
+    def test_migrate_invalidates_cache(self):
+        testutils.set_config(self, config.config_one, MONITORING_CACHE_TIME = 60)
+        self.deployment.get_info()
+        self.assertTrue(self.deployment.migrate_vm(1, "a", "b"))
+        self.assertEqual(self.one.migrations, [ (1, 1) ])
+
+        # The migration has not started in ONE yet, so the VM is still in its host
+        self.assertEqual(placement(self.deployment.get_info()), { "a": [ 1, 2 ], "b": [ 3 ] })
+        self.assertEqual(self.one.queries, 2)
+        self.assertEqual(self.deployment.get_info()["a"].get_vm_byid(1).state, defragger.VMData.STATE_RUNNING)
+
+    def test_new_host(self):
+        testutils.set_config(self, config.config_one, MONITORING_CACHE_TIME = 0)
+        self.one.set_host(1, "b", cpyutils.oneconnect.HOST.DISABLED)
+        self.one.set_host(0, "a", free_cpu = 100)
+        hosts_info = self.deployment.get_info()
+        self.assertEqual(placement(hosts_info), { "a": [ 1, 2 ] })
+
+        # The VM that is cached is attached to its host once it is monitored, and the keywords of the hosts are refreshed
+        self.one.set_host(1, "b")
+        self.one.set_host(0, "a", free_cpu = 700)
+        hosts_info = self.deployment.get_info()
+        self.assertEqual(placement(hosts_info), { "a": [ 1, 2 ], "b": [ 3 ] })
+        self.assertEqual(hosts_info["b"].cpu_free, hosts_info["b"].cpu_total - 1)
+        self.assertEqual(hosts_info["a"].keywords["FREE_CPU"], 700)
+
+if __name__ == '__main__':
+    unittest.main()
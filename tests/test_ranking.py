@@ -0,0 +1,108 @@
+# coding: utf-8
+#
+# Virtual Machine Consolidation Agent (VMCA)
+# Copyright (C) 2016 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Tests of the incremental structures used to select the hosts (IndexedHeap and HostsRanking), against sorting the hosts
+    each time.
+'''
+import random
+import unittest
+import testutils
+from testutils import defragger
+
+def rank_memory_free(hosts_info, h_id):
+    # The hosts without VMs are not considered, to check that the hosts whose rank is None are skipped
+    h = hosts_info[h_id]
+    if len(h.vm_list) == 0:
+        return None
+    return h.memory_free
+
+class TestIndexedHeap(unittest.TestCase):
+    def test_against_sorting(self):
+        rnd = random.Random(1)
+        heap = defragger.IndexedHeap()
+        keys = {}
+        for i in range(2000):
+            item = rnd.randint(0, 50)
+            if rnd.random() < 0.3:
+                self.assertEqual(heap.remove(item), item in keys)
+                keys.pop(item, None)
+            else:
+                key = (rnd.randint(0, 20), item)
+                heap.push(item, key)
+                keys[item] = key
+
+            self.assertEqual(len(heap), len(keys))
+            expected = sorted([ (key, item) for item, key in keys.items() ])
+            if len(expected) > 0:
+                self.assertEqual(heap.top(), expected[0][1])
+            else:
+                self.assertEqual(heap.top(), None)
+            if i % 50 == 0:
+                self.assertEqual(list(heap.ordered()), expected)
+
+class TestHostsRanking(unittest.TestCase):
+    def setUp(self):
+        self.hosts_info = testutils.create_random_hosts_info(40, 2)
+        self.order = list(self.hosts_info.keys())
+
+    def _expected(self, hosts_info, candidates):
+        ranked = [ h_id for h_id in candidates if rank_memory_free(hosts_info, h_id) is not None ]
+        return sorted(ranked, key = lambda h_id: (-rank_memory_free(hosts_info, h_id), self.order.index(h_id)))
+
+    def test_movements(self):
+        ranking = defragger.HostsRanking(rank_memory_free)
+        candidates = self.order[:30]
+        self.assertEqual(list(ranking.ordered(self.hosts_info, candidates)), self._expected(self.hosts_info, candidates))
+        # The hosts modified by the movements are re-ranked
+        for movement in testutils.random_movements(self.hosts_info, 20, 3):
+            self.hosts_info.make_movement(movement)
+            self.assertEqual(list(ranking.ordered(self.hosts_info, candidates)), self._expected(self.hosts_info, candidates))
+
+    def test_overlay(self):
+        ranking = defragger.HostsRanking(rank_memory_free)
+        candidates = self.order
+        ranking.ordered(self.hosts_info, candidates)
+        overlay = self.hosts_info.overlay()
+        movements = testutils.random_movements(self.hosts_info, 10, 4)
+        testutils.apply_plan(overlay, [ movements ])
+        self.assertEqual(list(ranking.ordered(overlay, candidates)), self._expected(overlay, candidates))
+        self.assertEqual(list(ranking.ordered(self.hosts_info, candidates)), self._expected(self.hosts_info, candidates))
+        overlay.commit()
+        self.assertEqual(list(ranking.ordered(self.hosts_info, candidates)), self._expected(self.hosts_info, candidates))
+
+    def test_candidates(self):
+        ranking = defragger.HostsRanking(rank_memory_free)
+        # Different lists of candidates, in which hosts enter and leave
+        for candidates in [ self.order[:20], self.order[10:30], self.order[10:30] + [ self.order[0] ], self.order ]:
+            self.assertEqual(list(ranking.ordered(self.hosts_info, candidates)), self._expected(self.hosts_info, candidates))
+
+        base = list(self.order)
+        for movement in testutils.random_movements(self.hosts_info, 10, 5):
+            self.hosts_info.make_movement(movement)
+            selection = defragger.CandidateHosts(self.hosts_info, base, (movement.host_src, ), True)
+            self.assertEqual(list(ranking.ordered(self.hosts_info, selection)), self._expected(self.hosts_info, list(selection)))
+
+    def test_new_structure(self):
+        ranking = defragger.HostsRanking(rank_memory_free)
+        ranking.ordered(self.hosts_info, self.order)
+        hosts_info = testutils.create_random_hosts_info(40, 6)
+        self.assertEqual(ranking.first(hosts_info, self.order), self._expected(hosts_info, self.order)[0])
+
+if __name__ == '__main__':
+    unittest.main()
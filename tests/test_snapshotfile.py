@@ -0,0 +1,89 @@
+# coding: utf-8
+#
+# Virtual Machine Consolidation Agent (VMCA)
+# Copyright (C) 2016 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Round-trip tests of the binary snapshot files: the frames must give the same structures that were written.
+'''
+import os
+import shutil
+import tempfile
+import unittest
+import testutils
+from testutils import defragger
+import snapshotfile
+
+class TestSnapshotFile(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, "hosts.snap")
+        self.hosts_info = testutils.create_detailed_hosts_info()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _check(self, hosts_info, expected):
+        self.assertEqual(hosts_info.csv(), expected.csv())
+        for h_id, h in expected.items():
+            restored = hosts_info[h_id]
+            self.assertEqual((restored.cpu_free, restored.memory_free, restored.maxvms, restored.extra_free, restored.extra_total, restored.keywords), (h.cpu_free, h.memory_free, h.maxvms, h.extra_free, h.extra_total, h.keywords))
+            for vm, restored_vm in zip(h.vm_list, restored.vm_list):
+                self.assertEqual((restored_vm.id, type(restored_vm.id), restored_vm.extra, restored_vm.timestamp_state, restored_vm.state), (vm.id, type(vm.id), vm.extra, vm.timestamp_state, vm.state))
+
+    def test_round_trip(self):
+        snapshotfile.write_snapshot(self.filename, self.hosts_info, 10.0)
+        self.assertTrue(snapshotfile.is_snapshot_file(self.filename))
+        reader = snapshotfile.SnapshotReader(self.filename)
+        try:
+            self.assertEqual(len(reader), 1)
+            self.assertEqual(reader.timestamp(0), 10.0)
+            self._check(reader.frame(0).hosts_info(), self.hosts_info)
+        finally:
+            reader.close()
+
+    def test_frames(self):
+        snapshotfile.write_snapshot(self.filename, self.hosts_info, 10.0)
+        moved = self.hosts_info.clone()
+        testutils.apply_plan(moved, [ testutils.random_movements(moved, 5, 1) ])
+        writer = snapshotfile.SnapshotWriter(self.filename, append = True)
+        writer.write(moved, 20.0)
+        writer.close()
+
+        reader = snapshotfile.SnapshotReader(self.filename)
+        try:
+            self.assertEqual([ reader.timestamp(i) for i in range(len(reader)) ], [ 10.0, 20.0 ])
+            self._check(reader.frame(0).hosts_info(), self.hosts_info)
+            self._check(reader.frame(1).hosts_info(), moved)
+        finally:
+            reader.close()
+
+    def test_empty(self):
+        snapshotfile.write_snapshot(self.filename, defragger.HostsInfo({}))
+        reader = snapshotfile.SnapshotReader(self.filename)
+        try:
+            self.assertEqual(reader.frame(0).hosts_info().keys(), [])
+        finally:
+            reader.close()
+
+    def test_not_a_snapshot(self):
+        filename = os.path.join(self.folder, "hosts.csv")
+        self.hosts_info.write_csv(filename)
+        self.assertFalse(snapshotfile.is_snapshot_file(filename))
+        self.assertRaises(snapshotfile.SnapshotFormatException, snapshotfile.SnapshotReader, filename)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+# coding: utf-8
+#
+# Virtual Machine Consolidation Agent (VMCA)
+# Copyright (C) 2016 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Tests of the monitor and of the execution of the migration plans, against a deployment whose migrations finish when the
+    test decides.
+'''
+import time
+import unittest
+import testutils
+from testutils import defragger
+import vmcaserver
+
+def wait_for_snapshot(monitor, version = 0, timeout = 5):
+    '''
+    @return the first snapshot published by the monitor whose version is greater than "version"
+    '''
+    limit = time.time() + timeout
+    while (monitor.get_snapshot().version <= version) and (time.time() < limit):
+        time.sleep(0.01)
+    return monitor.get_snapshot()
+
+class TestCompareHostsInfo(unittest.TestCase):
+    def setUp(self):
+        self.hosts_info = testutils.create_random_hosts_info(30, 1)
+        self.moved = self.hosts_info.clone()
+        self.movement = testutils.random_movements(self.moved, 1, 2)[0]
+        self.moved.make_movement(self.movement)
+
+    def test_compare(self):
+        self.assertEqual(vmcaserver.compare_hosts_info(self.hosts_info, self.hosts_info.clone(), []), 0)
+        self.assertNotEqual(vmcaserver.compare_hosts_info(self.hosts_info, self.moved, []), 0)
+        # The VMs that are being migrated are not taken into account
+        self.assertEqual(vmcaserver.compare_hosts_info(self.hosts_info, self.moved, [ self.movement.vmid ]), 0)
+
+    def test_same_fingerprint(self):
+        # A collision of the fingerprints of the structures must not hide the changes
+        self.moved._fingerprint = self.hosts_info.fingerprint()
+        self.assertNotEqual(vmcaserver.compare_hosts_info(self.hosts_info, self.moved, []), 0)
+
+class TestMonitor(unittest.TestCase):
+    def setUp(self):
+        testutils.set_config(self, MONITORIZATION_VALIDITY = 10)
+        self.deployment = testutils.Deployment_Test(testutils.create_hosts_info({ "a": [ (1, 1, 1024) ], "b": [] }))
+        self.monitor = vmcaserver.Monitor(self.deployment)
+
+    def test_without_monitoring_thread(self):
+        # The deployment is queried each time that the info is needed, even if the snapshot is valid
+        snapshot = self.monitor.monitor_snapshot()
+        self.assertEqual(self.monitor.monitor_snapshot().version, snapshot.version + 1)
+        self.assertEqual(self.deployment.get_info_calls, 2)
+
+    def test_valid_snapshot(self):
+        # The period is long enough for the thread to monitor the deployment only once during the test
+        self.monitor.start_monitoring(3600)
+        snapshot = wait_for_snapshot(self.monitor)
+        self.assertEqual(self.deployment.get_info_calls, 1)
+        self.assertTrue(self.monitor.monitor_snapshot() is snapshot)
+        self.assertEqual(self.monitor.monitor()["a"].vm_list[0].id, 1)
+        self.assertEqual(self.deployment.get_info_calls, 1)
+
+        # The snapshot is too old, so the deployment is queried again
+        testutils.set_config(self, MONITORIZATION_VALIDITY = 0)
+        self.assertEqual(self.monitor.monitor_snapshot().version, snapshot.version + 1)
+        self.assertEqual(self.deployment.get_info_calls, 2)
+
+    def test_monitorization_fails(self):
+        snapshot = self.monitor.monitor_snapshot()
+        self.deployment.available = False
+        # The info is still valid, so it is used although the deployment cannot be monitored
+        self.assertTrue(self.monitor.monitor_snapshot() is snapshot)
+        testutils.set_config(self, MONITORIZATION_VALIDITY = 0)
+        self.assertTrue(self.monitor.monitor_snapshot() is None)
+        self.assertTrue(self.monitor.monitor() is None)
+        self.assertEqual(self.deployment.get_info_calls, 4)
+
+    def test_monitoring_thread(self):
+        self.monitor.start_monitoring(0.05)
+        snapshot = wait_for_snapshot(self.monitor)
+        self.assertTrue(snapshot.hosts_info is not None)
+        self.assertTrue(wait_for_snapshot(self.monitor, snapshot.version).version > snapshot.version)
+
+class TestExecutor(unittest.TestCase):
+    def setUp(self):
+        testutils.set_config(self, ENABLE_MIGRATION = True, COOLDOWN_MIGRATION = 0, MAX_SIMULTANEOUS_MIGRATIONS = 1, MONITORIZATION_VALIDITY = 10)
+        self.deployment = testutils.Deployment_Test(testutils.create_hosts_info({ "a": [ (1, 1, 1024) ], "b": [ (2, 1, 1024) ], "c": [], "d": [] }))
+
+    def test_background_monitor(self):
+        monitor = vmcaserver.Monitor(self.deployment)
+        # The deployment is monitored once, and then the snapshot is valid during the whole test
+        monitor.start_monitoring(3600)
+        self.assertTrue(wait_for_snapshot(monitor).hosts_info is not None)
+
+        migration_plan = vmcaserver.MigrationPlan(monitor)
+        migration_plan.start([ [ defragger.VMMigration(1, "a", "c", 0, 0), defragger.VMMigration(2, "b", "d", 0, 0) ] ])
+        migration_plan._execute_event()
+        self.assertEqual(self.deployment.migrations, [ (1, "a", "c") ])
+
+        # The snapshot published when the migration is ordered must not make the plan think that the migration has finished
+        vm = monitor.get_snapshot().hosts_info["c"].get_vm_byid(1)
+        self.assertEqual(vm.state, defragger.VMData.STATE_MIGRATING)
+        migration_plan._execute_event()
+        self.assertEqual(self.deployment.migrations, [ (1, "a", "c") ])
+
+        # Once the migration has finished in the deployment (and the info is refreshed), the next migration is started
+        self.deployment.finish_migrations()
+        testutils.set_config(self, MONITORIZATION_VALIDITY = 0)
+        migration_plan._execute_event()
+        self.assertEqual(self.deployment.migrations, [ (1, "a", "c"), (2, "b", "d") ])
+
+class TestDispatch(unittest.TestCase):
+    def setUp(self):
+        testutils.set_config(self, ENABLE_MIGRATION = True, COOLDOWN_MIGRATION = 0, MAX_SIMULTANEOUS_MIGRATIONS = 3, MAX_SIMULTANEOUS_MIGRATIONS_PER_HOST = 0)
+        self.deployment = testutils.Deployment_Test(testutils.create_hosts_info({ "a": [ (1, 1, 1024) ], "b": [ (2, 1, 1024) ], "c": [ (3, 1, 1024) ], "d": [ (4, 1, 1024) ], "e": [ (5, 1, 1024) ] }))
+        self.migration_plan = vmcaserver.MigrationPlan(vmcaserver.Monitor(self.deployment))
+        self.migration_plan.set_network_model(None)
+
+    def _dispatch(self, migration_plan):
+        '''
+        @return the migrations that are started by the migration plan (as tuples), and then finishes them in the deployment
+        '''
+        if migration_plan is not None:
+            self.migration_plan.start([ [ defragger.VMMigration(vmid, h_src, h_dst, 0, 0) for (vmid, h_src, h_dst) in migration_list ] for migration_list in migration_plan ])
+        started = len(self.deployment.migrations)
+        self.migration_plan._execute_event()
+        self.deployment.finish_migrations()
+        return self.deployment.migrations[started:]
+
+    def test_simultaneous_migrations(self):
+        plan = [ [ (1, "a", "b"), (3, "c", "b"), (4, "d", "b"), (5, "e", "b") ] ]
+        self.assertEqual(self._dispatch(plan), [ (1, "a", "b"), (3, "c", "b"), (4, "d", "b") ])
+        self.assertEqual(self._dispatch(None), [ (5, "e", "b") ])
+
+    def test_migrations_per_host(self):
+        testutils.set_config(self, MAX_SIMULTANEOUS_MIGRATIONS_PER_HOST = 1)
+        # b is involved in two migrations, so the second one waits for the first
+        plan = [ [ (1, "a", "b"), (3, "c", "b"), (4, "d", "e") ] ]
+        self.assertEqual(self._dispatch(plan), [ (1, "a", "b"), (4, "d", "e") ])
+        self.assertEqual(self._dispatch(None), [ (3, "c", "b") ])
+
+    def test_dependencies(self):
+        # The migration of vm 3 to a depends on vm 1 leaving a, but the migration of vm 4 does not depend on the first list
+        plan = [ [ (1, "a", "b") ], [ (3, "c", "a"), (4, "d", "e") ] ]
+        self.assertEqual(self._dispatch(plan), [ (1, "a", "b"), (4, "d", "e") ])
+        self.assertEqual(self._dispatch(None), [ (3, "c", "a") ])
+
+class TestRepair(unittest.TestCase):
+    PLACEMENT = { "x": [ (1, 2, 512), (2, 2, 512) ], "y": [ (3, 2, 512) ], "z": [ (4, 2, 512) ], "e": [] }
+
+    def _repair(self, new_placement, can_use_empty_hosts = False):
+        '''
+        @return the repaired plan for the plan that empties host x (vm 1 to y and then vm 2 to z), if the VMs are moved
+            outside of the plan to new_placement (the hosts are x, y, z and e, with 8 cpus)
+        '''
+        migration_plan = vmcaserver.MigrationPlan(None)
+        migration_plan._hosts_info = testutils.create_hosts_info(self.PLACEMENT, 8, 8192)
+        migration_plan._defragger = testutils.Defragger_FF()
+        migration_plan._can_use_empty_hosts = can_use_empty_hosts
+        migration_plan._migration_plan = [ [ defragger.VMMigration(1, "x", "y", 0, 0) ], [ defragger.VMMigration(2, "x", "z", 0, 0) ] ]
+
+        hosts_info = testutils.create_hosts_info(new_placement, 8, 8192)
+        migration_plan._repair(hosts_info, migration_plan._hosts_info.diff(hosts_info))
+        return [ [ (m.vmid, m.host_src, m.host_dst) for m in migration_list ] for migration_list in migration_plan._migration_plan ]
+
+    def test_not_affected(self):
+        self.assertEqual(self._repair(dict(self.PLACEMENT, e = [ (5, 2, 512) ])), [ [ (1, "x", "y") ], [ (2, "x", "z") ] ])
+
+    def test_moved_vm(self):
+        # vm 1 has been moved to its destination, so its migration is not needed anymore
+        self.assertEqual(self._repair(dict(self.PLACEMENT, x = [ (2, 2, 512) ], y = [ (1, 2, 512), (3, 2, 512) ])), [ [], [ (2, "x", "z") ] ])
+
+    def test_replanned(self):
+        # z is full, so vm 2 is re-planned to the other host with VMs
+        self.assertEqual(self._repair(dict(self.PLACEMENT, z = [ (4, 2, 512), (5, 6, 512) ])), [ [ (1, "x", "y") ], [ (2, "x", "y") ] ])
+
+    def test_empty_hosts(self):
+        # y and z are full once vm 1 is moved, so the only destination for vm 2 is the empty host e
+        new_placement = dict(self.PLACEMENT, y = [ (3, 2, 512), (6, 4, 512) ], z = [ (4, 2, 512), (5, 6, 512) ])
+        self.assertEqual(self._repair(new_placement, True), [ [ (1, "x", "y") ], [ (2, "x", "e") ] ])
+        # If the empty hosts cannot be used, x cannot be emptied, so the migration of vm 1 (already accepted) is also discarded
+        self.assertEqual(self._repair(new_placement, False), [ [], [] ])
+
+if __name__ == '__main__':
+    unittest.main()
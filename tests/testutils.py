@@ -0,0 +1,210 @@
+# coding: utf-8
+#
+# Virtual Machine Consolidation Agent (VMCA)
+# Copyright (C) 2016 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+'''
+Common functions for the tests: the modules of VMCA are imported as they import each other (i.e. from the folder of the
+    sources), and the structures are built from a seed so that the tests are reproducible.
+'''
+import os
+import sys
+import random
+import logging
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import cpyutils.eventloop
+import config
+import defragger
+import deployment
+import schedule
+import firstfit
+
+logging.basicConfig(level = logging.CRITICAL)
+cpyutils.eventloop.create_eventloop(False)
+config.config_vmca.CONSIDER_VMS_STABLE_ON_STARTUP = True
+
+class Defragger_FF(schedule.Scheduler_Packing, firstfit.SelectHost_LessVMs_First, firstfit.Defragger_FF): pass
+
+class Deployment_Test(deployment.Deployment):
+    '''
+    A deployment with the hosts and the VMs of a HostsInfo structure. The migrations are ordered as in a real deployment
+        (the VM is in the destination host, migrating) and they do not finish until finish_migrations is called.
+    '''
+    def __init__(self, hosts_info):
+        deployment.Deployment.__init__(self)
+        for h_id, h in hosts_info.items():
+            self._hosts_info[h_id] = h.clone()
+            for vm in self._hosts_info[h_id].vm_list:
+                self._vms_info[vm.id] = vm
+        # The migrations ordered, as tuples (vmid, host_src, host_dst)
+        self.migrations = []
+        self.get_info_calls = 0
+        # If False, the deployment cannot be monitored (as if the cloud manager did not answer)
+        self.available = True
+
+    def get_info(self):
+        self.get_info_calls += 1
+        if not self.available:
+            return None
+        return deployment.Deployment.get_info(self)
+
+    def migrate_vm(self, vmid, host_src, host_dst):
+        self.migrations.append((vmid, host_src, host_dst))
+        return deployment.Deployment.migrate_vm(self, vmid, host_src, host_dst)
+
+    def finish_migrations(self):
+        for vm in self._vms_info.values():
+            if vm.state == defragger.VMData.STATE_MIGRATING:
+                vm.state = defragger.VMData.STATE_RUNNING
+
+def set_config(test_case, configuration = None, **values):
+    '''
+    @description Sets the values of the variables of the configuration (config.config_vmca by default), that are restored
+        when the test finishes
+    '''
+    if configuration is None:
+        configuration = config.config_vmca
+    for name, value in values.items():
+        test_case.addCleanup(setattr, configuration, name, getattr(configuration, name))
+        setattr(configuration, name, value)
+
+def create_hosts_info(placement, cpu = 16, memory = 32768, stable = True, extra = None):
+    '''
+    @param placement the VMs of each host: a dictionary host -> list of VMs, or a list of lists of VMs (then the hosts are
+        identified by their position). Each VM is a VMData, a tuple (vmid, cpu, memory) or only its cpu (then its memory
+        is 1024 per cpu and its id is its position in the placement)
+    @param stable if True, the VMs are stable (i.e. they can be migrated)
+    @param extra a dictionary with the total amount of the additional resources of the hosts
+    @return a HostsInfo with the hosts (all of them with the same cpu and memory) and the VMs of the placement
+    '''
+    if not isinstance(placement, dict):
+        placement = dict(enumerate(placement))
+
+    hosts = {}
+    vmid = 0
+    for h_id in sorted(placement.keys()):
+        h = defragger.HostData(h_id, cpu, memory)
+        for name, total in (extra or {}).items():
+            h.set_extra_resource(name, total)
+        for vm in placement[h_id]:
+            if not isinstance(vm, defragger.VMData):
+                if not isinstance(vm, tuple):
+                    vm = (vmid, vm, vm * 1024)
+                vm = defragger.VMData(vm[0], vm[1], vm[2], h_id)
+            h.add_vm(vm)
+            vmid += 1
+        hosts[h_id] = h
+
+    # The hosts have just been created, so they are not cloned again (as the constructor does)
+    hosts_info = defragger.HostsInfo({})
+    hosts_info._hosts_info = hosts
+    if stable:
+        hosts_info.stabilize_vms(config.config_vmca.STABLE_TIME, hosts_info.keys())
+    return hosts_info
+
+def create_detailed_hosts_info():
+    '''
+    @return a HostsInfo with all the details that are stored for the hosts and the VMs: keywords, maximum number of VMs,
+        additional resources, identifiers of the VMs that are numbers or strings and states of the VMs
+    '''
+    placement = {}
+    for i in range(12):
+        h_id = "host%02d" % i
+        placement[h_id] = []
+        for j in range(i % 5):
+            vmid = "vm%d_%d" % (i, j)
+            extra = None
+            if j % 2 == 0:
+                vmid = i * 100 + j
+                extra = { "disk": 10 }
+            vm = defragger.VMData(vmid, 1 + j, 1024 * (1 + j), h_id, extra = extra)
+            vm.state = j % 3
+            placement[h_id].append(vm)
+
+    hosts_info = create_hosts_info(placement, 32, 65536, stable = False, extra = { "disk": 1000 })
+    for i, h_id in enumerate(sorted(hosts_info.keys())):
+        hosts_info[h_id].maxvms = i % 4 - 1
+        if i % 2 == 1:
+            hosts_info[h_id].keywords = { "FREE_CPU": "3", "n": 1, "f": 2.5 }
+    return hosts_info
+
+def random_placement(hosts_count, seed, max_vms = 5, cpu = 16, memory = 32768):
+    '''
+    @return a placement for create_hosts_info with hosts_count hosts, each with up to max_vms VMs of random sizes that fit
+        in it. The defraggers solve the ties using the order of the hosts in the dictionary, so the hosts are identified by
+        integers (their order in a dictionary does not depend on how the dictionary was built, and so the copies of the
+        structure keep the order of the hosts)
+    '''
+    rnd = random.Random(seed)
+    placement = []
+    vmid = 0
+    for i in range(hosts_count):
+        vms = []
+        cpu_free, memory_free = cpu, memory
+        for j in range(rnd.randint(0, max_vms)):
+            vm_cpu = rnd.choice([ 1, 2, 4 ])
+            if (vm_cpu > cpu_free) or (vm_cpu * 1024 > memory_free):
+                continue
+            vms.append((vmid, vm_cpu, vm_cpu * 1024))
+            cpu_free -= vm_cpu
+            memory_free -= vm_cpu * 1024
+            vmid += 1
+        placement.append(vms)
+    return placement
+
+def create_random_hosts_info(hosts_count, seed, max_vms = 5, cpu = 16, memory = 32768):
+    return create_hosts_info(random_placement(hosts_count, seed, max_vms, cpu, memory), cpu, memory)
+
+def random_movements(hosts_info, count, seed):
+    '''
+    @return a list of VMMigration that can be made one after the other in hosts_info (the structure is not modified)
+    '''
+    rnd = random.Random(seed)
+    hosts_info = hosts_info.clone()
+    movements = []
+    while len(movements) < count:
+        vms = hosts_info.get_vms()
+        if len(vms) == 0:
+            break
+        vm = rnd.choice(vms)
+        destinations = [ h_id for h_id in sorted(hosts_info.keys()) if (h_id != vm.hostname) and hosts_info[h_id].vm_can_fit(vm) ]
+        if len(destinations) == 0:
+            continue
+        movement = defragger.VMMigration(vm.id, vm.hostname, rnd.choice(destinations), 0, 0)
+        hosts_info.make_movement(movement)
+        movements.append(movement)
+    return movements
+
+def plan_to_str(migration_plan):
+    return [ [ str(migration) for migration in migration_list ] for migration_list in migration_plan ]
+
+def apply_plan(hosts_info, migration_plan):
+    '''
+    @return True if all the migrations of the plan can be made (in order) in hosts_info, that is modified
+    '''
+    for migration_list in migration_plan:
+        for migration in migration_list:
+            if not hosts_info.make_movement(migration):
+                return False
+    return True
+
+def is_overloaded(hosts_info):
+    for h_id, h in hosts_info.items():
+        if (h.cpu_free < 0) or (h.memory_free < 0):
+            return True
+    return False
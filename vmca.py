@@ -21,6 +21,9 @@ import sys
 import config
 import xmlrpclib
 import logging
+import gzip
+import shutil
+import StringIO
 from cpyutils.parameters import *
 
 class VMCACmdLine(CmdLineParser):
@@ -71,12 +74,44 @@ class VMCACmdLine(CmdLineParser):
 
     def info(self, result, error):
         csv = (result.values["-c"])
+        output = None
+        if result.values["-o"] is not None:
+            output = result.values["-o"][0]
 
-        succeed, text = self._proxy.getinfo(csv)
+        # The CSV is transferred compressed, as it may be huge for large deployments
+        succeed, text = self._proxy.getinfo(csv, csv)
+        if not succeed:
+            return False, "Could not get info about VMCA (%s)" % text
+
+        if csv:
+            data = text.data
+            if (output is not None) and output.endswith(".gz"):
+                f = open(output, "wb")
+                f.write(data)
+                f.close()
+                return True, "CSV written to %s" % output
+
+            f_csv = gzip.GzipFile(fileobj = StringIO.StringIO(data), mode = "rb")
+            if output is None:
+                text = f_csv.read()
+            else:
+                f = open(output, "wt")
+                shutil.copyfileobj(f_csv, f)
+                f.close()
+                text = "CSV written to %s" % output
+            f_csv.close()
+            return True, text
+
+        return True, text
+
+    def stats(self, result, error):
+        profile = (result.values["-p"])
+        reset = (result.values["-r"])
+        succeed, text = self._proxy.stats(profile, reset)
         if succeed:
             return True, text
         else:
-            return False, "Could not get info about VMCA (%s)" % text
+            return False, "Could not get the statistics of VMCA (%s)" % text
 
 def main_function():
     XMLRPC_SERVER = 'http://%s:%s/RPC2' %(config.config_vmca.XMLRPC_HOST, config.config_vmca.XMLRPC_PORT)
@@ -100,7 +135,12 @@ def main_function():
             ]),
             Operation("version", desc = "Gets the version of the VMCA server"),
             Operation("info", desc = "Gets the monitoring information that has the VMCA server", arguments = [
-                Flag("-c", "--csv", desc = "Gets the information in CSV format (useful for debugging purposes)")
+                Flag("-c", "--csv", desc = "Gets the information in CSV format (useful for debugging purposes)"),
+                Parameter("-o", "--output", desc = "File to write the information in CSV format (it is compressed with gzip if its name ends in .gz)")
+            ]),
+            Operation("stats", desc = "Gets the time spent in each phase of the defrag cycle and the counters of the hot operations", arguments = [
+                Flag("-p", "--profile", desc = "Capture the next defrag cycle with cProfile"),
+                Flag("-r", "--reset", desc = "Reset the timings and the counters once they have been obtained")
             ]),
             Operation("getmean", desc = "Distributes the VMs, trying to get the hosts to the mean of used resources", arguments = [
                 Flag("-f", "--force", desc = "Force considering fixed VMs and those that have failed")
@@ -20,6 +20,7 @@
 import config
 import sys
 import logging
+import xmlrpclib
 
 def version():
     from version import VERSION
@@ -46,16 +47,22 @@ def getmean(override_fixed_vms):
     result, explain = DAEMON.defrag_using_defragger(bestfit.Defragger_Refill_Relative(), override_fixed_vms = override_fixed_vms, can_use_empty_hosts = True)
     return result, explain
 
-def getinfo(csv = False):
+def getinfo(csv = False, compressed = False):
     global DAEMON
     if csv:
+        if compressed:
+            return True, xmlrpclib.Binary(DAEMON.dump_csv(True))
         return True, DAEMON.dump_csv()
     else:
         return True, DAEMON.dump_data()
 
+def stats(profile = False, reset = False):
+    global DAEMON
+    return True, DAEMON.get_stats(profile, reset)
+
 def vmca_server_functions():
     import cpyutils.xmlrpcutils
-    cpyutils.xmlrpcutils.create_xmlrpc_server_in_thread(config.config_vmca.XMLRPC_HOST, config.config_vmca.XMLRPC_PORT, [version, forcerun, getplan, cleanhosts, getinfo, getmean])
+    cpyutils.xmlrpcutils.create_xmlrpc_server_in_thread(config.config_vmca.XMLRPC_HOST, config.config_vmca.XMLRPC_PORT, [version, forcerun, getplan, cleanhosts, getinfo, getmean, stats])
 
 def main_loop():
     DEBUG_MODE = True
@@ -73,16 +80,33 @@ def main_loop():
     import schedule
     import firstfit
     import vmcaserver
+    import network
     class T(schedule.Scheduler_Packing, firstfit.SelectHost_LessVMs_First, firstfit.Defragger_FF): pass
     class T_clean(schedule.Scheduler_Stripping, firstfit.SelectHost_LessVMs_First, firstfit.Defragger_FF): pass
+
+    network_model = network.create_network_model()
+    if config.config_vmca.MIGRATION_TIME_AS_COST and (network_model is not None):
+        class T(network.Cost_MigrationTime, schedule.Scheduler_Packing, firstfit.SelectHost_LessVMs_First, firstfit.Defragger_FF): pass
+        class T_clean(network.Cost_MigrationTime, schedule.Scheduler_Stripping, firstfit.SelectHost_LessVMs_First, firstfit.Defragger_FF): pass
     
+    import profiling
+    profiling.enable(config.config_vmca.ENABLE_PROFILING)
+
     import one
     deployment = one.Deployment(config.config_one.ONE_XMLRPC, config.config_one.ONE_AUTH)
     
     vmca_server_functions()
     
     global DAEMON
-    DAEMON = vmcaserver.Daemon(deployment, T(), T_clean())
+    defragger_periodical = T()
+    defragger_clean = T_clean()
+    if isinstance(defragger_periodical, network.Cost_MigrationTime):
+        defragger_periodical.set_network_model(network_model)
+        defragger_clean.set_network_model(network_model)
+    if config.config_vmca.LOCAL_SEARCH_EVALUATIONS > 0:
+        import localsearch
+        defragger_periodical = localsearch.Defragger_LocalSearch(defragger_periodical, config.config_vmca.LOCAL_SEARCH_EVALUATIONS)
+    DAEMON = vmcaserver.Daemon(deployment, defragger_periodical, defragger_clean)
     DAEMON.loop()    
 
 if __name__ == '__main__':
@@ -21,6 +21,7 @@ import logging
 import cpyutils.eventloop
 import time
 import config
+import profiling
 
 _LOGGER = logging.getLogger("[VMCA]")
 
@@ -37,18 +38,27 @@ def postprocess_hosts_info(hosts_dic):
 
 import defragger
 import schedule
+import network
 import threading
+import gzip
+import StringIO
 
 class VMMigration_ongoing(defragger.VMMigration):
-    def __init__(self, vmmigration):
+    def __init__(self, vmmigration, migration_list = None):
         defragger.VMMigration.__init__(self, vmmigration.vmid, vmmigration.host_src, vmmigration.host_dst, vmmigration.cost, vmmigration.reward)
         self.timestamp_start = cpyutils.eventloop.now()
+        # The migration list of the plan from which the migration was taken
+        self.migration_list = migration_list
 
+@profiling.timed("plan.compare")
 def compare_hosts_info(hosts_1, hosts_2, vms_excluded):
     # This function compares two host info structures to check whether they contain the same VMs in the same hosts.
     # - it is possible to pass one parameter: vms_excluded to not to take into account the vm ids contained in that list
-    hosts_1_keys = hosts_1.keys()
-    hosts_2_keys = hosts_2.keys()
+    # - the VMs of the hosts whose placement fingerprint is the same in both structures are not compared (they have the same VMs,
+    #   including the excluded ones)
+    vms_excluded = set(vms_excluded)
+    hosts_1_keys = set(hosts_1.keys())
+    hosts_2_keys = set(hosts_2.keys())
     for h_id, h_1 in hosts_1.items():
         # print "------------ DATOS", h_id, hosts_1.items(), hosts_2.items()
         if h_id not in hosts_2_keys:
@@ -56,15 +66,11 @@ def compare_hosts_info(hosts_1, hosts_2, vms_excluded):
             return -1
 
         h_2 = hosts_2._hosts_info[h_id]
+        if h_1.placement_fingerprint == h_2.placement_fingerprint:
+            continue
         for vm_1 in h_1.vm_list:
             if vm_1.id not in vms_excluded:
-                has_vm = False
-                for vm_2 in h_2.vm_list:
-                    if vm_2.id == vm_1.id:
-                        has_vm = True
-                        break
-                    
-                if not has_vm:
+                if not h_2.has_vm(vm_1):
                     # LHS has at least one VM in one host that is not in the same host in the RHS
                     return -2
 
@@ -74,63 +80,148 @@ def compare_hosts_info(hosts_1, hosts_2, vms_excluded):
             return 1
 
         h_1 = hosts_1._hosts_info[h_id]
+        if h_1.placement_fingerprint == h_2.placement_fingerprint:
+            continue
         for vm_2 in h_2.vm_list:
             if vm_2.id not in vms_excluded:
-                has_vm = False
-                for vm_1 in h_1.vm_list:
-                    if vm_1.id == vm_2.id:
-                        has_vm = True
-                        break
-                    
-                if not has_vm:
+                if not h_1.has_vm(vm_2):
                     # El de la derecha tiene alguna maquina que no tiene el de la derecha
                     return 2
     return 0
 
+class MonitorSnapshot:
+    '''
+    A version of the monitoring info published by the Monitor. The snapshots are immutable: the hosts_info structure is
+        shared by the readers, so it must not be modified (use hosts_info.derive() to obtain a private version of it).
+    '''
+    def __init__(self, hosts_info, timestamp, version):
+        self.hosts_info = hosts_info
+        self.timestamp = timestamp
+        self.version = version
+
 class Monitor():
     # This class abstracts the monitor from the deployment. It caches the data obtained from the monitorization of the infrastructure
+    # - the data is published as versioned snapshots (MonitorSnapshot) that are never modified: when the information changes (a new
+    #   monitorization or a migration), a new version that shares the unmodified hosts with the previous one is published instead.
+    #   So the readers can get the latest snapshot without locking, and they do not need to deep copy it.
+    # - the monitorization can be made in a background thread (see start_monitoring), so that the callers do not have to wait for
+    #   the deployment unless the snapshot is older than MONITORIZATION_VALIDITY
     def __init__(self, deployment):
         self._deployment = deployment
-        self._lock = threading.Lock()
-        self._timestamp_monitor = 0
-        self._hosts_info = None
-
-    def _set_hosts_info(self, hosts_info):
-        # Sets the monitoring info along with the timestamp
-        self._hosts_info = hosts_info
-        self._timestamp_monitor = cpyutils.eventloop.now()
+        # The deployment lock serializes the calls to the deployment (that is not thread safe), while the snapshot lock is only
+        # held to replace the snapshot; so the readers never wait for the deployment if the current snapshot is valid
+        self._deployment_lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._snapshot = MonitorSnapshot(None, 0, 0)
+        self._monitoring_thread = None
+
+    def _publish(self, hosts_info, timestamp):
+        # Publishes a new version of the monitoring info (the snapshot is replaced at once)
+        self._snapshot_lock.acquire()
+        self._snapshot = MonitorSnapshot(hosts_info, timestamp, self._snapshot.version + 1)
+        self._snapshot_lock.release()
+
+    def get_snapshot(self):
+        '''
+        @return the latest MonitorSnapshot (its hosts_info is None if the deployment has not been monitored yet)
+        '''
+        return self._snapshot
+
+    @staticmethod
+    def _is_valid(snapshot, now):
+        return (snapshot.hosts_info is not None) and ((now - snapshot.timestamp) < config.config_vmca.MONITORIZATION_VALIDITY)
+
+    def _refresh(self):
+        # Obtains new monitoring info from the deployment and publishes it (the deployment lock must be acquired)
+        new_hosts_info = self._deployment.get_info()
+        if new_hosts_info is not None:
+            self._publish(new_hosts_info, cpyutils.eventloop.now())
+        return new_hosts_info
 
-    def _monitor_hosts_info(self):
-        # Monitors the infrastructure and returns the hosts info structure obtained. If the monitorization fails, we will use the monitoring info
-        # - TODO: include a cache of a interval of seconds, to avoid saturation
+    def _monitor_hosts_info(self, previous):
+        # Monitors the infrastructure and returns the snapshot obtained (previous is the snapshot that was published before
+        # acquiring the deployment lock). If the monitorization fails, we will use the monitoring info if it is still valid
         NOW = cpyutils.eventloop.now()
-        new_hosts_info = self._deployment.get_info()
-        if new_hosts_info is None:
-            if (NOW - self._timestamp_monitor) > config.config_vmca.MONITORIZATION_VALIDITY:
+        snapshot = self._snapshot
+
+        # If other thread has monitored the deployment while we were waiting for the lock, its info is used
+        if (snapshot.timestamp > previous.timestamp) and self._is_valid(snapshot, NOW):
+            return snapshot
+
+        if self._refresh() is None:
+            if self._is_valid(snapshot, NOW):
                 _LOGGER.debug("could not monitor deployment, but the current info is still valid")
-                return self._hosts_info
+                return snapshot
             else:
                 _LOGGER.error("could not monitor deployment")
                 return None
-        if self._hosts_info is None:
-            self._set_hosts_info(new_hosts_info.clone())
             
-        return new_hosts_info
+        return self._snapshot
+
+    def monitor_snapshot(self):
+        '''
+        @return the MonitorSnapshot with the current monitoring info (None if the deployment could not be monitored)
+        '''
+        # If the infrastructure is being monitored in background, the deployment is only queried if the info is too old (and
+        # the age of the snapshot is checked without waiting for the monitorization that may be in progress)
+        snapshot = self._snapshot
+        if (self._monitoring_thread is not None) and self._is_valid(snapshot, cpyutils.eventloop.now()):
+            return snapshot
+
+        self._deployment_lock.acquire()
+        try:
+            retval = self._monitor_hosts_info(snapshot)
+        finally:
+            self._deployment_lock.release()
+        return retval
 
     def monitor(self):
-        # The monitoring function protected against concurrent calls
-        self._lock.acquire()
-        retval = self._monitor_hosts_info()
-        self._lock.release()
-        return retval
+        '''
+        @return a private version of the current monitoring info, that the caller can modify (None if the deployment could not be monitored)
+        '''
+        snapshot = self.monitor_snapshot()
+        if snapshot is None:
+            return None
+        return snapshot.hosts_info.derive()
+
+    def _monitoring_loop(self, period):
+        while True:
+            self._deployment_lock.acquire()
+            try:
+                if self._refresh() is None:
+                    _LOGGER.error("could not monitor deployment")
+            except:
+                _LOGGER.exception("error monitoring the deployment")
+            self._deployment_lock.release()
+            time.sleep(period)
+
+    def start_monitoring(self, period):
+        '''
+        @description Starts a background thread that monitors the deployment every "period" seconds
+        '''
+        if self._monitoring_thread is None:
+            self._monitoring_thread = threading.Thread(target = self._monitoring_loop, args = (period,), name = "monitoring")
+            self._monitoring_thread.daemon = True
+            self._monitoring_thread.start()
 
     def make_migration(self, vmmigration):
-        # This method orders the migration in the deployment and also makes it in the local data structure in order to be able to be used as a cache
-        self._lock.acquire()
+        # This method orders the migration in the deployment and also publishes a new version of the monitoring info in which the
+        #   migration has been made, in order to be able to be used as a cache
+        # - the VM is published as migrating (as the deployment reports it), because the migration has only been ordered: the readers
+        #   must not consider that it has finished until the deployment is monitored again (e.g. the migration plan would stop
+        #   tracking the migration, and it would start more simultaneous migrations than allowed)
+        self._deployment_lock.acquire()
         retval = self._deployment.migrate_vm(vmmigration.vmid, vmmigration.host_src, vmmigration.host_dst)
         if retval:
-            retval = self._hosts_info.make_movement(vmmigration)
-        self._lock.release()
+            snapshot = self._snapshot
+            if snapshot.hosts_info is not None:
+                new_hosts_info = snapshot.hosts_info.derive()
+                retval = new_hosts_info.make_movement(vmmigration)
+                if retval:
+                    # The host has been copied in the new version by make_movement, so the VM is not shared with the snapshot
+                    new_hosts_info[vmmigration.host_dst].get_vm_byid(vmmigration.vmid).state = defragger.VMData.STATE_MIGRATING
+                self._publish(new_hosts_info, snapshot.timestamp)
+        self._deployment_lock.release()
         return retval
 
 class MigrationPlan():
@@ -145,6 +236,10 @@ class MigrationPlan():
         
         self._migration_plan = None
         self._migration_event = None
+        # The defragger that created the migration plan, that is used to re-plan the migrations when the plan is repaired (using
+        # the empty hosts as destinations only if the plan was created that way)
+        self._defragger = None
+        self._can_use_empty_hosts = False
         
         self._timestamp_last_migration = 0
         self._last_migration = None
@@ -152,6 +247,14 @@ class MigrationPlan():
         
         self._failed_migrations = {}
         # TODO: consider make a "_NOW" var and use it instead calling now() function all the time
+
+        # The model of the network, to avoid oversubscribing the links when making simultaneous migrations
+        self._network = network.create_network_model()
+
+    def set_network_model(self, network_model):
+        self._lock.acquire()
+        self._network = network_model
+        self._lock.release()
         
     def __str__(self):
         self._lock.acquire()
@@ -192,12 +295,12 @@ class MigrationPlan():
         self._lock.release()
         return retval
 
-    def _make_migration(self, vmmigration):
+    def _make_migration(self, vmmigration, migration_list = None):
         if vmmigration.vmid in self._ongoing_migrations:
             _LOGGER.warning("trying to migrate %s but it is already being migrated!" % vmmigration.vmid)
             return False
         
-        self._last_migration = VMMigration_ongoing(vmmigration)
+        self._last_migration = VMMigration_ongoing(vmmigration, migration_list)
         if self._deployment.make_migration(vmmigration):
             '''
             self._deployment.migrate_vm(vmmigration.vmid, vmmigration.host_src, vmmigration.host_dst)
@@ -221,12 +324,113 @@ class MigrationPlan():
         ongoing_migrating_vms = [ vmid for vmid, migration in self._ongoing_migrations.items() if (NOW - migration.timestamp_start) < config.config_vmca.MAX_MIGRATION_TIME ]
         if compare_hosts_info(h_info, self._hosts_info, ongoing_migrating_vms) != 0:        
             if self._migration_plan is not None:
-                _LOGGER.warning("things have changed, so we are cancelling the migration plan")
-                self._cancel()
+                excluded = set([ str(vmid) for vmid in ongoing_migrating_vms ])
+                moved = [ m for m in self._hosts_info.diff(h_info) if str(m.vmid) not in excluded ]
+                _LOGGER.debug("vms moved: %s" % ", ".join([ str(m) for m in moved ]))
+                if config.config_vmca.REPAIR_MIGRATION_PLAN:
+                    _LOGGER.info("things have changed, so we are repairing the migration plan")
+                    self._repair(h_info, moved)
+                else:
+                    _LOGGER.warning("things have changed, so we are cancelling the migration plan")
+                    self._cancel()
 
         self._hosts_info = h_info
         return self._purge_migrating_vms()
 
+    def _repair(self, hosts_info, moved):
+        '''
+        @description Repairs the pending migrations of the plan, according to the current hosts_info, after some VMs have been
+            moved outside of the plan (moved is the list of VMMigration obtained from HostsInfo.diff)
+
+        * only the migrations that involve the VMs or the hosts that have changed are revalidated; the rest of them are kept
+        * the migrations whose VM is no longer in the source host are discarded (they are not needed anymore)
+        * the migrations whose VM does not fit in the destination host are re-planned by means of the defragger that created
+          the plan (with the same policy about the empty hosts); if there is no other destination, the host cannot be emptied,
+          so all its pending migrations are discarded
+        '''
+        affected_vms = set([ str(m.vmid) for m in moved ])
+        affected_hosts = set([ h_id for m in moved for h_id in [ m.host_src, m.host_dst ] if h_id is not None ])
+        affected_hosts.update([ h_id for h_id in self._hosts_info.keys() if h_id not in hosts_info ])
+
+        # If a host is abandoned once some of its migrations have been accepted, the plan is repaired again from the beginning,
+        # discarding all the migrations of the abandoned hosts (each new pass abandons at least one more host)
+        abandoned_hosts = set()
+        while True:
+            repaired_plan, replanned, discarded, repeat = self._repair_pass(hosts_info, affected_vms, set(affected_hosts), abandoned_hosts)
+            if not repeat:
+                break
+
+        # The lists are modified in place, because the ongoing migrations keep a reference to the list from which they were taken
+        for migration_list, repaired_list in zip(self._migration_plan, repaired_plan):
+            migration_list[:] = repaired_list
+
+        _LOGGER.info("migration plan repaired: %d migrations re-planned and %d migrations discarded" % (replanned, discarded))
+
+    def _repair_pass(self, hosts_info, affected_vms, affected_hosts, abandoned_hosts):
+        '''
+        @description Simulates the pending migrations of the plan over hosts_info, discarding the migrations from the hosts in
+            abandoned_hosts (the set is updated with the hosts that are abandoned in this pass)
+        @return a tuple (repaired lists, number of re-planned migrations, number of discarded migrations, True if a host has
+            been abandoned after accepting some of its migrations, so the pass must be repeated)
+        '''
+        # The movements of the ongoing migrations are simulated, to take into account the resources that they will use
+        simulated_hosts_info = hosts_info.derive()
+        for migration in self._ongoing_migrations.values():
+            if (simulated_hosts_info.get_vm_location(migration.vmid) == migration.host_src) and (migration.host_dst in simulated_hosts_info):
+                simulated_hosts_info.make_movement(migration)
+
+        hosts_to_empty = set([ m.host_src for migration_list in self._migration_plan for m in migration_list ])
+        accepted_sources = set()
+        repeat = False
+        replanned = 0
+        discarded = 0
+        repaired_plan = []
+        for migration_list in self._migration_plan:
+            repaired_list = []
+            for migration in migration_list:
+                if migration.host_src in abandoned_hosts:
+                    discarded += 1
+                    continue
+
+                if (migration.host_src not in affected_hosts) and (migration.host_dst not in affected_hosts) and (str(migration.vmid) not in affected_vms):
+                    if simulated_hosts_info.make_movement(migration):
+                        repaired_list.append(migration)
+                        accepted_sources.add(migration.host_src)
+                        continue
+
+                vm = simulated_hosts_info.get_vm_byid(migration.vmid)
+                if (vm is None) or (simulated_hosts_info.get_vm_location(migration.vmid) != migration.host_src):
+                    _LOGGER.debug("discarding migration %s because the vm is no longer in the source host" % migration)
+                    discarded += 1
+                    continue
+
+                if (migration.host_dst not in simulated_hosts_info) or (not simulated_hosts_info[migration.host_dst].vm_can_fit(vm)):
+                    host_dst = None
+                    if self._defragger is not None:
+                        possible_destinations = [ h_id for h_id in self._defragger.prefilter_possible_destinations(simulated_hosts_info) if (h_id not in hosts_to_empty) or (h_id in abandoned_hosts) ]
+                        used_empty_hosts = self._defragger.can_use_empty_hosts_as_destination(self._can_use_empty_hosts)
+                        candidates = self._defragger.filter_destinations_for_vm(simulated_hosts_info, possible_destinations, vm)
+                        self._defragger.can_use_empty_hosts_as_destination(used_empty_hosts)
+                        host_dst = self._defragger.schedule_vm(simulated_hosts_info, candidates, vm)
+                    if host_dst is None:
+                        _LOGGER.debug("discarding the pending migrations from host %s because vm %s does not fit in other host" % (migration.host_src, migration.vmid))
+                        abandoned_hosts.add(migration.host_src)
+                        repeat = repeat or (migration.host_src in accepted_sources)
+                        discarded += 1
+                        continue
+                    migration = defragger.VMMigration(migration.vmid, migration.host_src, host_dst, migration.cost, migration.reward)
+                    # The migrations to the new destination must also be revalidated
+                    affected_hosts.add(host_dst)
+                    replanned += 1
+
+                simulated_hosts_info.make_movement(migration)
+                repaired_list.append(migration)
+                accepted_sources.add(migration.host_src)
+
+            repaired_plan.append(repaired_list)
+
+        return repaired_plan, replanned, discarded, repeat
+
     def update(self):
         self._lock.acquire()
         self._update_info()
@@ -246,8 +450,13 @@ class MigrationPlan():
         self._cancel()
         self._lock.release()
         
-    def start(self, migration_plan):
+    def start(self, migration_plan, defragger_used = None, can_use_empty_hosts = False):
         self._lock.acquire()
+        self._defragger = defragger_used
+        self._can_use_empty_hosts = can_use_empty_hosts
+        if self._network is not None:
+            # The migrations are sorted to minimize the time needed to execute the plan
+            migration_plan = network.MigrationScheduler_Bandwidth(self._network).reorder(migration_plan, self._hosts_info)
         self._migration_plan = migration_plan
         self._timestamp_start = None
         self._timestamp_end = 0
@@ -270,6 +479,69 @@ class MigrationPlan():
             return True
         return False
 
+    def _get_next_dispatchable_migration(self):
+        '''
+        @return a pair (migration, migration_list) with the next migration that can be started while the ongoing migrations
+            are still in progress, and the list of the plan from which it has been taken (or None if there is not any)
+
+        * the migrations of one migration list do not depend on each other, but they may depend on the migrations of the
+          previous lists (see network.migration_depends_on), so a migration is not started while any migration of the previous
+          lists on which it depends is pending or ongoing
+        * the number of simultaneous migrations from or to a host is limited by MAX_SIMULTANEOUS_MIGRATIONS_PER_HOST
+        * if there is a model of the network, the migrations that would oversubscribe any link are not started
+        '''
+        if self._migration_plan is None:
+            return None
+
+        list_index = dict([ (id(ml), i) for i, ml in enumerate(self._migration_plan) ])
+
+        migrations_per_host = {}
+        links_usage = None
+        if self._network is not None:
+            links_usage = network.LinksUsage(self._network)
+        for vmid, migration in self._ongoing_migrations.items():
+            for h_id in [ migration.host_src, migration.host_dst ]:
+                migrations_per_host[h_id] = migrations_per_host.get(h_id, 0) + 1
+            if links_usage is not None:
+                links_usage.add(migration.host_src, migration.host_dst)
+
+        max_per_host = config.config_vmca.MAX_SIMULTANEOUS_MIGRATIONS_PER_HOST
+        previous_pending = []
+        for i, migration_list in enumerate(self._migration_plan):
+            # The ongoing migrations that were taken from previous lists (the lists that have been emptied are no longer in the plan)
+            previous_ongoing = [ m for m in self._ongoing_migrations.values() if list_index.get(id(m.migration_list), -1) < i ]
+            for migration in migration_list:
+                if len([ m for m in previous_pending + previous_ongoing if network.migration_depends_on(migration, m) ]) > 0:
+                    continue
+                if max_per_host > 0:
+                    if (migrations_per_host.get(migration.host_src, 0) >= max_per_host) or (migrations_per_host.get(migration.host_dst, 0) >= max_per_host):
+                        continue
+                if (links_usage is not None) and (len(self._ongoing_migrations) > 0) and (not links_usage.fits(migration.host_src, migration.host_dst)):
+                    continue
+                migration_list.remove(migration)
+                return migration, migration_list
+            previous_pending.extend(migration_list)
+        return None
+
+    def _migrate_next_vms(self):
+        '''
+        @description Starts as many migrations as possible, according to MAX_SIMULTANEOUS_MIGRATIONS and the dependencies
+            between the migrations
+        @return False if the migration plan has been cancelled because some migration could not be started
+        '''
+        while len(self._ongoing_migrations) < config.config_vmca.MAX_SIMULTANEOUS_MIGRATIONS:
+            next_dispatchable = self._get_next_dispatchable_migration()
+            if next_dispatchable is None:
+                break
+
+            next_migration, migration_list = next_dispatchable
+            _LOGGER.info("will migrate %s" % next_migration)
+            if not self._make_migration(next_migration, migration_list):
+                self._cancel()
+                _LOGGER.warning("cancelling migration plan because migration %s could not be done" % next_migration)
+                return False
+        return True
+
     def _program_event(self, next_program = None):
         if self._pending_migrations() or (len(self._ongoing_migrations) > 0):
             if self._migration_event is None:
@@ -301,15 +573,10 @@ class MigrationPlan():
         for vmid, migration in self._ongoing_migrations.items():
             # Let's check if the migration has been finally carried out
             h_dst = migration.host_dst
-            if h_dst in self._hosts_info.keys():
-                h = self._hosts_info[h_dst]
-                migration_done = False
-                for vm in h.vm_list:
-                    if (vm.id == migration.vmid) and (vm.state == defragger.VMData.STATE_RUNNING):
-                        migration_done = True
-                        _LOGGER.debug("vm %s is finally running in host %s" % (vm.id, h_dst))
-                        break
-                if migration_done:
+            if h_dst in self._hosts_info:
+                vm = self._hosts_info[h_dst].get_vm_byid(migration.vmid)
+                if (vm is not None) and (vm.id == migration.vmid) and (vm.state == defragger.VMData.STATE_RUNNING):
+                    _LOGGER.debug("vm %s is finally running in host %s" % (vm.id, h_dst))
                     continue
             else:
                 # The host is not in the hosts info structure, so we cannot check it
@@ -355,12 +622,6 @@ class MigrationPlan():
             self._lock.release()
             return
         
-        if config.config_vmca.MAX_SIMULTANEOUS_MIGRATIONS > 1:
-            # TODO: give support
-            _LOGGER.error("there is no support for more than one migration at once, now")
-            self._lock.release()
-            raise Exception("there is no support for more than one migration at once, now")
-
         if len(self._ongoing_migrations) >= config.config_vmca.MAX_SIMULTANEOUS_MIGRATIONS:
             _LOGGER.debug("still migrating some VMs")
             self._program_event()
@@ -376,7 +637,10 @@ class MigrationPlan():
         #    return
    
         if self._pending_migrations():
-            self._migrate_next_vm()
+            if config.config_vmca.MAX_SIMULTANEOUS_MIGRATIONS > 1:
+                self._migrate_next_vms()
+            else:
+                self._migrate_next_vm()
 
         self._program_event()        
         self._lock.release()
@@ -397,51 +661,69 @@ class Daemon(object):
         self._lock = threading.Lock()
         # self._migration_plan = None
             
+    def _get_hosts_info_to_read(self):
+        # The readers use the latest snapshot of the monitoring info (without waiting for the monitorization), unless there is not any
+        snapshot = self._monitor.get_snapshot()
+        if snapshot.hosts_info is None:
+            snapshot = self._monitor.monitor_snapshot()
+            if snapshot is None:
+                return None
+        return snapshot.hosts_info
+
     def dump_data(self):
-        self._lock.acquire()
-        hosts_str = ""
-        hosts_i = self._monitor.monitor()
+        hosts_i = self._get_hosts_info_to_read()
         if hosts_i is None:
-            self._lock.release()
             return "None"
-	hosts_i.normalize_resources()
+
+        # The snapshot must not be modified, so the normalization is made on a new version
+        hosts_i = hosts_i.derive()
+        hosts_i.normalize_resources()
         
+        lines = [ "\nhostsinfo:\n" + "-"*80 + "\n" ]
         for h_id, h in hosts_i.items():
-            vm_str = ""
+            lines.append("%s\n" % str(h))
             for vm in h.vm_list:
-                vm_str = "%s\t%s\n" % (vm_str, str(vm))
-            
-            h_line = "%s\n%s" % (str(h), vm_str)
-            hosts_str = "%s%s\n" % (hosts_str, h_line)
-        
-        retval = "hostsinfo:\n" + "-"*80 + "\n%s" % (hosts_str)
+                lines.append("\t%s\n" % str(vm))
+            lines.append("\n")
         
-        retval = "\n%sfailed migrations:\n%s" % (retval, "-"*80)
+        lines.append("failed migrations:\n%s" % ("-"*80))
         for vmid, movement in self._migration_plan.get_failed_migrations().items():
-            retval = "%s\n%s" % (retval, movement)
+            lines.append("\n%s" % movement)
         
-        self._lock.release()
-        return retval
-
-    def dump_csv(self):
-        self._lock.acquire()
-        hosts_str = ""
-        hosts_i = self._monitor.monitor()
+        return "".join(lines)
+
+    def dump_csv(self, compressed = False):
+        '''
+        @param compressed if True, the CSV is compressed with gzip while it is generated (the result is binary data)
+        '''
+        hosts_i = self._get_hosts_info_to_read()
+        if not compressed:
+            if hosts_i is None:
+                return "None"
+            return hosts_i.csv()
+
+        buf = StringIO.StringIO()
+        f = gzip.GzipFile(fileobj = buf, mode = "wb")
         if hosts_i is None:
-            self._lock.release()
-            return "None"
-
-        retval = hosts_i.csv()
-        self._lock.release()
-        return retval
+            f.write("None")
+        else:
+            hosts_i.write_csv(f)
+        f.close()
+        return buf.getvalue()
         
     def defrag(self, estabilize_vms = False):
         if self._migration_plan.is_alive():
             _LOGGER.debug("migration plan is still alive... we'll skip defragging")
             return
 
+        # The whole cycle is profiled with cProfile if a capture has been requested (see get_stats)
+        with profiling.span("defrag"):
+            profiling.run_cycle(self._defrag, estabilize_vms)
+
+    def _defrag(self, estabilize_vms):
         self._lock.acquire()
-        new_hosts_info = self._monitor.monitor()
+        with profiling.span("defrag.monitor"):
+            new_hosts_info = self._monitor.monitor()
         if new_hosts_info is None:
             _LOGGER.error("could not get information about the deployment... skipping defraggging")
             self._lock.release()
@@ -463,12 +745,22 @@ class Daemon(object):
             # _LOGGER.debug("applying the spare threshold: CPU: %s or %s%%, MEM: %s or %s%%" % (config.config_vmca.SPARE_CPU, config.config_vmca.SPARE_CPU_PCT, config.config_vmca.SPARE_MEMORY, config.config_vmca.SPARE_MEMORY_PCT))
             new_hosts_info.reduce_capacity(config.config_vmca.SPARE_CPU, config.config_vmca.SPARE_MEMORY, config.config_vmca.SPARE_CPU_PCT, config.config_vmca.SPARE_MEMORY_PCT)
         
-        new_migration_plan = self._defragger_periodical.defrag(new_hosts_info, hosts_fixed = locked_hosts, fixed_vms = failed_vms + self._deployment.get_locked_vms())
+        # The defragger must not take longer than the period between calls, so it has a time budget
+        time_budget = config.config_vmca.DEFRAGGER_TIME_BUDGET
+        if time_budget <= 0:
+            time_budget = config.config_vmca.DEFRAGGER_FREQUENCY
+        previous_time_budget = self._defragger_periodical.set_time_budget(time_budget)
+        with profiling.span("defrag.defragger"):
+            new_migration_plan = self._defragger_periodical.defrag(new_hosts_info, hosts_fixed = locked_hosts, fixed_vms = failed_vms + self._deployment.get_locked_vms())
+        self._defragger_periodical.set_time_budget(previous_time_budget)
+        if not self._defragger_periodical.converged():
+            _LOGGER.warning("the defragger did not finish in %.1f seconds, so we are using the best migration plan found" % time_budget)
     
         if (new_migration_plan is None) or (len(new_migration_plan) == 0):
             _LOGGER.debug("nothing to migrate")
         else:
-            self._migration_plan.start(new_migration_plan)
+            with profiling.span("defrag.start_plan"):
+                self._migration_plan.start(new_migration_plan, self._defragger_periodical)
             # self._start_migration_plan(new_migration_plan)
                 
         self._lock.release()
@@ -501,7 +793,7 @@ class Daemon(object):
             retval = "nothing to migrate"
         else:
             self._migration_plan.cancel()
-            self._migration_plan.start(new_migration_plan)
+            self._migration_plan.start(new_migration_plan, defragger_to_use, can_use_empty_hosts)
             retval = "migration plan created\n%s" % str(self._migration_plan)
 
         self._lock.release()
@@ -544,7 +836,7 @@ class Daemon(object):
             retval = "nothing to migrate"
         else:
             self._migration_plan.cancel()
-            self._migration_plan.start(new_migration_plan)
+            self._migration_plan.start(new_migration_plan, self._defragger_clean, can_use_empty_hosts)
             retval = "migration plan created\n%s" % str(self._migration_plan)
 
         self._lock.release()
@@ -554,6 +846,21 @@ class Daemon(object):
         _LOGGER.info("forcing defrag...")
         self.defrag(estabilize_vms)
 
+    def get_stats(self, profile = False, reset = False):
+        '''
+        @description Obtains the timing of the phases of the defrag cycle and the counters of the hot operations
+        @param profile if True, the next defrag cycle is captured with cProfile (the capture is included in the
+            following calls)
+        @param reset if True, the spans and the counters are reset once they have been reported
+        @return the text of the report
+        '''
+        if profile:
+            profiling.request_profile()
+        retval = profiling.report()
+        if reset:
+            profiling.reset()
+        return retval
+
     def get_migration_plan(self):
         self._lock.acquire()
         retval = str(self._migration_plan)
@@ -562,6 +869,8 @@ class Daemon(object):
         
     def loop(self):
         cpyutils.eventloop.create_eventloop(True)
+        if config.config_vmca.MONITORING_FREQUENCY > 0:
+            self._monitor.start_monitoring(config.config_vmca.MONITORING_FREQUENCY)
         if config.config_vmca.ENABLE_DEFRAGGER:
             # cpyutils.eventloop.get_eventloop().add_periodical_event(config.config_vmca.DEFRAGGER_FREQUENCY, -config.config_vmca.DEFRAGGER_FREQUENCY, "defrag", callback = self.defrag, arguments = [], stealth = True)
             cpyutils.eventloop.get_eventloop().add_event(cpyutils.eventloop.Event_Periodical(0, config.config_vmca.DEFRAGGER_FREQUENCY, description = "defrag", callback = self.defrag, mute = True))